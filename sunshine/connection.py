@@ -77,6 +77,23 @@ if ssl_support == False:
 else:
     logger.info('Using SSL-like connection.')
 
+# where to ask for the address of a server - lqsoft.pygadu.fake_server
+# serves a local one
+DEFAULT_APPMSG_URL = 'http://appmsg.gadu-gadu.pl/appsvc/appmsg_ver10.asp'
+APPMSG_URL = os.environ.get('SUNSHINE_APPMSG_URL', DEFAULT_APPMSG_URL)
+GG_PORT = 8074
+
+def appmsg_port(fields):
+    """The port in the host:port field of an appmsg reply. Only an endpoint
+        set with SUNSHINE_APPMSG_URL chooses it - Gadu-Gadu servers are
+        always at GG_PORT, as is any port that isn't valid."""
+    if APPMSG_URL == DEFAULT_APPMSG_URL or len(fields) < 3:
+        return GG_PORT
+    port = fields[2].partition(':')[2]
+    if port.isdigit() and 0 < int(port) < 65536:
+        return int(port)
+    return GG_PORT
+
 class GaduClientFactory(protocol.ClientFactory):
     def __init__(self, config):
         self.config = config
@@ -394,7 +411,7 @@ class SunshineConnection(telepathy.server.Connection,
 
     def getServerAdress(self, uin):
         logger.info("Fetching GG server adress.")
-        url = 'http://appmsg.gadu-gadu.pl/appsvc/appmsg_ver10.asp?fmnumber=%s&lastmsg=0&version=10.1.1.11119' % (str(uin))
+        url = '%s?fmnumber=%s&lastmsg=0&version=10.1.1.11119' % (APPMSG_URL, str(uin))
         d = getPage(url, timeout=10)
         d.addCallback(self.on_server_adress_fetched, uin)
         d.addErrback(self.on_server_adress_fetched_failed, uin)
@@ -418,7 +435,7 @@ class SunshineConnection(telepathy.server.Connection,
                     port = 443
                     self.makeConnection(addr, port)
                 else:
-                    port = 8074
+                    port = appmsg_port(a)
                     self.makeConnection(addr, port)
             else:
                 raise Exception()
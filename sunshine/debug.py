@@ -16,6 +16,8 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import logging
+
 import telepathy
 
 class SunshineDebug(telepathy.server.Debug):
@@ -35,3 +37,10 @@ class SunshineDebug(telepathy.server.Debug):
             category = name
         name = domain.lower() + "/" + category.lower()
         return name
+
+cstruct_logger = logging.getLogger('Sunshine.CStruct')
+
+def cstruct_trace_hook(event):
+    """CStruct trace hook forwarding unpacked fields to the debug interface"""
+    cstruct_logger.debug("%s.%s @%d = %r (%.1f us)" % (event.klass.__name__, \
+        event.field.name, event.offset, event.value, event.elapsed * 1e6))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+__doc__ = """Source builder for the specialised pack/unpack functions of CStruct
+classes. MetaStruct asks every item of a class layout to emit its part
+of the function and the result is compiled with exec - just like
+namedtuple does it."""
+
+import keyword
+
+class SourceBuilder(object):
+
+    def __init__(self, func_name, args, struct_name):
+        self.func_name = func_name
+        self.struct_name = struct_name
+        self.header = 'def %s(%s):' % (func_name, args)
+        self.namespace = {}
+        self.__bound = {}
+        self.prologue = []
+        self.lines = []
+        self.level = 1
+        self.__counter = 0
+
+    def bind(self, value, hint='c'):
+        """Make the value available to generated code, returns its name"""
+        try:
+            return self.__bound[id(value)]
+        except KeyError:
+            pass
+        name = '_%s%d' % (hint, self.__counter)
+        self.__counter += 1
+        self.namespace[name] = value
+        self.__bound[id(value)] = name
+        return name
+
+    def local(self, hint='v'):
+        """A fresh local variable name"""
+        name = '%s%d' % (hint, self.__counter)
+        self.__counter += 1
+        return name
+
+    def attr(self, obj, name):
+        """Attribute access expression, safe for any field name"""
+        if keyword.iskeyword(name):
+            return 'getattr(%s, %r)' % (obj, name)
+        return '%s.%s' % (obj, name)
+
+    def require(self, line):
+        """Add a line to the function prologue (only once)"""
+        if line not in self.prologue:
+            self.prologue.append(line)
+
+    def emit(self, line):
+        self.lines.append('    ' * self.level + line)
+
+    def indent(self):
+        self.level += 1
+
+    def dedent(self):
+        self.level -= 1
+
+    def source(self):
+        body = ['    ' + line for line in self.prologue] + self.lines
+        return '\n'.join([self.header] + body) + '\n'
+
+    def build(self):
+        src = self.source()
+        code = compile(src, '<cstruct %s.%s>' % (self.struct_name, self.func_name), 'exec')
+        exec code in self.namespace
+        func = self.namespace[self.func_name]
+        func.source = src
+        return func
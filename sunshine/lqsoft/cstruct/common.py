@@ -5,11 +5,120 @@ __author__="lreqc"
 __date__ ="$2009-07-19 07:48:34$"
 
 import sunshine.lqsoft.cstruct.constraints as const
-import struct,sys
+from sunshine.lqsoft.cstruct.codegen import SourceBuilder
+import struct,sys,weakref
+from collections import namedtuple
+from operator import attrgetter
+from timeit import default_timer
 
 def log(msg):
     sys.stderr.write(msg+'\n')
 
+#
+# Tracing - disabled by default. When a hook is installed, all CStruct
+# classes unpack through the interpreted implementation, which reports
+# every unpacked field to the hook.
+#
+TraceEvent = namedtuple('TraceEvent', 'klass field offset value elapsed')
+
+_trace_hook = None
+
+def set_trace_hook(hook):
+    """Install a callable receiving a TraceEvent for every unpacked field.
+        Pass None to disable tracing."""
+    global _trace_hook
+    _trace_hook = hook
+    for klass in list(MetaStruct.registry):
+        MetaStruct.install_engine(klass)
+
+def get_trace_hook():
+    return _trace_hook
+
+#
+# Engines - classes (un)pack with the functions generated for their layout
+# ('fast', the default) or with the interpreted implementation of the
+# fields and constraints ('reference'). Both give the same bytes and values.
+# A class can pick its engine with the engine attribute, the others use
+# the one set with set_engine().
+#
+ENGINES = ('fast', 'reference')
+
+_engine = 'fast'
+
+def set_engine(name):
+    """Select the engine of all CStruct classes without their own"""
+    global _engine
+    if name not in ENGINES:
+        raise ValueError("Unknown engine %r, expected one of: %s" % (name, ', '.join(ENGINES)))
+    _engine = name
+    for klass in list(MetaStruct.registry):
+        MetaStruct.install_engine(klass)
+
+def get_engine():
+    return _engine
+
+#
+# Buffer helpers - unpacking works on any object supporting the buffer
+# protocol (str, memoryview, bytearray, mmap), bytes are only copied
+# out of it for string fields.
+#
+def buffer_bytes(chunk):
+    """Convert a slice of a buffer into a byte string"""
+    if isinstance(chunk, str):
+        return chunk
+    if isinstance(chunk, memoryview):
+        return chunk.tobytes()
+    return str(chunk)
+
+def buffer_find(data, sub, start, end, step=512):
+    """Like str.find(), but for any buffer type"""
+    try:
+        return data.find(sub, start, end)
+    except AttributeError:
+        pass
+    # memoryview and buffer have no find() - scan them in chunks
+    pos = start
+    while pos < end:
+        chunk = buffer_bytes(data[pos:min(pos + step + len(sub) - 1, end)])
+        found = chunk.find(sub)
+        if found >= 0:
+            return pos + found
+        pos += step
+    return -1
+
+def buffer_reserve(buf, end):
+    """Grow the bytearray buf with zeros, so that it holds at least end bytes"""
+    missing = end - len(buf)
+    if missing > 0:
+        buf.extend('\0' * missing)
+
+def class_attribute(klass, name):
+    """The attribute name from the __dict__ of klass or its first base
+        that has it - unlike getattr(), without binding it"""
+    for base in klass.__mro__:
+        if name in base.__dict__:
+            return base.__dict__[name]
+    raise AttributeError(name)
+
+#
+# Struct cache - formats of variable-size fields (like '<12s') are compiled
+# once and shared. The cache is dropped when it grows over STRUCT_CACHE_SIZE,
+# so lengths coming from the data can't make it grow without bounds.
+#
+STRUCT_CACHE_SIZE = 256
+
+_struct_cache = {}
+
+def struct_for(fmt):
+    """A (shared) struct.Struct of the format string fmt"""
+    try:
+        return _struct_cache[fmt]
+    except KeyError:
+        if len(_struct_cache) >= STRUCT_CACHE_SIZE:
+            _struct_cache.clear()
+        compiled = _struct_cache[fmt] = struct.Struct(fmt)
+        return compiled
+
 
 class ICField(object):
 
@@ -22,7 +131,7 @@ class ICField(object):
     def pack(self, obj, offset, **opts):
         pass
 
-    def unpack(self, obj, data, pos):
+    def unpack(self, obj, data, pos, end=None, trusted=False):
         pass
 
     def get_value(self, obj, current_value):
@@ -92,7 +201,7 @@ class CField(ICField):
         for c in reversed(self.constraints):
             c.before_pack(opts)
 
-        return struct.calcsize(self._format_string(opts))
+        return self._packed_size(opts)
         
     def pack(self, obj, offset, **opts):
         """Pack the field into a byte array"""
@@ -105,15 +214,19 @@ class CField(ICField):
         for c in reversed(self.constraints):
             c.pack(opts)
 
-        return struct.pack( self._format_string(opts), value)
+        return self._format_struct(opts).pack(value)
 
-    def unpack(self, obj, data, pos):
-        """Unpack the given byte buffer into this field, starting at pos"""
+    def unpack(self, obj, data, pos, end=None, trusted=False):
+        """Unpack the given byte buffer into this field, starting at pos.
+            Data after end (by default - the end of buffer) is not used.
+            Nested structures are built without validation, if trusted."""
         # before we unpack we need to check things like:
         #  * is the field at given offset ? (yes, this always comes first)
         #  * does the field prefix match ?
         #  * any other stuff the user wants to check
-        opts = {'obj': obj, 'data': data, 'offset': pos}
+        if end is None:
+            end = len(data)
+        opts = {'obj': obj, 'data': data, 'offset': pos, 'end': end, 'trusted': trusted}
         self._before_unpack(opts)
         
         if not opts.get('__ommit', False):
@@ -125,16 +238,192 @@ class CField(ICField):
         """The format string for the default retrieval method"""
         return ''
 
+    def _format_struct(self, opts):
+        """The compiled _format_string(opts)"""
+        return struct_for(self._format_string(opts))
+
+    def _packed_size(self, opts):
+        """Size of the value in opts, after the constraints ran"""
+        return self._format_struct(opts).size
+
+    def fixed_format(self):
+        """Struct format (without byte order) of the field, if it has a fixed
+            size and no constraints that need to be checked during (un)packing.
+            Such fields can be merged into a single CompiledRun. Returns None
+            otherwise."""
+        return None
+
+    def static_size(self):
+        """Packed size of the field, if it never changes, None otherwise"""
+        fmt = self.fixed_format()
+        if fmt is None:
+            return None
+        return struct_for('<' + fmt).size
+
+    def _is_plain(self):
+        """True if no constraint has to run when the field is (un)packed."""
+        if self.nullable:
+            return False
+        for c in self.constraints:
+            if isinstance(c, (const.OffsetConstraint, const.PrefixConstraint)):
+                return False
+        return True
+
+    def _reads_to_end(self):
+        """True if the extent of the field can depend on where the data
+            ends - such fields can't be unpacked from a partial buffer."""
+        if self.nullable:
+            return True
+        length = self._length_constraint()
+        return length is not None and length.length == -1
+
+    def _streamable(self):
+        """True if the field can be handed to a consumer in chunks, when
+            it ends a struct decoded by a StreamDecoder."""
+        return False
+
     def _retrieve_value(self, opts):
         #print opts
-        fmt = self._format_string(opts)
-        fmt_len = struct.calcsize(fmt)
-        v = struct.unpack_from(fmt, opts['data'], opts['offset'])
-        return (v, opts['offset'] + fmt_len)
+        fmt = self._format_struct(opts)
+        v = fmt.unpack_from(opts['data'], opts['offset'])
+        return (v, opts['offset'] + fmt.size)
+
+    # code generation - the generated functions are equivalent
+    # to the interpreted before_pack()/pack()/unpack() calls
+    GEN_CONSTRAINTS = (const.OffsetConstraint, const.PrefixConstraint, \
+        const.ValueTypeConstraint, const.NumericBounds, const.LengthConstraint)
+
+    _gen_retrieve = None
+    _gen_write = None
+
+    def _gen_inlinable(self):
+        """Can generated code handle the constraints of this field ?"""
+        prefixes = 0
+        for c in self.constraints:
+            if not isinstance(c, self.GEN_CONSTRAINTS):
+                return False
+            if isinstance(c, const.OffsetConstraint) and not isinstance(c.offset, str):
+                return False
+            if isinstance(c, const.PrefixConstraint):
+                prefixes += 1
+        return prefixes <= 1 and self.ommit in ([], ['prefix'])
+
+    def _gen_inline_unpack(self):
+        return self._gen_retrieve is not None and self._gen_inlinable()
+
+    def _gen_inline_pack(self):
+        return self._gen_write is not None and self._gen_inlinable()
+
+    def _length_constraint(self, opt_name='length'):
+        for c in self.constraints:
+            if isinstance(c, const.LengthConstraint) and c._opt_name == opt_name:
+                return c
+        return None
+
+    def _gen_length(self, gen, constr, var):
+        """Emit code computing the length given by constr into var"""
+        length = constr.length
+        if isinstance(length, property):
+            gen.needs_scope = True
+            gen.emit("%s = %s.__get__({'obj': d, 'data': data, 'offset': offset, 'end': end, 'trusted': trusted})" \
+                % (var, gen.bind(length, 'length')))
+        elif isinstance(length, str):
+            gen.emit('%s = d[%r]' % (var, length))
+        else:
+            gen.emit('%s = %d' % (var, length))
+
+    def gen_unpack(self, gen):
+        """Emit code that unpacks the field into d[name] and advances offset"""
+        if not self._gen_inline_unpack():
+            gen.needs_scope = True
+            gen.emit('d[%r], offset = %s.unpack(d, data, offset, end, trusted)' \
+                % (self.name, gen.bind(self, 'field')))
+            return
+
+        prefix = None
+        for c in self.constraints:
+            if isinstance(c, const.PrefixConstraint):
+                prefix = c
+                gen.emit('if %s.match(data, offset, end):' % gen.bind(c, 'prefix'))
+                gen.indent()
+
+        self._gen_retrieve(gen)
+
+        if prefix is not None:
+            gen.dedent()
+            gen.emit('else:')
+            gen.indent()
+            if self.nullable:
+                gen.emit('d[%r] = None' % self.name)
+            else:
+                gen.emit('raise %s(%r, %s)' % (gen.bind(UnpackException, 'UnpackException'), \
+                    'Data buffer failed to satisfy constraint: ' + str(prefix), gen.bind(prefix, 'prefix')))
+            gen.dedent()
+
+    def gen_before_pack(self, gen):
+        """Emit the pack dry-run for this field, advancing offset"""
+        if not self._gen_inline_pack():
+            gen.emit('offset += %s.before_pack(self, offset)' % gen.bind(self, 'field'))
+            return
+
+        value = gen.local('value')
+        gen.emit('%s = %s' % (value, gen.attr('self', self.name)))
+        if self.nullable:
+            gen.emit('if %s is not None:' % value)
+            gen.indent()
+        for c in self.constraints:
+            if isinstance(c, const.OffsetConstraint):
+                gen.emit('setattr(self, %r, offset)' % c.offset)
+        self._gen_size(gen, value)
+        if self.nullable:
+            gen.dedent()
+
+    def gen_pack_into(self, gen):
+        """Emit code writing the field into buf at pos, advancing pos.
+            Offset and length fields written before are patched in place."""
+        gen_record(gen, self.name, 'pos')
+        if not self._gen_inline_pack():
+            field, data = gen.bind(self, 'field'), gen.local('data')
+            gen.emit('%s.before_pack(self, pos - base)' % field)
+            for c in self.constraints:
+                if isinstance(c, const.OffsetConstraint) and isinstance(c.offset, str):
+                    gen_patch(gen, c.offset, gen.attr('self', c.offset))
+            gen.emit('%s = %s.pack(self, pos - base)' % (data, field))
+            gen.emit('buf[pos:pos + len(%s)] = %s' % (data, data))
+            gen.emit('pos += len(%s)' % data)
+            return
+
+        value = gen.local('value')
+        gen.emit('%s = %s' % (value, gen.attr('self', self.name)))
+        if self.nullable:
+            gen.emit('if %s is not None:' % value)
+            gen.indent()
+        for c in self.constraints:
+            if isinstance(c, const.OffsetConstraint):
+                gen.emit('setattr(self, %r, pos - base)' % c.offset)
+                gen_patch(gen, c.offset, 'pos - base')
+        self._gen_write(gen, value)
+
+        length = self._length_constraint()
+        if length is not None and isinstance(length.length, str):
+            # the value could have been resized after it was set
+            n = gen.local('n')
+            gen.emit('%s = len(%s)' % (n, value))
+            gen.emit('if %s != %s:' % (n, gen.attr('self', length.length)))
+            gen.indent()
+            gen.emit('setattr(self, %r, %s)' % (length.length, n))
+            gen_patch(gen, length.length, n)
+            gen.dedent()
+        if self.nullable:
+            gen.dedent()
 
     def get_value(self, obj, current_value):
         return current_value
 
+    def trusted_value(self, obj, value):
+        """Like set_value(), but for values known to be valid (unpacked ones)"""
+        return value
+
     def set_value(self, obj, new_value):
         # enable niling the field
         if (new_value == None) and self.nullable:
@@ -152,24 +441,75 @@ class CField(ICField):
     def __str__(self):
         return str(self.name)
 
+#
+# Single pass packing - the generated _pack_into() remembers where the
+# fields holding offsets and lengths of other fields were written, so
+# they can be patched once the real values are known.
+#
+def pack_targets(order):
+    """Map names of the numeric fields other fields refer to (by offset
+        or length) to the struct.Struct used to rewrite them."""
+    fields = dict( (field.name, field) for field in order )
+    targets = {}
+    for field in order:
+        for c in field.constraints:
+            if isinstance(c, const.OffsetConstraint):
+                name = c.offset
+            elif isinstance(c, const.LengthConstraint):
+                name = c.length
+            else:
+                continue
+            target = fields.get(name) if isinstance(name, str) else None
+            if target is not None and not target.nullable \
+                    and getattr(target, 'format_struct', None) is not None:
+                targets[name] = target.format_struct
+    return targets
+
+def gen_record(gen, name, pos):
+    """Emit code remembering the position of field name, if it is a target"""
+    if name in gen.targets:
+        var = gen.local('p')
+        gen.emit('%s = %s' % (var, pos))
+        gen.positions[name] = var
+
+def gen_patch(gen, name, value):
+    """Emit code rewriting the already written field name with value"""
+    var = gen.positions.get(name)
+    if var is not None:
+        gen.emit('%s.pack_into(buf, %s, %s)' % (gen.bind(gen.targets[name], 'num'), var, value))
+
 class MetaStruct(type):
+    registry = weakref.WeakSet()
+
     def __new__(cls, name, bases, cdict):
         fields = []
         #internal_dict = {}
         ndict = {}
         # log('Constructing class: ' + name)
+        compact = cdict.get('compact', any(getattr(base, 'compact', False) for base in bases))
 
         for (field_name, field_value) in cdict.iteritems():
             if isinstance(field_value, CField):
                 field_value.name = field_name
                 fields.append(field_value)
                 #internal_dict[field_name] = field_value
-                ndict[field_name] = property( \
-                    MetaStruct.getter_for(field_value), \
-                    MetaStruct.setter_for(field_value) )
+                if compact:
+                    getter = MetaStruct.compact_getter_for(field_value)
+                else:
+                    getter = MetaStruct.getter_for(field_value)
+                ndict[field_name] = property(getter, MetaStruct.setter_for(field_value))
             else:
                 ndict[field_name] = field_value
 
+        if compact and '__slots__' not in cdict:
+            # values live in slots, there is no instance __dict__ (if the
+            # bases have none too); lazy loading moves to __getattr__
+            slots = ['_' + field.name for field in fields]
+            if not any(hasattr(base, '_lazy_state') for base in bases):
+                slots.append('_lazy_state')
+            ndict['__slots__'] = tuple(slots)
+            ndict.setdefault('__getattr__', compact_getattr)
+
         klass = type.__new__(cls, name, bases, ndict)
 
         #old_dict = getattr(klass, '_internal', {})
@@ -181,15 +521,156 @@ class MetaStruct(type):
         order = getattr(klass, '_field_order', [])
         order = order + fields
         setattr(klass, '_field_order', order)
+        setattr(klass, '_layout', MetaStruct.compile_layout(order))
+        setattr(klass, '_static_size', MetaStruct.layout_size(klass._layout))
+
+        unpack, before_pack, pack_into = MetaStruct.compile_functions(klass)
+        setattr(klass, '_unpack_items', MetaStruct.compile_item_functions(klass))
+        setattr(klass, '_layout_index', dict( (field.name, index) \
+            for (index, item) in enumerate(klass._layout) for field in item_fields(item) ))
+
+        # functions the class defines itself are never replaced
+        generated = {'unpack': classmethod(unpack), \
+            '_before_pack': before_pack, '_pack_into': pack_into}
+        setattr(klass, '_generated', dict( (name, function) \
+            for (name, function) in generated.iteritems() if name not in cdict ))
+        MetaStruct.install_engine(klass)
+        MetaStruct.registry.add(klass)
         return klass
 
+    @staticmethod
+    def compile_layout(order):
+        """Merge runs of consecutive fixed-size fields into CompiledRuns.
+            Returns a list of CompiledRun and CField items, in field order."""
+        layout = []
+        run = []
+        for field in order:
+            if field.fixed_format() is not None:
+                run.append(field)
+                continue
+            if run:
+                layout.append(CompiledRun(run))
+                run = []
+            layout.append(field)
+        if run:
+            layout.append(CompiledRun(run))
+        return layout
+
+    @staticmethod
+    def layout_size(layout):
+        """Total size of the layout items, None if any has a variable size"""
+        size = 0
+        for item in layout:
+            if isinstance(item, CompiledRun):
+                size += item.size
+                continue
+            item_size = item.static_size()
+            if item_size is None:
+                return None
+            size += item_size
+        return size
+
+    # the interpreted counterparts of the generated functions
+    REFERENCE = {
+        'unpack': 'unpack_reference',
+        '_before_pack': '_before_pack_reference',
+        '_pack_into': '_pack_into_reference',
+    }
+
+    @staticmethod
+    def install_engine(klass):
+        """Install the generated or the reference functions of klass,
+            depending on its engine. Tracing needs the reference unpack."""
+        engine = klass.engine or _engine
+        for (name, function) in klass._generated.iteritems():
+            if engine == 'reference' or (name == 'unpack' and _trace_hook is not None):
+                function = class_attribute(klass, MetaStruct.REFERENCE[name])
+            setattr(klass, name, function)
+
+    @staticmethod
+    def compile_functions(klass):
+        """Generate the unpack(), _before_pack() and _pack_into() functions
+            specialised for the layout of klass."""
+        name = klass.__name__
+
+        gen = SourceBuilder('unpack', 'cls, data, offset=0, end=None, trusted=None', name)
+        gen.require('if end is None:')
+        gen.require('    end = len(data)')
+        gen.require('if trusted is None:')
+        gen.require('    trusted = cls.trusted_decode')
+        gen.needs_scope = False
+        for item in klass._layout:
+            item.gen_unpack(gen)
+        # a plain dict, unless some field reads the values unpacked before it
+        if gen.needs_scope:
+            gen.require('d = %s()' % gen.bind(FieldScope, 'FieldScope'))
+        else:
+            gen.require('d = {}')
+        gen.emit('if offset > end:')
+        gen.emit('    raise %s("unpack requires a buffer of %%d bytes" %% (offset - end))' \
+            % gen.bind(struct.error, 'error'))
+        gen.emit('if trusted:')
+        gen.indent()
+        gen.emit('obj = %s(cls)' % gen.bind(object.__new__, 'new'))
+        for field in klass._field_order:
+            if field.trusted_value.im_func is CField.trusted_value.im_func:
+                gen.emit('obj._%s = d[%r]' % (field.name, field.name))
+            else:
+                gen.emit('obj._%s = %s.trusted_value(obj, d[%r])' \
+                    % (field.name, gen.bind(field, 'field'), field.name))
+        gen.emit('return obj, offset')
+        gen.dedent()
+        gen.emit('return cls(**d), offset')
+        unpack = gen.build()
+
+        gen = SourceBuilder('_before_pack', 'self, offset=0', name)
+        for item in klass._layout:
+            item.gen_before_pack(gen)
+        gen.emit('return offset')
+        before_pack = gen.build()
+
+        # buf is a bytearray and pos <= len(buf) always holds, so slice
+        # assignment at pos overwrites or appends; offsets are pos - base
+        gen = SourceBuilder('_pack_into', 'self, buf, pos, base', name)
+        gen.targets, gen.positions = pack_targets(klass._field_order), {}
+        for item in klass._layout:
+            item.gen_pack_into(gen)
+        gen.emit('return pos')
+        pack_into = gen.build()
+
+        return unpack, before_pack, pack_into
+
+    @staticmethod
+    def compile_item_functions(klass):
+        """Generate a function unpacking each item of the layout on its own,
+            for lazy structs. Values are stored in the given scope d."""
+        functions = []
+        for item in klass._layout:
+            gen = SourceBuilder('unpack_item', 'd, data, offset, end, trusted', klass.__name__)
+            item.gen_unpack(gen)
+            gen.emit('return offset')
+            functions.append(gen.build())
+        return functions
+
 
     @staticmethod
     def getter_for(field):
+        attr = '_' + field.name
         def getter(self):
-            return field.get_value(self, getattr(self, '_' + field.name))
+            try:
+                value = getattr(self, attr)
+            except AttributeError:
+                value = self._lazy_load(field)
+            return field.get_value(self, value)
         return getter
 
+    @staticmethod
+    def compact_getter_for(field):
+        if field.get_value.im_func is CField.get_value.im_func:
+            # a plain slot read
+            return attrgetter('_' + field.name)
+        return MetaStruct.getter_for(field)
+
     @staticmethod
     def setter_for(field):
         def setter(self, value):
@@ -197,49 +678,206 @@ class MetaStruct(type):
             return setattr(self, '_' + field.name, field.set_value(self, value))
         return setter
 
+def compact_getattr(self, name):
+    """__getattr__ of compact classes - reading an empty slot of a field
+        ends up here, the field may be waiting to be unpacked lazily."""
+    index = self._layout_index.get(name)
+    if index is None:
+        raise AttributeError(name)
+    for field in item_fields(self._layout[index]):
+        if field.name == name:
+            return field.get_value(self, self._lazy_load(field))
+
 class CStruct(object):
     __metaclass__ = MetaStruct
+    __slots__ = ()
+
+    # store values in __slots__ instead of the instance __dict__ - saves
+    # memory and makes reading plain fields a direct slot access. Classes
+    # deriving from a compact one are compact too.
+    compact = False
+
+    # build unpacked instances without running the field constraints
+    trusted_decode = False
+
+    # 'fast' or 'reference' - None follows set_engine()
+    engine = None
 
     def __init__(self, **kwargs):
         for field in self._field_order:            
             setattr(self, field.name, kwargs.get(field.name,field.default))
 
-    def _before_pack(self, offset=0):        
-        for field in self._field_order:
-            offset += field.before_pack(self, offset)
+    # the interpreted (reference) implementation, the default
+    # unpack(), _before_pack() and _pack_into() are generated by MetaStruct
+
+    def _before_pack_reference(self, offset=0):
+        for item in self._layout:
+            if isinstance(item, CompiledRun):
+                offset += item.size
+            else:
+                offset += item.before_pack(self, offset)
         return offset
 
-    def _pack(self, off=0):
-        s = ''
-        for field in self._field_order:
-            data = field.pack(self, off)
+    def _pack_into_reference(self, buf, pos, base):
+        data = self.pack_reference(pos - base)
+        buffer_reserve(buf, pos)
+        buf[pos:pos + len(data)] = data
+        return pos + len(data)
+
+    def _pack_reference(self, off=0):
+        parts = []
+        for item in self._layout:
+            if isinstance(item, CompiledRun):
+                data = item.pack(self)
+            else:
+                data = item.pack(self, off)
             off += len(data)
-            s += data
-        return s
+            parts.append(data)
+        return ''.join(parts)
 
     def pack(self, offset=0):
-        self._before_pack(offset)
-        return self._pack(offset)
+        buf = bytearray()
+        self._pack_into(buf, 0, -offset)
+        return str(buf)
+
+    def pack_into(self, buffer, offset=0):
+        """Pack the struct into the bytearray buffer at offset, in a single
+            pass. The buffer grows as needed, offsets stored in the fields
+            are relative to offset. Returns the end of the packed data."""
+        buffer_reserve(buffer, offset)
+        return self._pack_into(buffer, offset, offset)
 
     @classmethod
-    def unpack(cls, data, offset=0):
-        print "Unpacking class %s: offset=%d, total_buf=%d" % (cls.__name__, offset, len(data))
-        dict = {}
-        dp = ItemWrapper(dict)
-        
+    def static_size(cls):
+        """Packed size of every instance of the class, or None if the
+            layout has fields of variable size"""
+        return cls._static_size
+
+    def packed_size(self):
+        """Length of the packed struct. Like a pack dry-run, this updates
+            the fields holding offsets."""
+        return self._before_pack(0)
+
+    def pack_reference(self, offset=0):
+        self._before_pack_reference(offset)
+        return self._pack_reference(offset)
+
+    @classmethod
+    def from_trusted(cls, values):
+        """Create an instance from a dict of valid field values, without
+            running the field constraints."""
+        instance = cls.__new__(cls)
         for field in cls._field_order:
-            print "Unpacking field @%d: %s" % (offset, field.name)
-            value, next_offset = field.unpack(dp, data, offset)
-            dict[field.name] = value
+            setattr(instance, '_' + field.name, field.trusted_value(instance, values[field.name]))
+        return instance
+
+    @classmethod
+    def unpack_reference(cls, data, offset=0, end=None, trusted=None):
+        if end is None:
+            end = len(data)
+        if trusted is None:
+            trusted = cls.trusted_decode
+        hook = _trace_hook
+        d = FieldScope()
+
+        for item in cls._layout:
+            if hook is not None:
+                start = default_timer()
+
+            if isinstance(item, CompiledRun):
+                values = item.struct.unpack_from(data, offset)
+                for (name, value) in zip(item.names, values):
+                    d[name] = value
+                if hook is not None:
+                    # fields of a run are unpacked together, so they
+                    # all report the time of the whole run
+                    elapsed = default_timer() - start
+                    for (field, off, value) in zip(item.fields, item.offsets, values):
+                        hook( TraceEvent(cls, field, offset + off, value, elapsed) )
+                offset += item.size
+                continue
+
+            value, next_offset = item.unpack(d, data, offset, end, trusted)
+            d[item.name] = value
+            if hook is not None:
+                hook( TraceEvent(cls, item, offset, value, default_timer() - start) )
             offset = next_offset
-            print "Unpacked: " + repr(value)
 
-        instance = cls(**dict)
-        print "Unpacked: " + str(instance)
-        return instance, offset
+        if offset > end:
+            raise struct.error("unpack requires a buffer of %d bytes" % (offset - end))
+        if trusted:
+            return cls.from_trusted(d), offset
+        return cls(**d), offset
     
+    @classmethod
+    def decoder(cls, length=None, consumers=None, trusted=None):
+        """Return a StreamDecoder for an instance of this class"""
+        return StreamDecoder(cls, length, consumers, trusted)
+
+    @classmethod
+    def unpack_lazy(cls, data, offset=0, end=None, trusted=None):
+        """Return an instance that decodes its fields from data on first access.
+            Field offsets are computed on demand, so only the fields that are
+            read (and the ones needed to locate them) are ever decoded. The
+            data must not change while the instance is in use."""
+        if end is None:
+            end = len(data)
+        if trusted is None:
+            trusted = cls.trusted_decode
+        instance = cls.__new__(cls)
+        instance._lazy_state = LazyState(data, offset, end, trusted, len(cls._layout))
+        return instance
+
+    def _lazy_load(self, field):
+        state = getattr(self, '_lazy_state', None)
+        if state is None:
+            raise AttributeError('_' + field.name)
+        self._lazy_item(self._layout_index[field.name], state)
+        return getattr(self, '_' + field.name)
+
+    def _lazy_start(self, index, state):
+        """Offset of layout item index"""
+        start = state.starts[index]
+        if start is not None:
+            return start
+
+        item = self._layout[index]
+        for c in getattr(item, 'constraints', ()):
+            if isinstance(c, const.OffsetConstraint) and isinstance(c.offset, str):
+                start = getattr(self, c.offset)
+
+        if start is None:
+            previous = self._layout[index-1]
+            if isinstance(previous, CompiledRun):
+                start = self._lazy_start(index-1, state) + previous.size
+            else:
+                self._lazy_item(index-1, state)
+                start = state.starts[index]
+
+        state.starts[index] = start
+        return start
+
+    def _lazy_item(self, index, state):
+        """Decode layout item index, keeping values that were already set"""
+        start = self._lazy_start(index, state)
+        scope = LazyScope(self)
+        state.starts[index+1] = self._unpack_items[index](scope, \
+            state.data, start, state.end, state.trusted)
+
+        for field in item_fields(self._layout[index]):
+            attr = '_' + field.name
+            if hasattr(self, attr):
+                continue
+            if state.trusted:
+                setattr(self, attr, field.trusted_value(self, scope[field.name]))
+            else:
+                setattr(self, attr, field.set_value(self, scope[field.name]))
+
     def __field_value(self, field, default=None):
-        return field.get_value(self, getattr(self, '_' + field.name, default))
+        try:
+            return getattr(self, field.name)
+        except AttributeError:
+            return default
 
     def __str__(self):
         buf = "CStruct("
@@ -248,69 +886,189 @@ class CStruct(object):
         buf += ")"
         return buf
 
-class ItemWrapper(object):
-    """Wraps the given object (usually a dict or a list) with
-        accessor methods that turn attribute calls to index calls.
-        Also provides a handy way, to attach set/get triggers."""
+class CompiledRun(object):
+    """A sequence of adjacent fixed-size fields, packed and unpacked with
+        a single precomputed struct.Struct."""
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.offsets = []
+        size = 0
+        for field in self.fields:
+            self.offsets.append(size)
+            size += field.static_size()
+        self.names = tuple(field.name for field in self.fields)
+        self.struct = struct.Struct('<' + ''.join(field.fixed_format() for field in self.fields))
+        self.size = self.struct.size
+
+    def pack(self, obj):
+        return self.struct.pack(*[getattr(obj, name) for name in self.names])
+
+    def gen_unpack(self, gen):
+        targets = ''.join('d[%r], ' % name for name in self.names)
+        gen.emit('%s= %s.unpack_from(data, offset)' % (targets, gen.bind(self.struct, 'run')))
+        gen.emit('offset += %d' % self.size)
+
+    def gen_before_pack(self, gen):
+        gen.emit('offset += %d' % self.size)
+
+    def gen_pack_into(self, gen):
+        for (name, offset) in zip(self.names, self.offsets):
+            gen_record(gen, name, 'pos + %d' % offset)
+        values = ', '.join(gen.attr('self', name) for name in self.names)
+        gen.emit('%s(buf, pos + %d)' % (gen.bind(buffer_reserve, 'buffer_reserve'), self.size))
+        gen.emit('%s.pack_into(buf, pos, %s)' % (gen.bind(self.struct, 'run'), values))
+        gen.emit('pos += %d' % self.size)
 
-    def __init__(self, obj):
-        self._object = obj
-        
-    def __getattribute__(self, name):
-        # play nice with names startign with '_'
-        if name.startswith('_'):
+    def __str__(self):
+        return ','.join(self.names)
+
+def item_fields(item):
+    """Fields of a layout item"""
+    if isinstance(item, CompiledRun):
+        return item.fields
+    return [item]
+
+def item_reads_to_end(item):
+    return not isinstance(item, CompiledRun) and item._reads_to_end()
+
+class StreamDecoder(object):
+    """Incremental decoder of a single CStruct, for data that arrives in
+        pieces. Items of the layout are unpacked as soon as their data is
+        complete, fields that read up to the end of the data wait for all
+        of it (its length must be given, or close() called).
+
+        If the last field is a streamable one (a StringField with length -1)
+        and consumers has a callable for its name, the field data is passed
+        to it in chunks instead of being buffered. The value of the field in
+        the result is then an empty string."""
+
+    def __init__(self, klass, length=None, consumers=None, trusted=None):
+        if trusted is None:
+            trusted = klass.trusted_decode
+        self.klass = klass
+        self.length = length
+        self.trusted = trusted
+        self.values = FieldScope()
+        self.result = None
+        self.received = 0
+
+        self.__consumer = None
+        last = klass._layout[-1] if klass._layout else None
+        if consumers and not isinstance(last, CompiledRun) and last._streamable():
+            self.__consumer = consumers.get(last.name)
+        self.__buffer = bytearray()
+        self.__offset = 0
+        self.__index = 0
+        self.__closed = False
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    @property
+    def remaining(self):
+        """Bytes still expected, or None if the length is unknown"""
+        if self.length is None:
+            return None
+        return self.length - self.received
+
+    def feed(self, data):
+        """Add data, unpacking all the items it completes. Returns the
+            values of the fields unpacked so far."""
+        if self.done:
+            raise ValueError("Data fed to a finished decoder.")
+        if self.length is not None and self.received + len(data) > self.length:
+            raise ValueError("The data exceeds the length of the struct.")
+        self.__buffer += data
+        self.received += len(data)
+        self.__decode()
+        return self.values
+
+    def close(self):
+        """Signal the end of data, returns the decoded instance"""
+        self.__closed = True
+        if not self.done:
+            self.__decode()
+        if not self.done:
+            raise struct.error("unpack requires a buffer of %d more bytes" % self.remaining)
+        return self.result
+
+    def __complete(self):
+        return self.__closed or self.received == self.length
+
+    def __decode(self):
+        layout = self.klass._layout
+        buffer = self.__buffer
+        while self.__index < len(layout):
+            item = layout[self.__index]
+            complete = self.__complete()
+
+            if self.__consumer is not None and self.__index == len(layout) - 1:
+                # the stream goes straight to the consumer, only the
+                # unpacked head of the struct is kept in the buffer
+                if len(buffer) > self.__offset:
+                    self.__consumer(str(buffer[self.__offset:]))
+                    del buffer[self.__offset:]
+                if not complete:
+                    return
+                self.values[item.name] = ''
+                self.__index += 1
+                continue
+
+            if item_reads_to_end(item) and not complete:
+                return
             try:
-                return object.__getattribute__(self, name)
-            except AttributeError:
-                return object.__getattribute__(self._object, name[1:])
-
-        return self._get_action(self, name, self._object[name])
-
-    def __setattr__(self, name, value):
-        # play nice :)
-        if name.startswith('_'):
-            return object.__setattr__(self, name, value)
-
-        self._object[name] = self._set_action(self, name, value)
-
-    def __getitem__(self, name):        
-        return self._get_action(self, name, self._object[name])
+                offset = self.klass._unpack_items[self.__index](self.values, \
+                    buffer, self.__offset, len(buffer), self.trusted)
+                if offset > len(buffer):
+                    raise struct.error("unpack requires a buffer of %d bytes" % offset)
+            except (struct.error, UnpackException):
+                if complete:
+                    raise
+                return # wait for more data
+            self.__offset = offset
+            self.__index += 1
+
+        if self.length is not None and not self.__complete():
+            return # the struct is unpacked, but not all of its data arrived
+        if self.trusted:
+            self.result = self.klass.from_trusted(self.values)
+        else:
+            self.result = self.klass(**self.values)
 
-    def __setitem__(self, name, value):
-        self._object[name] = self._set_action(self, name, value)
+class LazyState(object):
+    """The buffer and known item offsets of a lazily unpacked CStruct"""
 
-    def __len__(self):
-        return self._object.__len__()
+    def __init__(self, data, offset, end, trusted, items):
+        self.data = data
+        self.end = end
+        self.trusted = trusted
+        self.starts = [offset] + [None] * items
 
-    def _set_action(self, me, name, value):
-        return value
+class FieldScope(dict):
+    """Field values by name, readable as attributes - this is how
+        constraints see the values unpacked before their field."""
+    __slots__ = ()
 
-    def _get_action(self, me, name, value):
-        return value
-        
-    def __str__(self):
-        return str(self._object)
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
 
-    def __eq__(self, other):
-        return self._object.__eq__(other)
+class LazyScope(FieldScope):
+    """Unpack scope of a lazy struct - values not unpacked by the current
+        item are read from the instance."""
+    __slots__ = ('instance',)
 
+    def __init__(self, instance):
+        FieldScope.__init__(self)
+        self.instance = instance
 
-class ListItemWrapper(ItemWrapper):
+    def __missing__(self, name):
+        return getattr(self.instance, name)
 
-    def __getattribute__(self, name):
-        try:
-            key = int(name)
-            return self._get_action(self, name, self._object[key])
-        except ValueError:
-            return ItemWrapper.__getattribute__(self, name)
-    
-    def __setattr__(self, name, value):
-        try:
-            key = int(name)
-            self._object[key] = self._set_action(self, name, value)
-        except ValueError:
-            return ItemWrapper.__setattr__(self, name, value)    
-        
 class UnpackException(Exception):
     def __init__(self, msg, constraint):
         Exception.__init__(self, msg)
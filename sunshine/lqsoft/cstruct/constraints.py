@@ -37,19 +37,19 @@ class PrefixConstraint(IConstraint):
             raise ValueError("Prefix constraints takes a byte array as an argument")
         self.prefix = param
 
-    def match(self, data, pos):
-        l = len(data)
-        for char in self.prefix:
-            if pos >= l: # prefix exceeds the data
-                return False
-
-            if data[pos] != char: # characters don't match
-                return False
-            pos += 1
-        return True
+    def match(self, data, pos, end=None):
+        if end is None:
+            end = len(data)
+        stop = pos + len(self.prefix)
+        if stop > end: # prefix exceeds the data
+            return False
+        chunk = data[pos:stop]
+        if not isinstance(chunk, str):
+            chunk = chunk.tobytes() if isinstance(chunk, memoryview) else str(chunk)
+        return chunk == self.prefix
 
     def before_unpack(self, opts):
-        return self.match(opts['data'], opts['offset'])
+        return self.match(opts['data'], opts['offset'], opts['end'])
 
 class OffsetConstraint(IConstraint):
 
@@ -64,6 +64,7 @@ class OffsetConstraint(IConstraint):
             raise ValueError("Offset constraint must contain a number or a valid field name.")
         
         self.__offset = param
+        self.offset = param
 
     def before_upack_number(self, options):
         if self.__offset != options['offset']:
@@ -144,6 +145,7 @@ class LengthConstraint(IConstraint):
 
         self._opt_name = opt_name
         self.__length = length
+        self.length = length
         self.__padding_func = padding_func
 
     def on_value_set(self, opts):
@@ -164,8 +166,10 @@ class LengthConstraint(IConstraint):
 
     def before_pack(self, opts):
         # the value is about to be packed
-        # nothing to do here, 'cause we ensure proper length in the trigger
-        opts[self._opt_name] = len(opts['value'])
+        # the length is set in the trigger, unless the value was resized later
+        L = opts[self._opt_name] = len(opts['value'])
+        if isinstance(self.__length, str) and getattr(opts['obj'], self.__length) != L:
+            setattr(opts['obj'], self.__length, L)
 
     def pack(self, opts):
         # value is being packed - add our property
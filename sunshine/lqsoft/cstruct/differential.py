@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+__doc__ = """Differential testing of the CStruct engines.
+
+Instances of CStruct classes are filled with random values, then packed and
+unpacked with every engine (see common.ENGINES). The engines must agree on
+the packed bytes and on the unpacked values, and the unpacked values must be
+the ones that were packed. Every disagreement is reported as a Divergence,
+together with the speedup of the 'fast' engine over the 'reference' one:
+
+    python -m sunshine.lqsoft.cstruct.differential [module ...]
+
+checks all CStruct classes defined in the given modules (by default, the
+Gadu-Gadu 8.0 packets)."""
+
+import random
+import sys
+from collections import namedtuple
+from timeit import default_timer
+
+from sunshine.lqsoft.cstruct.common import CStruct, set_engine, get_engine
+from sunshine.lqsoft.cstruct.constraints import PrefixConstraint
+from sunshine.lqsoft.cstruct.fields.numeric import NumericField
+from sunshine.lqsoft.cstruct.fields.text import StringField, NullStringField
+from sunshine.lqsoft.cstruct.fields.complex import ArrayField, StructField
+
+DEFAULT_MODULES = ['sunshine.lqsoft.pygadu.network_v8']
+
+# longest variable-size strings and arrays that are generated
+MAX_LENGTH = 64
+MAX_ITEMS = 8
+
+# what: 'pack' (engines packed different bytes), 'unpack' (engines unpacked
+# different values), 'roundtrip' (the values unpacked aren't the packed ones)
+# or 'error' (only some engines raised); details are the engine results
+Divergence = namedtuple('Divergence', 'klass seed what details')
+
+#
+# Random values
+#
+BYTES = [chr(c) for c in xrange(256)]
+NON_NULL_BYTES = BYTES[1:]
+
+def random_bytes(rnd, length, chars=BYTES):
+    return ''.join([rnd.choice(chars) for _ in xrange(length)])
+
+def random_length(field, rnd, opt_name='length', limit=MAX_LENGTH):
+    constr = field._length_constraint(opt_name)
+    if constr is not None and isinstance(constr.length, int) and constr.length >= 0:
+        return rnd.randint(0, constr.length)
+    return rnd.randint(0, limit)
+
+def random_value(field, rnd):
+    """A random valid value of field, or None, if it is nullable"""
+    if field.nullable and rnd.random() < 0.25:
+        return None
+
+    if isinstance(field, NumericField):
+        return rnd.randint(*field.value_range())
+    if isinstance(field, NullStringField):
+        length = min(random_length(field, rnd), random_length(field, rnd, 'max_length'))
+        return random_bytes(rnd, length, NON_NULL_BYTES) + '\0'
+    if isinstance(field, StringField):
+        return random_bytes(rnd, random_length(field, rnd))
+    if isinstance(field, ArrayField):
+        count = random_length(field, rnd, limit=MAX_ITEMS)
+        return [random_value(field.subfield, rnd) for _ in xrange(count)]
+    if isinstance(field, StructField):
+        return random_struct(field._struct_klass, rnd)
+    return field.default
+
+def prefixed_value(field, value):
+    """value, changed so that it starts with the prefix of field, if any"""
+    for c in field.constraints:
+        if not isinstance(c, PrefixConstraint) or value is None:
+            continue
+        if isinstance(value, CStruct) and not value.pack().startswith(c.prefix):
+            # prefixes usually tag the struct with its first field
+            first = value._field_order[0]
+            setattr(value, first.name, first.default)
+        if isinstance(value, CStruct) and value.pack().startswith(c.prefix):
+            continue
+        if field.default is None or field.nullable:
+            return None
+        return field.default
+    return value
+
+def random_struct(klass, rnd):
+    """An instance of klass with random field values"""
+    values = {}
+    for field in klass._field_order:
+        values[field.name] = prefixed_value(field, random_value(field, rnd))
+    return klass(**values)
+
+#
+# Comparisons
+#
+def plain(value):
+    """value with structs and records turned into dicts and all
+        sequences into lists, for comparing"""
+    if isinstance(value, CStruct):
+        return dict( (field.name, plain(getattr(value, field.name))) \
+            for field in value._field_order )
+    if hasattr(value, '_asdict'):
+        return dict( (name, plain(item)) for (name, item) in value._asdict().iteritems() )
+    if isinstance(value, (list, tuple)) or hasattr(value, 'tolist'):
+        return [plain(item) for item in value]
+    return value
+
+def with_engine(engine, func, *args):
+    """(result, None) or (None, exception) of func(*args), run with engine"""
+    previous = get_engine()
+    set_engine(engine)
+    try:
+        return func(*args), None
+    except Exception, e:
+        return None, e
+    finally:
+        set_engine(previous)
+
+def outcome(result):
+    value, error = result
+    if error is not None:
+        return 'error', type(error).__name__
+    return 'value', value
+
+def check(klass, instance, seed=None, engines=('reference', 'fast')):
+    """List of Divergences of the engines on instance of klass"""
+    divergences = []
+
+    def unpack(data):
+        return plain(klass.unpack(data)[0])
+
+    packed = [with_engine(engine, instance.pack) for engine in engines]
+    outcomes = [outcome(result) for result in packed]
+    if len(set(kind for (kind, _) in outcomes)) > 1:
+        return [Divergence(klass, seed, 'error', zip(engines, outcomes))]
+    if outcomes[0][0] == 'error':
+        return divergences # all engines refused the values
+    if len(set(value for (_, value) in outcomes)) > 1:
+        divergences.append( Divergence(klass, seed, 'pack', zip(engines, outcomes)) )
+
+    data = outcomes[0][1]
+    unpacked = [outcome(with_engine(engine, unpack, data)) for engine in engines]
+    if len(set(kind for (kind, _) in unpacked)) > 1:
+        divergences.append( Divergence(klass, seed, 'error', zip(engines, unpacked)) )
+        return divergences
+    if unpacked[0][0] == 'error':
+        divergences.append( Divergence(klass, seed, 'roundtrip', zip(engines, unpacked)) )
+        return divergences
+
+    values = [value for (_, value) in unpacked]
+    if any(value != values[0] for value in values[1:]):
+        divergences.append( Divergence(klass, seed, 'unpack', zip(engines, values)) )
+    elif values[0] != plain(instance):
+        divergences.append( Divergence(klass, seed, 'roundtrip', \
+            [('packed', plain(instance)), ('unpacked', values[0])]) )
+    return divergences
+
+def timed(engine, func, items):
+    previous = get_engine()
+    set_engine(engine)
+    try:
+        start = default_timer()
+        for item in items:
+            func(item)
+        return default_timer() - start
+    finally:
+        set_engine(previous)
+
+def speedup(klass, instances, data):
+    """Time of the reference engine over the time of the fast engine,
+        for (packing, unpacking) the instances"""
+    pack = lambda instance: instance.pack()
+    unpack = lambda chunk: klass.unpack(chunk)
+    return (timed('reference', pack, instances) / max(timed('fast', pack, instances), 1e-9), \
+        timed('reference', unpack, data) / max(timed('fast', unpack, data), 1e-9))
+
+def run(classes, rounds=100, seed=0):
+    """Check rounds random instances of every class. Returns a dict:
+        class -> (divergences, (pack speedup, unpack speedup))"""
+    results = {}
+    for klass in classes:
+        divergences, instances, data = [], [], []
+        for n in xrange(rounds):
+            rnd = random.Random('%s:%d:%d' % (klass.__name__, seed, n))
+            instance = random_struct(klass, rnd)
+            found = check(klass, instance, n)
+            divergences.extend(found)
+            if not found:
+                try:
+                    data.append(instance.pack())
+                    instances.append(instance)
+                except Exception:
+                    pass # values both engines refuse
+        results[klass] = (divergences, speedup(klass, instances, data))
+    return results
+
+def module_classes(module):
+    """CStruct classes defined in module"""
+    return sorted((value for value in vars(module).itervalues() \
+        if isinstance(value, type) and issubclass(value, CStruct) \
+            and value.__module__ == module.__name__), key=lambda klass: klass.__name__)
+
+def main(argv=None):
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] [module ...]')
+    parser.add_option('--rounds', type='int', default=100, help='instances of every class [%default]')
+    parser.add_option('--seed', type='int', default=0, help='random seed [%default]')
+    options, names = parser.parse_args(argv)
+
+    classes = []
+    for name in names or DEFAULT_MODULES:
+        __import__(name)
+        classes.extend(module_classes(sys.modules[name]))
+
+    failed = False
+    for (klass, (divergences, (pack, unpack))) in sorted(run(classes, options.rounds, \
+            options.seed).iteritems(), key=lambda item: item[0].__name__):
+        print '%-28s %4d divergences  pack x%.1f  unpack x%.1f' \
+            % (klass.__name__, len(divergences), pack, unpack)
+        for divergence in divergences[:3]:
+            print '    seed %d, %s: %r' % (divergence.seed, divergence.what, divergence.details)
+        failed = failed or bool(divergences)
+    return int(failed)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,23 +4,161 @@
 __author__ = "Łukasz Rekucki"
 __date__ = "$2009-07-19 07:46:52$"
 
-from sunshine.lqsoft.cstruct.common import ListItemWrapper, CField
+from sunshine.lqsoft.cstruct.common import CField, FieldScope, buffer_bytes, \
+    buffer_reserve, item_reads_to_end, struct_for
 from sunshine.lqsoft.cstruct.constraints import *
 
+from sunshine.lqsoft.cstruct.fields.numeric import NumericField
+
+import array
+import struct
+import sys
+
 
 def array_padder(opts):
     pad = opts['padding']
-    opts['value']._extend(None for _ in xrange(0, pad))
+    value = opts['value']
+    value.extend([value._field.item_default()] * pad)
     # setattr(opts['obj'], '_' + opts['field'].name, value)
 
+class FieldList(list):
+    """Items of an ArrayField. New items are validated by the subfield."""
+    __slots__ = ('_field',)
+
+    def __init__(self, field, items=()):
+        list.__init__(self, items)
+        self._field = field
+
+    def _valid(self, values):
+        return [self._field.item_value(self, v) for v in values]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = self._valid(value)
+        else:
+            value = self._field.item_value(self, value)
+        list.__setitem__(self, index, value)
+
+    def __setslice__(self, i, j, values):
+        list.__setslice__(self, i, j, self._valid(values))
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def append(self, value):
+        list.append(self, self._field.item_value(self, value))
+
+    def insert(self, index, value):
+        list.insert(self, index, self._field.item_value(self, value))
+
+    def extend(self, values):
+        list.extend(self, self._valid(values))
+
+class FieldArray(array.array):
+    """Items of a numeric ArrayField, stored in machine format.
+        New items are validated by the subfield. Compares equal
+        to a list with the same items."""
+    __slots__ = ('_field',)
+
+    def __new__(cls, field, typecode, items=()):
+        if not isinstance(items, (list, tuple, array.array)):
+            items = list(items)
+        try:
+            self = array.array.__new__(cls, typecode, items)
+        except (TypeError, OverflowError):
+            # floats or values out of range - see ArrayField.coerce_items()
+            self = array.array.__new__(cls, typecode, field.coerce_items(items))
+        self._field = field
+        return self
+
+    def _valid(self, values):
+        field = self._field
+        return array.array(self.typecode, \
+            field.coerce_items([field.item_value(self, v) for v in values]))
+
+    def _item(self, value):
+        field = self._field
+        return field.coerce_items([field.item_value(self, value)])[0]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = self._valid(value)
+        else:
+            value = self._item(value)
+        array.array.__setitem__(self, index, value)
+
+    def __setslice__(self, i, j, values):
+        array.array.__setslice__(self, i, j, self._valid(values))
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def append(self, value):
+        array.array.append(self, self._item(value))
+
+    def insert(self, index, value):
+        array.array.insert(self, index, self._item(value))
+
+    def extend(self, values):
+        array.array.extend(self, self._valid(values))
+
+    def __eq__(self, other):
+        if isinstance(other, list):
+            return self.tolist() == other
+        return array.array.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.tolist())
+
 class ArrayField(CField):
     KEYWORDS = dict(CField.KEYWORDS,
         length= lambda lv: LengthConstraint(\
             length=lv, padding_func=array_padder) )
 
+    # the subfield always reads its value from this attribute
+    # of the item scope (see __item)
+    ITEM = 'item'
+
     def __init__(self, idx, subfield, default=[], length=0, **kwargs):
         CField.__init__(self, idx, default, **dict(kwargs, length=length) )
         self.__subfield = subfield
+        subfield.name = self.ITEM
+
+        # fixed-size numeric items are (un)packed all at once
+        fmt = subfield.fixed_format() if isinstance(subfield, NumericField) else None
+        self.__item_format = fmt
+        self.__item_size = subfield.static_size() if fmt is not None else None
+        # and kept in an array, if its machine format is the wire format
+        self.__typecode = None
+        if fmt is not None and sys.byteorder == 'little' \
+                and array.array(fmt).itemsize == self.__item_size:
+            self.__typecode = fmt
+
+    @property
+    def subfield(self):
+        return self.__subfield
+
+    def __item(self, value):
+        return FieldScope({self.ITEM: value})
+
+    def __array_struct(self, count):
+        return struct_for('<%d%s' % (count, self.__item_format))
+
+    def static_size(self):
+        length = self._length_constraint().length
+        if not self._is_plain() or not isinstance(length, int) or length < 0:
+            return None
+        item_size = self.__subfield.static_size()
+        if item_size is None:
+            return None
+        return length * item_size
 
     # packing
     def before_pack(self, obj, offset, **opts):
@@ -33,12 +171,14 @@ class ArrayField(CField):
         for c in reversed(self.constraints):
             c.before_pack(opts)     
 
+        items = value[:opts['length']]
+        if self.__item_format is not None:
+            return len(items) * self.__item_size
+
         data_len = 0
         off = offset
-        for i in xrange(0, opts['length']):
-            # map the field to index i
-            self.__subfield.name = str(i)
-            sf_len = self.__subfield.before_pack(value, off)
+        for item in items:
+            sf_len = self.__subfield.before_pack(self.__item(item), off)
             data_len += sf_len
             off += sf_len
 
@@ -56,50 +196,197 @@ class ArrayField(CField):
 
         # all constraints to this field applied      
 
-        buffer = ''
+        items = value[:opts['length']]
+        if self.__item_format is not None:
+            return self.__array_struct(len(items)).pack(*items)
+
+        parts = []
         off = offset
-        for i in xrange(0, opts['length']):
-            # map the field to index i
-            self.__subfield.name = str(i)
-            data = self.__subfield.pack(value, off)
+        for item in items:
+            data = self.__subfield.pack(self.__item(item), off)
             off += len(data)
-            buffer += data
-        return buffer
+            parts.append(data)
+        return ''.join(parts)
 
 
     # unpacking
     def _retrieve_value(self, opts):
-        l = []
-        data_len = len(opts['data'])
+        data_len = opts['end']
         array_len = opts['length']
         offset = opts['offset']
 
+        if self.__item_format is not None:
+            if array_len < 0:
+                array_len, rest = divmod(data_len - offset, self.__item_size)
+                if rest:
+                    raise struct.error("unpack requires a buffer of %d bytes" \
+                        % (self.__item_size - rest))
+            l = self.decode_items(opts['data'], offset, array_len)
+            return (l, offset + array_len * self.__item_size)
+
+        l = []
         i = 0
         while (array_len < 0 and offset < data_len) or (0 <= i < array_len):
-            self.__subfield.name = str(i)
-            v, offset = self.__subfield.unpack(opts['obj'], opts['data'], offset)
+            v, offset = self.__subfield.unpack(opts['obj'], opts['data'], offset, data_len, opts['trusted'])
             l.append(v)
             i += 1
             
         return (l, offset)
 
-    def item_set_value(self, wrapper, item_name, new_value):
+    def _reads_to_end(self):
+        return CField._reads_to_end(self) or self.__subfield._reads_to_end()
+
+    def decode_items(self, data, offset, count):
+        """Decode count numeric items starting at offset"""
+        if self.__typecode is None:
+            return FieldList(self, self.__array_struct(count).unpack_from(data, offset))
+        size = count * self.__item_size
+        chunk = data[offset:offset + size]
+        if len(chunk) != size:
+            raise struct.error("unpack_from requires a buffer of at least %d bytes" \
+                % (offset + size))
+        items = FieldArray(self, self.__typecode)
+        items.fromstring(buffer_bytes(chunk))
+        return items
+
+    def item_value(self, items, value):
         # let the subfield se the value - this validates
-        # print self, wrapper, item_name, new_value
-        self.__subfield.name = item_name
-        return self.__subfield.set_value(wrapper, new_value)
-
-    def item_get_value(self, wrapper, item_name, current_value):
-        # let the subfield se the value - this validates
-        self.__subfield.name = item_name
-        return self.__subfield.get_value(wrapper, current_value)
+        return self.__subfield.set_value(items, value)
+
+    def coerce_items(self, values):
+        """The numeric values, as the subfield packs them - like in
+            NumericField, struct truncates floats and raises struct.error
+            for values out of the range of the format"""
+        fmt = self.__subfield.format_struct
+        return [fmt.unpack(fmt.pack(v))[0] for v in values]
+
+    def item_default(self):
+        return self.__subfield.default
+
+    def _gen_inline_subfield(self):
+        subfield = self.__subfield
+        if isinstance(subfield, StructField) and not subfield.constraints:
+            return True
+        return subfield.fixed_format() is not None
+
+    def _gen_inline_unpack(self):
+        return self._gen_inline_subfield() and CField._gen_inline_unpack(self)
+
+    def _gen_inline_pack(self):
+        return self._gen_inline_subfield() and CField._gen_inline_pack(self)
+
+    def _gen_retrieve(self, gen):
+        subfield = self.__subfield
+        length, items = gen.local('n'), gen.local('items')
+        self._gen_length(gen, self._length_constraint(), length)
+
+        def gen_counted():
+            if self.__item_format is not None:
+                gen.emit('%s = %s.decode_items(data, offset, %s)' % (items, gen.bind(self, 'field'), length))
+                gen.emit('offset += %s * %d' % (length, self.__item_size))
+                return
+            gen.emit('%s = []' % items)
+            gen.emit('for _ in xrange(%s):' % length)
+            gen_item()
+
+        def gen_until_end():
+            if self.__item_format is not None:
+                rest = gen.local('rest')
+                gen.emit('%s, %s = divmod(end - offset, %d)' % (length, rest, self.__item_size))
+                gen.emit('if %s:' % rest)
+                gen.emit('    raise %s("unpack requires a buffer of %%d bytes" %% (%d - %s))' \
+                    % (gen.bind(struct.error, 'error'), self.__item_size, rest))
+                gen_counted()
+                return
+            gen.emit('%s = []' % items)
+            gen.emit('while offset < end:')
+            gen_item()
+
+        def gen_item():
+            gen.indent()
+            if isinstance(subfield, StructField):
+                item = gen.local('item')
+                gen.emit('%s, offset = %s.unpack(data, offset, end, trusted)' \
+                    % (item, gen.bind(subfield._struct_klass, 'struct')))
+                gen.emit('%s.append(%s)' % (items, item))
+            else:
+                fmt = struct.Struct('<' + subfield.fixed_format())
+                gen.emit('%s.append(%s.unpack_from(data, offset)[0])' % (items, gen.bind(fmt, 'item')))
+                gen.emit('offset += %d' % fmt.size)
+            gen.dedent()
+
+        spec = self._length_constraint().length
+        if isinstance(spec, int):
+            if spec < 0:
+                gen_until_end()
+            else:
+                gen_counted()
+        else:
+            gen.emit('if %s < 0:' % length)
+            gen.indent()
+            gen_until_end()
+            gen.dedent()
+            gen.emit('else:')
+            gen.indent()
+            gen_counted()
+            gen.dedent()
+        gen.emit('d[%r] = %s' % (self.name, items))
+
+    def _gen_size(self, gen, value):
+        subfield = self.__subfield
+        if isinstance(subfield, StructField):
+            item = gen.local('item')
+            gen.emit('for %s in %s:' % (item, value))
+            gen.emit('    offset = %s._before_pack(offset)' % item)
+        else:
+            gen.emit('offset += len(%s) * %d' \
+                % (value, struct.calcsize('<' + subfield.fixed_format())))
+
+    def _gen_write(self, gen, value):
+        subfield = self.__subfield
+        items, item = value, gen.local('item')
+        if isinstance(subfield, StructField):
+            gen.emit('for %s in %s:' % (item, items))
+            gen.emit('    pos = %s._pack_into(buf, pos, base)' % item)
+        elif self.__typecode is not None:
+            # already in the wire format
+            data = gen.local('data')
+            gen.emit('%s = %s.tostring()' % (data, items))
+            gen.emit('buf[pos:pos + len(%s)] = %s' % (data, data))
+            gen.emit('pos += len(%s)' % data)
+        elif self.__item_format is not None:
+            # all items in one go
+            size = gen.local('size')
+            gen.emit('%s = len(%s) * %d' % (size, items, self.__item_size))
+            gen.emit('%s(buf, pos + %s)' % (gen.bind(buffer_reserve, 'buffer_reserve'), size))
+            gen.emit('%s("<%%d%s" %% len(%s)).pack_into(buf, pos, *%s)' \
+                % (gen.bind(struct_for, 'struct_for'), self.__item_format, items, items))
+            gen.emit('pos += %s' % size)
+        else:
+            fmt = struct.Struct('<' + subfield.fixed_format())
+            gen.emit('%s(buf, pos + len(%s) * %d)' \
+                % (gen.bind(buffer_reserve, 'buffer_reserve'), items, fmt.size))
+            gen.emit('for %s in %s:' % (item, items))
+            gen.emit('    %s.pack_into(buf, pos, %s)' % (gen.bind(fmt, 'item'), item))
+            gen.emit('    pos += %d' % fmt.size)
 
     # override set, to wrap the value
     def set_value(self, obj, value):
-        wrapper = ListItemWrapper(value)
-        wrapper._set_action = self.item_set_value
-        wrapper._get_action = self.item_get_value
-        return CField.set_value(self, obj, wrapper)
+        if value is not None:
+            value = self.__wrap(value)
+        return CField.set_value(self, obj, value)
+
+    def trusted_value(self, obj, value):
+        if value is None:
+            return None
+        return self.__wrap(value)
+
+    def __wrap(self, value):
+        if isinstance(value, (FieldList, FieldArray)) and value._field is self:
+            return value
+        if self.__typecode is not None:
+            return FieldArray(self, self.__typecode, value)
+        return FieldList(self, value)
 
     # no need to wrap the get
     
@@ -123,7 +410,7 @@ class StructField(CField):
         for c in reversed(self.constraints):
             c.before_pack(opts)
 
-        return value._before_pack(offset)
+        return value._before_pack_reference(offset) - offset
 
     def pack(self, obj, offset, **opts):
         value = getattr(obj, self.name)
@@ -134,7 +421,27 @@ class StructField(CField):
         for c in reversed(self.constraints):
             c.pack(opts)
 
-        return value._pack(offset)
+        return value._pack_reference(offset)
+
+    def static_size(self):
+        if not self._is_plain():
+            return None
+        return self._struct_klass.static_size()
+
+    def _reads_to_end(self):
+        return CField._reads_to_end(self) \
+            or any(item_reads_to_end(item) for item in self._struct_klass._layout)
 
     def _retrieve_value(self, opts):
-        return self._struct_klass.unpack(opts['data'], opts['offset'])
+        return self._struct_klass.unpack_reference(opts['data'], opts['offset'], \
+            opts['end'], opts['trusted'])
+
+    def _gen_retrieve(self, gen):
+        gen.emit('d[%r], offset = %s.unpack(data, offset, end, trusted)' \
+            % (self.name, gen.bind(self._struct_klass, 'struct')))
+
+    def _gen_size(self, gen, value):
+        gen.emit('offset = %s._before_pack(offset)' % value)
+
+    def _gen_write(self, gen, value):
+        gen.emit('pos = %s._pack_into(buf, pos, base)' % value)
@@ -5,6 +5,7 @@ __author__ = "Łukasz Rekucki"
 __date__ = "$2009-07-19 07:46:52$"
 
 import numbers
+import struct
 
 from sunshine.lqsoft.cstruct.common import *
 import sunshine.lqsoft.cstruct.constraints as const
@@ -18,6 +19,9 @@ class NumericField(CField):
         CField.__init__(self, idx, default, **kwargs)
         self.add_constraint( const.ValueTypeConstraint(numbers.Real) )
         self.__ctype = kwargs.get('ctype', 'int')
+        # the format never changes - compile it once
+        self.__format = '<' + NumericField.FMT_STRING[self.__ctype]
+        self.format_struct = struct_for(self.__format)
 
     FMT_STRING = {
         'int': 'i',
@@ -29,11 +33,45 @@ class NumericField(CField):
     }
 
     def _format_string(self, opts):
-        return '<' + NumericField.FMT_STRING[self.__ctype]
+        return self.__format
+
+    def _format_struct(self, opts):
+        return self.format_struct
+
+    def fixed_format(self):
+        if self._is_plain():
+            return NumericField.FMT_STRING[self.__ctype]
+        return None
+
+    def value_range(self):
+        """(lowest, highest) value that the field accepts and can pack"""
+        bits = 8 * self.format_struct.size
+        if self.__format[-1].isupper():
+            lowest, highest = 0, 2**bits - 1
+        else:
+            lowest, highest = -2**(bits - 1), 2**(bits - 1) - 1
+        for c in self.constraints:
+            if isinstance(c, const.NumericBounds):
+                lowest, highest = max(lowest, c._lbound), min(highest, c._ubound)
+        return (lowest, highest)
 
     def _retrieve_value(self, opts):
          (v, offset) = CField._retrieve_value(self, opts)
          return (v[0], offset)
+
+    def _gen_retrieve(self, gen):
+        fmt = self.format_struct
+        gen.emit('d[%r], = %s.unpack_from(data, offset)' % (self.name, gen.bind(fmt, 'num')))
+        gen.emit('offset += %d' % fmt.size)
+
+    def _gen_size(self, gen, value):
+        gen.emit('offset += %d' % self.format_struct.size)
+
+    def _gen_write(self, gen, value):
+        fmt = self.format_struct
+        gen.emit('%s(buf, pos + %d)' % (gen.bind(buffer_reserve, 'buffer_reserve'), fmt.size))
+        gen.emit('%s.pack_into(buf, pos, %s)' % (gen.bind(fmt, 'num'), value))
+        gen.emit('pos += %d' % fmt.size)
     
 # some usefull shorthands
 class IntField(NumericField):
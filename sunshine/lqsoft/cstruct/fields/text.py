@@ -4,12 +4,39 @@
 __author__ = "Łukasz Rekucki"
 __date__ = "$2009-07-19 09:50:34$"
 
-from sunshine.lqsoft.cstruct.common import CField, CStruct
+from sunshine.lqsoft.cstruct.common import CField, CStruct, UnpackException, \
+    buffer_bytes, buffer_find
 from sunshine.lqsoft.cstruct.fields.numeric import UIntField
 from sunshine.lqsoft.cstruct.fields.complex import StructField
 
 from sunshine.lqsoft.cstruct.constraints import *
 
+import struct
+
+def string_value(data, start, length):
+    """The length bytes starting at start, as a string"""
+    value = data[start:start + length]
+    if len(value) != length:
+        raise struct.error("unpack_from requires a buffer of at least %d bytes" % (start + length))
+    return buffer_bytes(value)
+
+def gen_string_value(gen, name, start, length):
+    """Emit code that stores length bytes starting at start as d[name]"""
+    value = gen.local('s')
+    gen.emit('%s = data[%s:%s + %s]' % (value, start, start, length))
+    gen.emit('if len(%s) != %s:' % (value, length))
+    gen.emit('    raise %s("unpack_from requires a buffer of at least %%d bytes" %% (%s + %s))' \
+        % (gen.bind(struct.error, 'error'), start, length))
+    gen.emit('if %s.__class__ is not str:' % value)
+    gen.emit('    %s = %s(%s)' % (value, gen.bind(buffer_bytes, 'buffer_bytes'), value))
+    gen.emit('d[%r] = %s' % (name, value))
+
+def gen_string_write(gen, value):
+    gen.emit('if not isinstance(%s, str):' % value)
+    gen.emit('    raise %s("argument for \'s\' must be a string")' % gen.bind(struct.error, 'error'))
+    gen.emit('buf[pos:pos + len(%s)] = %s' % (value, value))
+    gen.emit('pos += len(%s)' % value)
+
 def string_padder(opts):
     pad = opts['padding']
     opts['value'] += pad*'\x00'
@@ -21,16 +48,46 @@ class StringField(CField):
 
     def __init__(self, idx, default='', length=0, **kwargs):
         CField.__init__(self, idx, default, **dict(kwargs, length=length) )
-        
+        self.length = length
+
+    def fixed_format(self):
+        if isinstance(self.length, int) and self.length >= 0 and self._is_plain():
+            return str(self.length) + 's'
+        return None
+
     def _format_string(self, opts):
         if opts['length'] == -1:
-            opts['length'] = len(opts['data']) - opts['offset']
+            opts['length'] = opts['end'] - opts['offset']
             
         return '<'+str(opts['length'])+'s'
 
+    def _packed_size(self, opts):
+        return opts['length']
+
     def _retrieve_value(self, opts):
-         (v, offset) = CField._retrieve_value(self, opts)
-         return (v[0], offset)
+        length = opts['length']
+        if length == -1:
+            length = opts['end'] - opts['offset']
+        v = string_value(opts['data'], opts['offset'], length)
+        return (v, opts['offset'] + length)
+
+    def _streamable(self):
+        return self.length == -1 and self._is_plain()
+
+    def _gen_retrieve(self, gen):
+        length = gen.local('n')
+        self._gen_length(gen, self._length_constraint(), length)
+        if not isinstance(self.length, int) or self.length == -1:
+            gen.emit('if %s == -1:' % length)
+            gen.emit('    %s = end - offset' % length)
+        gen_string_value(gen, self.name, 'offset', length)
+        gen.emit('offset += %s' % length)
+
+    def _gen_size(self, gen, value):
+        gen.emit('offset += len(%s)' % value)
+
+    def _gen_write(self, gen, value):
+        gen_string_write(gen, value)
 
   
 class NullStringField(CField):
@@ -42,12 +99,12 @@ class NullStringField(CField):
 
     def _before_unpack(self, opts):
         CField._before_unpack(self, opts)
-        try:
-            opts['length'] = opts['data'].index('\0', opts['offset']) - opts['offset'] + 1
-            if opts.has_key('max_length'):
-                opts['length'] = min(opts['max_length'], opts['length'])
-        except ValueError:
-            raise UnpackException("Unterminated null string occured.")
+        pos = buffer_find(opts['data'], '\0', opts['offset'], opts['end'])
+        if pos < 0:
+            raise UnpackException("Unterminated null string occured.", None)
+        opts['length'] = pos - opts['offset'] + 1
+        if opts.has_key('max_length'):
+            opts['length'] = min(opts['max_length'], opts['length'])
 
     def before_pack(self, obj, offset, **opts):
         value = getattr(obj, self.name)
@@ -57,9 +114,33 @@ class NullStringField(CField):
         value = getattr(obj, self.name)
         return CField.pack(self, obj, offset, length=len(value), **opts)
 
+    def _packed_size(self, opts):
+        return opts['length']
+
     def _retrieve_value(self, opts):
-        (v, offset) = CField._retrieve_value(self, opts)
-        return (v[0], offset)
+        v = string_value(opts['data'], opts['offset'], opts['length'])
+        return (v, opts['offset'] + opts['length'])
+
+    def _gen_retrieve(self, gen):
+        end, length = gen.local('e'), gen.local('n')
+        gen.emit("%s = %s(data, '\\0', offset, end)" % (end, gen.bind(buffer_find, 'buffer_find')))
+        gen.emit('if %s < 0:' % end)
+        gen.emit('    raise %s("Unterminated null string occured.", None)' \
+            % gen.bind(UnpackException, 'UnpackException'))
+        gen.emit('%s = %s - offset + 1' % (length, end))
+        max_length = self._length_constraint('max_length')
+        if max_length is not None:
+            limit = gen.local('m')
+            self._gen_length(gen, max_length, limit)
+            gen.emit('%s = min(%s, %s)' % (length, limit, length))
+        gen_string_value(gen, self.name, 'offset', length)
+        gen.emit('offset += %s' % length)
+
+    def _gen_size(self, gen, value):
+        gen.emit('offset += len(%s)' % value)
+
+    def _gen_write(self, gen, value):
+        gen_string_write(gen, value)
 
     def set_value(self, obj, value):
         if not isinstance(value, str) or value[-1] != '\0':
@@ -68,6 +149,8 @@ class NullStringField(CField):
         return CField.set_value(self, obj, value)
 
 class CStruct_VarString(CStruct):
+    compact = True
+
     length = UIntField(0)
     text = StringField(1, length='length')
 
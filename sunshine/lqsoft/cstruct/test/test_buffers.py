@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct, UnpackException
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class BufferTest(unittest.TestCase):
+
+    def setUp(self):
+        class TestStruct(CStruct):
+            f1 = IntField(0, prefix='\x05')
+            name = NullStringField(1)
+            text = StringField(2, length=-1)
+
+        self.TestStruct = TestStruct
+        self.data = struct.pack('<i', 5) + 'x' * 600 + '\0' + 'Hello'
+
+    def testBufferTypes(self):
+        for buf in (memoryview(self.data), bytearray(self.data), buffer(self.data)):
+            for unpack in (self.TestStruct.unpack, self.TestStruct.unpack_reference):
+                s, offset = unpack(buf)
+                self.assertEqual(offset, len(self.data))
+                self.assertEqual(s.name, 'x' * 600 + '\0')
+                self.assertEqual(s.text, 'Hello')
+                self.assert_(isinstance(s.text, str))
+
+    def testEnd(self):
+        data = self.data + 'garbage'
+        for unpack in (self.TestStruct.unpack, self.TestStruct.unpack_reference):
+            s, offset = unpack(memoryview(data), 0, len(self.data))
+            self.assertEqual(s.text, 'Hello')
+            self.assertEqual(offset, len(self.data))
+            self.assertRaises((struct.error, UnpackException), unpack, data, 0, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct
+from lqsoft.cstruct.fields.complex import *
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+from lqsoft.cstruct.constraints import *
+
+class GeneratedCodeTest(unittest.TestCase):
+    """The generated functions must give the same results as the
+        interpreted reference implementation."""
+
+    def assertSameUnpack(self, klass, data, offset=0):
+        s1, off1 = klass.unpack_reference(data, offset)
+        s2, off2 = klass.unpack(data, offset)
+        self.assertEqual(off1, off2)
+        self.assertEqual(s1.pack_reference(offset), s2.pack_reference(offset))
+        return s2
+
+    def assertSamePack(self, s):
+        data = s.pack_reference()
+        self.assertEqual(s.pack(), data)
+        return data
+
+    def testSource(self):
+        class TestStruct(CStruct):
+            f1 = IntField(0)
+            text = StringField(1, length=-1)
+
+        self.assert_('unpack_from' in TestStruct.unpack.im_func.source)
+
+    def testPrefixAndOmmit(self):
+        class TestStruct(CStruct):
+            f1 = UIntField(0, prefix__ommit='\x00')
+            f2 = UIntField(1)
+            f3 = IntField(2, prefix='\x02')
+
+        d = struct.pack("<Ii", 0xcafebabe, 2)
+        v = self.assertSameUnpack(TestStruct, d)
+        self.assertEqual(v.f1, None)
+        self.assertEqual(v.f3, 2)
+        self.assertEqual(self.assertSamePack(v), d)
+
+        try:
+            TestStruct.unpack(struct.pack("<Ii", 0xcafebabe, 3))
+            self.fail('Invalid prefix accepted by generated unpack.')
+        except UnpackException, e:
+            self.assert_(isinstance(e.constraint, PrefixConstraint))
+
+    def testLengthReference(self):
+        class TestStruct(CStruct):
+            tlen = IntField(0)
+            text = StringField(1, length='tlen')
+            rest = NullStringField(2, max_length=3)
+
+        s = TestStruct(text='Hello', rest='ab\0')
+        data = self.assertSamePack(s)
+        self.assertSameUnpack(TestStruct, data)
+        self.assertSameUnpack(TestStruct, 'XXXX' + data, 4)
+
+    def testShortBuffer(self):
+        class TestStruct(CStruct):
+            tlen = IntField(0)
+            text = StringField(1, length='tlen')
+
+        self.assertRaises(struct.error, TestStruct.unpack, struct.pack('<i', 10) + 'abc')
+
+    def testArrays(self):
+        class Inner(CStruct):
+            one = IntField(0)
+            text = VarcharField(1)
+
+        class TestStruct(CStruct):
+            count = IntField(0)
+            numbers = ArrayField(1, length='count', subfield=IntField(0))
+            inner = ArrayField(2, length=-1, subfield=StructField(0, struct=Inner))
+
+        s = TestStruct(numbers=[1, 2, 3], \
+            inner=[Inner(one=1, text=CStruct_VarString(text='a')), Inner(one=2)])
+        data = self.assertSamePack(s)
+        v = self.assertSameUnpack(TestStruct, data)
+        self.assertEqual(v.numbers, [1, 2, 3])
+        self.assertEqual(v.inner[1].one, 2)
+
+    def testNumericArrays(self):
+        class TestStruct(CStruct):
+            count = UByteField(0)
+            shorts = ArrayField(1, length='count', subfield=UShortField(0))
+            rest = ArrayField(2, length=-1, subfield=IntField(0))
+
+        s = TestStruct(shorts=[1, 2, 3], rest=[-1, 7])
+        data = self.assertSamePack(s)
+        self.assertEqual(data, struct.pack('<B3H2i', 3, 1, 2, 3, -1, 7))
+        v = self.assertSameUnpack(TestStruct, data)
+        self.assertEqual(v.shorts, [1, 2, 3])
+        self.assertEqual(v.rest, [-1, 7])
+        self.assertRaises(ValueError, v.shorts.__setitem__, 0, -1)
+
+        # trailing bytes do not make up a whole item
+        for unpack in (TestStruct.unpack, TestStruct.unpack_reference):
+            self.assertRaises(struct.error, unpack, data + 'x')
+
+    def testGaduMessage(self):
+        from lqsoft.pygadu.network import MessageOutPacket, MessageInPacket, \
+            StructMessage, StructMsgAttrs, StructRichText, StructConference
+
+        attrs = StructMsgAttrs(conference=StructConference(recipients=[1, 2, 3]))
+        attrs.richtext = StructRichText()
+        payload = StructMessage(klass=StructMessage.CLASS.CHAT, \
+            html_message='<b>ala</b>\0', plain_message='ala\0', attrs=attrs)
+        self.assertSamePack(MessageOutPacket(recipient=1849224, seq=42, content=payload))
+
+        data = self.assertSamePack(MessageInPacket(sender=7, seq=42, time=0, content=payload))
+        v = self.assertSameUnpack(MessageInPacket, data)
+        self.assertEqual(v.content.plain_message, 'ala\0')
+        self.assertEqual(v.content.attrs.conference.recipients, [1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct
+from lqsoft.cstruct.fields.complex import *
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class CompactStructTest(unittest.TestCase):
+
+    def setUp(self):
+        class TestStruct(CStruct):
+            compact = True
+            count = IntField(0)
+            numbers = ArrayField(1, length='count', subfield=IntField(0))
+            name = NullStringField(2)
+
+        class Derived(TestStruct):
+            extra = UByteField(3)
+
+        self.TestStruct = TestStruct
+        self.Derived = Derived
+
+    def testNoDict(self):
+        s = self.Derived(numbers=[1, 2], name='ala\0', extra=3)
+        self.assertFalse(hasattr(s, '__dict__'))
+        self.assertRaises(AttributeError, setattr, s, 'other', 1)
+        self.assertEqual((s.count, s.name, s.extra), (2, 'ala\0', 3))
+        self.assertRaises(ValueError, setattr, s, 'name', 'ala')
+
+    def testUnpack(self):
+        data = self.Derived(numbers=[1, 2], name='ala\0', extra=3).pack()
+        for unpack in (self.Derived.unpack, self.Derived.unpack_reference):
+            for trusted in (False, True):
+                s, offset = unpack(data, trusted=trusted)
+                self.assertEqual(s.pack(), data)
+
+        s = self.Derived.unpack_lazy(data)
+        self.assertEqual(s.extra, 3)
+        self.assertEqual(s.numbers, [1, 2])
+        self.assertRaises(AttributeError, getattr, s, 'other')
+        self.assertRaises(AttributeError, getattr, self.Derived.__new__(self.Derived), 'count')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -45,6 +45,54 @@ class ArrayFieldTest(unittest.TestCase):
         for i in xrange(0, self.slen):
             self.assertEqual( s.array[i], self.svalue[i])
 
+    def testTypedContainer(self):
+        class TestStruct(CStruct):
+            count = IntField(0)
+            array = ArrayField(1, length='count', subfield=UIntField(0))
+
+        s, offset = TestStruct.unpack(struct.pack('<i', self.slen) + self.sdata)
+        self.assertEqual(list(s.array), self.svalue)
+        self.assertNotEqual(s.array, self.svalue[1:])
+        self.assertRaises(ValueError, s.array.append, -1)
+        self.assertRaises(ValueError, s.array.__setitem__, slice(0, 2), [1, 'x'])
+
+        # the count follows the array when it grows
+        s.array.extend([13, 21])
+        data = struct.pack('<i8I', 8, *(self.svalue + [13, 21]))
+        self.assertEqual(s.pack(), data)
+        self.assertEqual(s.count, 8)
+        self.assertEqual(TestStruct.unpack(data)[0].pack_reference(), data)
+
+    def testFloatItems(self):
+        class TestStruct(CStruct):
+            count = IntField(0)
+            array = ArrayField(1, length='count', subfield=IntField(0))
+
+        # accepted like by an IntField - struct truncates them
+        data = struct.pack('<3i', 2, 1, -2)
+        for s in (TestStruct(array=[1.5, -2.5]), TestStruct(array=(x for x in [1.9, -2.1]))):
+            self.assertEqual(s.array, [1, -2])
+            self.assertEqual(s.pack(), data)
+            self.assertEqual(s.pack_reference(), data)
+
+        s.array.append(3.7)
+        s.array[0] = 4.2
+        self.assertEqual(s.array, [4, -2, 3])
+        self.assertRaises(ValueError, s.array.append, 'x')
+        self.assertRaises(struct.error, TestStruct, array=[2**40])
+
+    def testStructContainer(self):
+        class InnerStruct(CStruct):
+            one = IntField(0)
+
+        class TestStruct(CStruct):
+            array = ArrayField(0, length=-1, subfield=StructField(0, struct=InnerStruct))
+
+        s = TestStruct(array=[InnerStruct(one=1)])
+        s.array.append(InnerStruct(one=2))
+        self.assertEqual([i.one for i in s.array], [1, 2])
+        self.assertEqual(s.pack(), struct.pack('<ii', 1, 2))
+
 class StructFieldTest(unittest.TestCase):
     
     def setUp(self):
@@ -75,6 +123,24 @@ class StructFieldTest(unittest.TestCase):
         print repr(data)
         self.assertEqual( data[4:-4], self.inner_data )
 
+    def testStaticSize(self):
+        self.assertEqual(self.InnerStruct.static_size(), 8)
+        self.assertEqual(self.OuterStruct.static_size(), None)
+
+        class FixedStruct(CStruct):
+            head = UIntField(0)
+            inner = StructField(1, struct=self.InnerStruct)
+            items = ArrayField(2, IntField(0), length=3)
+
+        self.assertEqual(FixedStruct.static_size(), 24)
+        self.assertEqual(len(FixedStruct(inner=self.inner).pack()), 24)
+
+        class NullableStruct(CStruct):
+            head = UIntField(0)
+            inner = StructField(1, struct=self.InnerStruct, prefix__ommit='\x0d')
+
+        self.assertEqual(NullableStruct.static_size(), None)
+
     def testGaduMsgOut(self):
         from lqsoft.pygadu.network import *
         import time
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct, set_engine
+from lqsoft.cstruct.fields.complex import *
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class EngineTest(unittest.TestCase):
+
+    def setUp(self):
+        class TestStruct(CStruct):
+            f1 = IntField(0)
+            length = UIntField(1)
+            text = StringField(2, length='length')
+            items = ArrayField(3, ShortField(0), length=-1)
+
+        self.TestStruct = TestStruct
+        self.value = TestStruct(f1=-5, text='hello', items=[1, 2, 3])
+
+    def tearDown(self):
+        set_engine('fast')
+
+    def testSetEngine(self):
+        data = self.value.pack()
+        set_engine('reference')
+        self.assertEqual(self.TestStruct.unpack.im_func, CStruct.unpack_reference.im_func)
+        self.assertEqual(self.value.pack(), data)
+        buf = bytearray('xx')
+        self.assertEqual(self.value.pack_into(buf, 2), 2 + len(data))
+        self.assertEqual(str(buf[2:]), data)
+        self.assertEqual(self.TestStruct.unpack(data)[0].items, [1, 2, 3])
+
+        set_engine('fast')
+        self.assertNotEqual(self.TestStruct.unpack.im_func, CStruct.unpack_reference.im_func)
+        self.assertRaises(ValueError, set_engine, 'turbo')
+
+    def testClassEngine(self):
+        class ReferenceStruct(self.TestStruct):
+            engine = 'reference'
+
+        self.assertEqual(ReferenceStruct.unpack.im_func, CStruct.unpack_reference.im_func)
+        data = ReferenceStruct(f1=-5, text='hello', items=[1, 2, 3]).pack()
+        self.assertEqual(data, self.value.pack())
+
+class DifferentialTest(unittest.TestCase):
+
+    def setUp(self):
+        from lqsoft.cstruct import differential
+        self.differential = differential
+
+    def testPackets(self):
+        from lqsoft.pygadu import network_v8
+
+        classes = self.differential.module_classes(network_v8)
+        self.assert_(network_v8.MessageInPacket in classes)
+        for (klass, (divergences, speedup)) in self.differential.run(classes, rounds=5).iteritems():
+            self.assertEqual(divergences, [], klass.__name__)
+
+    def testDivergence(self):
+        from lqsoft.pygadu.network import StructNotice
+        generated = StructNotice._generated
+
+        def broken(cls, data, offset=0, end=None, trusted=None):
+            return cls(uin=0), offset + 5
+
+        StructNotice._generated = dict(generated, unpack=classmethod(broken))
+        try:
+            StructNotice.install_engine(StructNotice)
+            divergences = self.differential.check(StructNotice, StructNotice(uin=7))
+        finally:
+            StructNotice._generated = generated
+            StructNotice.install_engine(StructNotice)
+
+        self.assertEqual([d.what for d in divergences], ['unpack'])
+        self.assertEqual(self.differential.check(StructNotice, StructNotice(uin=7)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class LazyStructTest(unittest.TestCase):
+
+    def setUp(self):
+        from lqsoft.pygadu.network import MessageInPacket, StructMessage, \
+            StructMsgAttrs, StructRichText
+
+        attrs = StructMsgAttrs(richtext=StructRichText())
+        payload = StructMessage(klass=StructMessage.CLASS.CHAT, \
+            html_message='<b>ala</b>\0', plain_message='ala\0', attrs=attrs)
+        self.packet = MessageInPacket(sender=7, seq=42, time=0, content=payload)
+        self.data = self.packet.pack()
+        self.StructMessage = StructMessage
+        self.MessageInPacket = MessageInPacket
+
+    def loaded(self, s):
+        return [field.name for field in s._field_order if hasattr(s, '_' + field.name)]
+
+    def testOnlyNeededFields(self):
+        data = self.packet.content.pack(12)
+        s = self.StructMessage.unpack_lazy('X' * 12 + data, 12)
+        self.assertEqual(self.loaded(s), [])
+        self.assertEqual(s.plain_message, 'ala\0')
+        # found using offset_plain, html_message was not touched
+        self.assert_('offset_plain' in self.loaded(s))
+        self.assert_('html_message' not in self.loaded(s))
+        self.assertEqual(s.html_message, '<b>ala</b>\0')
+
+    def testSameAsEager(self):
+        eager, _ = self.MessageInPacket.unpack(self.data)
+        lazy = self.MessageInPacket.unpack_lazy(memoryview(self.data))
+        self.assertEqual(lazy.seq, 42)
+        self.assertEqual(lazy.content.attrs.richtext.format, eager.content.attrs.richtext.format)
+        self.assertEqual(str(lazy), str(eager))
+        self.assertEqual(lazy.pack(), self.data)
+
+    def testLengthReference(self):
+        class TestStruct(CStruct):
+            tlen = IntField(0)
+            text = StringField(1, length='tlen')
+            check = IntField(2)
+
+        data = TestStruct(text='Hello', check=3).pack()
+        s = TestStruct.unpack_lazy(data)
+        self.assertEqual(s.check, 3)
+        self.assertEqual(s.text, 'Hello')
+        s.check = 4
+        self.assertEqual(s.pack(), TestStruct(text='Hello', check=4).pack())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,7 @@
 import unittest
 import struct
 
-from lqsoft.cstruct.common import CStruct
+from lqsoft.cstruct.common import CStruct, CompiledRun
 from lqsoft.cstruct.fields.numeric import *
 from lqsoft.cstruct.constraints import *
 
@@ -135,6 +135,29 @@ class NumericFieldTest(unittest.TestCase):
         
 
 
+    def testCompiledRun(self):
+        class TestStruct(CStruct):
+            f1 = ByteField(0)
+            f2 = UIntField(1)
+            f3 = IntField(2, prefix='\x07')
+            f4 = ShortField(3)
+            f5 = ShortField(4)
+
+        layout = TestStruct._layout
+        self.assertEqual(len(layout), 3)
+        self.assert_(isinstance(layout[0], CompiledRun))
+        self.assertEqual(layout[0].size, 5)
+        self.assertFalse(isinstance(layout[1], CompiledRun))
+        self.assertEqual(layout[2].names, ('f4', 'f5'))
+
+        s = TestStruct(f1=-3, f2=0xcafebabe, f3=7, f4=-2, f5=300)
+        data = s.pack()
+        self.assertEqual(data, struct.pack('<bIihh', -3, 0xcafebabe, 7, -2, 300))
+
+        v, offset = TestStruct.unpack(data)
+        self.assertEqual(offset, len(data))
+        self.assertEqual((v.f1, v.f2, v.f3, v.f4, v.f5), (-3, 0xcafebabe, 7, -2, 300))
+
     def testBoundViolation(self):
         class A(CStruct):
             f = ByteField(0)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+class PackIntoTest(unittest.TestCase):
+
+    def setUp(self):
+        from lqsoft.pygadu.network import StructMessage, StructMsgAttrs, StructConference
+
+        attrs = StructMsgAttrs(conference=StructConference(recipients=[1, 2, 3]))
+        self.message = StructMessage(klass=StructMessage.CLASS.CHAT, \
+            html_message='<b>ala</b>\0', plain_message='ala\0', attrs=attrs)
+
+    def testPackInto(self):
+        data = self.message.pack_reference()
+        buf = bytearray('HEAD')
+        end = self.message.pack_into(buf, 4)
+        self.assertEqual(end, 4 + len(data))
+        self.assertEqual(str(buf), 'HEAD' + data)
+        # offsets are relative to the start of the struct
+        self.assertEqual(self.message.offset_plain, 12 + len('<b>ala</b>\0'))
+
+        # existing contents are overwritten
+        buf = bytearray('X' * 200)
+        end = self.message.pack_into(buf, 8)
+        self.assertEqual(str(buf[8:end]), data)
+        self.assertEqual(str(buf[end:]), 'X' * (200 - end))
+
+    def testPatchedOffsets(self):
+        self.message.offset_plain = 0
+        self.message.offset_attrs = 0
+        self.assertEqual(self.message.pack(), self.message.pack_reference())
+
+    def testPackedSize(self):
+        self.assertEqual(self.message.packed_size(), len(self.message.pack()))
+
+    def testPacket(self):
+        from lqsoft.pygadu.network import MessageOutPacket
+
+        packet = MessageOutPacket(recipient=1849224, seq=42, content=self.message)
+        data = packet.pack()
+        self.assertEqual(packet.as_packet(), \
+            struct.pack('<II', packet.packet_id, len(data)) + data)
+
+if __name__ == '__main__':
+    unittest.main()
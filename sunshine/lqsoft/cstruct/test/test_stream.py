@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class StreamDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        class TestStruct(CStruct):
+            tlen = IntField(0)
+            text = StringField(1, length='tlen')
+            name = NullStringField(2)
+            rest = StringField(3, length=-1)
+
+        self.TestStruct = TestStruct
+        self.data = TestStruct(text='Hello', name='ala\0', rest='x' * 100).pack()
+
+    def testByteByByte(self):
+        decoder = self.TestStruct.decoder(len(self.data))
+        for (i, c) in enumerate(self.data):
+            values = decoder.feed(c)
+            if i == 3:
+                self.assertEqual(values, {'tlen': 5})
+            if i == 12:
+                self.assertEqual(values['name'], 'ala\0')
+                self.assert_('rest' not in values)
+        self.assert_(decoder.done)
+        self.assertEqual(decoder.result.pack(), self.data)
+        self.assertRaises(ValueError, decoder.feed, 'x')
+
+    def testConsumer(self):
+        import zlib
+        payload = 'contact list ' * 1000
+        data = self.data[:13] + zlib.compress(payload)
+
+        inflater = zlib.decompressobj()
+        parts = []
+        consume = lambda chunk: parts.append(inflater.decompress(chunk))
+        decoder = self.TestStruct.decoder(consumers={'rest': consume}, trusted=True)
+        for i in xrange(0, len(data), 64):
+            decoder.feed(data[i:i + 64])
+        # everything but the head was handed over already
+        self.assertEqual(len(parts), (len(data) + 63) // 64)
+        s = decoder.close()
+        self.assertEqual(''.join(parts) + inflater.flush(), payload)
+        self.assertEqual((s.text, s.rest), ('Hello', ''))
+
+    def testTruncated(self):
+        decoder = self.TestStruct.decoder()
+        decoder.feed(self.data[:6])
+        self.assertRaises(struct.error, decoder.close)
+
+if __name__ == '__main__':
+    unittest.main()
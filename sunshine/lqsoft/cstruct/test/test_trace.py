@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct, set_trace_hook
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class TraceHookTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_trace_hook(None)
+
+    def testTraceEvents(self):
+        class TestStruct(CStruct):
+            f1 = IntField(0)
+            f2 = ShortField(1)
+            text = StringField(2, length=-1)
+
+        events = []
+        set_trace_hook(events.append)
+        s, offset = TestStruct.unpack(struct.pack('<ih', 5, 6) + 'abc')
+        self.assertEqual(s.text, 'abc')
+        self.assertEqual([(e.klass, e.field.name, e.offset, e.value) for e in events], \
+            [(TestStruct, 'f1', 0, 5), (TestStruct, 'f2', 4, 6), (TestStruct, 'text', 6, 'abc')])
+
+        set_trace_hook(None)
+        TestStruct.unpack(struct.pack('<ih', 5, 6))
+        self.assertEqual(len(events), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.common import CStruct
+from lqsoft.cstruct.fields.complex import *
+from lqsoft.cstruct.fields.numeric import *
+from lqsoft.cstruct.fields.text import *
+
+class TrustedDecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        class TestStruct(CStruct):
+            count = IntField(0)
+            numbers = ArrayField(1, length='count', subfield=IntField(0))
+            name = NullStringField(2, max_length=3)
+
+        self.TestStruct = TestStruct
+        self.data = struct.pack('<3i', 2, 5, 6) + 'abcdef\0'
+
+    def testSkipsValidation(self):
+        # the truncated string is not null-terminated
+        for unpack in (self.TestStruct.unpack, self.TestStruct.unpack_reference):
+            self.assertRaises(ValueError, unpack, self.data)
+
+            s, offset = unpack(self.data, trusted=True)
+            self.assertEqual(offset, 15)
+            self.assertEqual(s.name, 'abc')
+            self.assertEqual(s.numbers, [5, 6])
+
+        s = self.TestStruct.unpack_lazy(self.data, trusted=True)
+        self.assertEqual(s.name, 'abc')
+
+    def testOutgoingStillValidated(self):
+        s, offset = self.TestStruct.unpack(self.data, trusted=True)
+        try:
+            s.numbers[0] = 'ala ma kota'
+            self.fail('Integer array accepted a string')
+        except ValueError:
+            pass
+        self.assertRaises(ValueError, self.TestStruct, name='abc')
+
+    def testClassDefault(self):
+        class Trusted(self.TestStruct):
+            trusted_decode = True
+
+        s, offset = Trusted.unpack(self.data)
+        self.assertEqual(s.name, 'abc')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8
+__doc__ = """A GaduSession over an asyncio transport.
+
+This is an optional adapter, next to the Twisted GaduClient - it needs
+asyncio (or, on Python 2, its trollius backport):
+
+    loop = asyncio.get_event_loop()
+    transport, gadu = loop.run_until_complete( connect(host, port, uin, password) )
+    loop.run_until_complete(gadu.logged_in)
+    gadu.send( gadu.session.send_message(rcpt, seq, html, plain) )"""
+
+import hashlib
+import logging
+
+try:
+    import asyncio
+except ImportError:
+    # Python 2
+    import trollius as asyncio
+
+from sunshine.lqsoft.pygadu.session import GaduSession, PacketReceived, PacketChunk, \
+    PacketSkipped, ProtocolError, STATE_WELCOME, STATE_CONNECTED, STATE_FAILED, \
+    DECODE_ERRORS, skipped
+
+logger = logging.getLogger('Sunshine.PyGadu')
+
+class GaduAsyncioProtocol(asyncio.Protocol):
+    """Logs in when the server welcomes it and pings it while connected.
+        Received packets are passed to packet_received(), which calls the
+        handle<PacketClass> method, if there is one. The logged_in future
+        is done when the login succeeds or fails."""
+
+    def __init__(self, uin, password, status=None, loop=None, streamed=()):
+        self.uin = uin
+        self.status = status
+        self.loop = loop or asyncio.get_event_loop()
+        self.session = GaduSession(streamed=streamed)
+        self.logged_in = asyncio.Future(loop=self.loop)
+        self.transport = None
+        self.__hash = hashlib.new('sha1')
+        self.__hash.update(password)
+        self.__ping = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if self.__ping is not None:
+            self.__ping.cancel()
+            self.__ping = None
+        if not self.logged_in.done():
+            self.logged_in.set_exception(exc or EOFError("Connection closed before login."))
+        self.transport = None
+
+    def data_received(self, data):
+        session = self.session
+        for event in session.feed(data):
+            if isinstance(event, PacketReceived):
+                self.__handshake(event.packet)
+                try:
+                    self.packet_received(event.packet)
+                except DECODE_ERRORS, e:
+                    if not event.packet.lazy_decode:
+                        raise
+                    # a lazy packet, broken in a field the handler read
+                    logger.info(skipped(event.header, e).reason)
+            elif isinstance(event, PacketChunk):
+                self.chunk_received(event)
+            elif isinstance(event, PacketSkipped):
+                logger.info(event.reason)
+            elif isinstance(event, ProtocolError):
+                logger.error(event.reason)
+                self.transport.close()
+
+    def __handshake(self, packet):
+        state = self.session.state
+        if state == STATE_WELCOME:
+            self.send( self.session.send_login(self.uin, self.__hash, self.status) )
+        elif state == STATE_CONNECTED and not self.logged_in.done():
+            self.__schedulePing()
+            self.logged_in.set_result(self)
+        elif state == STATE_FAILED and not self.logged_in.done():
+            self.logged_in.set_exception(RuntimeError("Login failed: %s." % type(packet).__name__))
+
+    def __schedulePing(self):
+        self.__ping = self.loop.call_later(self.session.ping_interval, self.__sendPing)
+
+    def __sendPing(self):
+        self.send( self.session.send_ping() )
+        self.__schedulePing()
+
+    def send(self, data):
+        """Write the data of packets, made with the send_*() methods of
+            the session"""
+        self.transport.write(data)
+
+    def packet_received(self, packet):
+        handler = getattr(self, 'handle' + type(packet).__name__, None)
+        if handler is not None:
+            handler(packet)
+
+    def chunk_received(self, event):
+        """A PacketChunk of a packet, whose class is streamed"""
+        pass
+
+def connect(host, port, uin, password, status=None, loop=None, factory=GaduAsyncioProtocol):
+    """The create_connection() coroutine of the loop, for a factory protocol"""
+    loop = loop or asyncio.get_event_loop()
+    return loop.create_connection(lambda: factory(uin, password, status, loop), host, port)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8
+__doc__ = """Codec benchmarks for every registered packet class.
+
+Each packet class gets a payload resembling real traffic (see PAYLOADS,
+other classes are benchmarked with their defaults). For every payload the
+pack and unpack time, the gc-tracked objects retained by an unpacked packet
+and the cost of every field are measured. Results can be saved as a JSON baseline, and
+later runs compared against it:
+
+    python -m sunshine.lqsoft.pygadu.benchmark --save baseline.json
+    python -m sunshine.lqsoft.pygadu.benchmark --baseline baseline.json
+
+The exit status is 1 if any case got slower (or bigger) than the baseline
+by more than the threshold. The decoding of a stream of all the incoming
+payloads and the login handshake are measured too, with a GaduSession
+alone - no reactor involved."""
+
+import gc
+import hashlib
+import json
+import optparse
+import random
+import sys
+import zlib
+from timeit import default_timer
+
+from sunshine.lqsoft.cstruct.common import set_trace_hook, get_trace_hook
+from sunshine.lqsoft.pygadu.packets import Resolver
+from sunshine.lqsoft.pygadu.session import GaduSession
+from sunshine.lqsoft.pygadu.network import *
+
+# metrics compared with the baseline - for all of them, less is better
+METRICS = ('pack_us', 'unpack_us', 'retained_gc_objects')
+
+DEFAULT_THRESHOLD = 0.10
+
+#
+# Payloads - functions returning a packet instance, given a random.Random
+#
+def html_message(rnd, words=40):
+    text = ' '.join('slowo%d' % rnd.randint(0, 1000) for _ in xrange(words))
+    return '<span style="color:#000000; font-family:\'MS Shell Dlg 2\'; ' \
+        'font-size:12pt; ">%s</span>\0' % text, text + '\0'
+
+def message_content(rnd, recipients=20):
+    html, plain = html_message(rnd)
+    attrs = StructMsgAttrs()
+    attrs.conference = StructConference(recipients=[rnd.randint(1, 10**7) for _ in xrange(recipients)])
+    attrs.richtext = StructRichText()
+    return StructMessage(klass=StructMessage.CLASS.CHAT, html_message=html, \
+        plain_message=plain, attrs=attrs)
+
+def status_notices(rnd, count=2000):
+    contacts = []
+    for uin in xrange(count):
+        description = rnd.choice(['', 'zaraz wracam', 'http://www.example.com/%d' % uin])
+        contacts.append( StructStatus(uin=uin + 1000, status=rnd.choice([0x02, 0x03, 0x14]), \
+            flags=0x00800001, remote_ip=rnd.randint(0, 2**31 - 1), remote_port=8074, \
+            image_size=0xff, description=CStruct_VarString(text=description)) )
+    return StatusNoticiesPacket(contacts=contacts)
+
+def message_in(rnd):
+    return MessageInPacket(sender=rnd.randint(1, 10**7), seq=rnd.randint(0, 2**31 - 1), \
+        time=1249215667, content=message_content(rnd))
+
+def message_out(rnd):
+    return MessageOutPacket(recipient=rnd.randint(1, 10**7), seq=rnd.randint(0, 2**31 - 1), \
+        content=message_content(rnd, recipients=0))
+
+def userlist_reply(rnd, size=500 * 1024):
+    # a zlib stream of that size, like the ones with the contact book
+    entries = []
+    length = 0
+    while length < size:
+        entry = '<Contact><Guid>%032x</Guid><GGNumber>%d</GGNumber><ShowName>kontakt %d' \
+            '</ShowName><Groups><GroupId>%032x</GroupId></Groups></Contact>' \
+            % (rnd.getrandbits(128), rnd.randint(1, 10**7), len(entries), rnd.getrandbits(128))
+        entries.append( zlib.compress(entry) )
+        length += len(entries[-1])
+    return ULReplyPacket(type=0, version=1, data=''.join(entries)[:size])
+
+def user_data(rnd, users=50, attrs=20):
+    items = []
+    for i in xrange(users):
+        values = []
+        for j in xrange(attrs):
+            values.append( StructUserDataAttr(name='attr.%d' % j, type=0x01, \
+                value='%x' % rnd.getrandbits(64)) )
+        items.append( StructUserDataUser(uin=i + 1000, attr=values) )
+    return UserDataPacket(type=0x04, users=items)
+
+def login(rnd):
+    return LoginPacket(uin=rnd.randint(1, 10**7), login_hash='%064x' % rnd.getrandbits(256), \
+        description=CStruct_VarString(text='dostepny'))
+
+def notices(klass, count=400):
+    def payload(rnd):
+        return klass(contacts=[StructNotice(uin=rnd.randint(1, 10**7)) for _ in xrange(count)])
+    return payload
+
+PAYLOADS = {
+    'StatusNoticiesPacket': status_notices,
+    'MessageInPacket': message_in,
+    'MessageOutPacket': message_out,
+    'ULReplyPacket': userlist_reply,
+    'UserDataPacket': user_data,
+    'LoginPacket': login,
+    'NoticeFirstPacket': notices(NoticeFirstPacket),
+    'NoticeLastPacket': notices(NoticeLastPacket),
+    'StatusUpdatePacket': lambda rnd: StatusUpdatePacket(contact=status_notices(rnd, 1).contacts[0]),
+    'AddNoticePacket': lambda rnd: AddNoticePacket(contact=StructNotice(uin=rnd.randint(1, 10**7))),
+    'RemoveNoticePacket': lambda rnd: RemoveNoticePacket(contact=StructNotice(uin=rnd.randint(1, 10**7))),
+    'ChangeStatusPacket': lambda rnd: ChangeStatusPacket(status=0x14, description='zaraz wracam'),
+    'XmlEventPacket': lambda rnd: XmlEventPacket(data='<event><type>%d</type></event>' % rnd.randint(0, 9)),
+}
+
+def payload(klass, seed=0):
+    """A packet of class klass, for benchmarking"""
+    rnd = random.Random(seed)
+    factory = PAYLOADS.get(klass.__name__, lambda rnd: klass())
+    return factory(rnd)
+
+#
+# Measurements
+#
+def best_time(func, min_time=0.05, repeat=3):
+    """The best time of a single func() call, in seconds. Calls are
+        timed in loops of at least min_time, best of repeat loops."""
+    number = 1
+    while True:
+        start = default_timer()
+        for _ in xrange(number):
+            func()
+        elapsed = default_timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed / number
+    for _ in xrange(repeat - 1):
+        start = default_timer()
+        for _ in xrange(number):
+            func()
+        best = min(best, (default_timer() - start) / number)
+    return best
+
+def retained_gc_objects(func, count=10):
+    """Number of gc-tracked objects kept alive by a func() result. This
+        isn't a count of allocations - strings, ints and buffers aren't
+        tracked by gc, containers and instances are."""
+    gc.collect()
+    before = len(gc.get_objects())
+    results = [func() for _ in xrange(count)]
+    gc.collect()
+    kept = len(gc.get_objects()) - before - 1 # the list itself
+    del results
+    return kept // count
+
+def field_costs(klass, data, count=3):
+    """Mean time of unpacking every field (of nested structs too), in
+        microseconds, keyed with 'Struct.field'. This runs the interpreted
+        implementation, so the times are relative ones."""
+    costs = {}
+    def hook(event):
+        key = '%s.%s' % (event.klass.__name__, event.field.name)
+        costs[key] = costs.get(key, 0.0) + event.elapsed
+
+    previous = get_trace_hook()
+    set_trace_hook(hook)
+    try:
+        for _ in xrange(count):
+            klass.unpack(data, trusted=True)
+    finally:
+        set_trace_hook(previous)
+    return dict( (key, value * 1e6 / count) for (key, value) in costs.iteritems() )
+
+def measure(klass, min_time=0.05, repeat=3):
+    """Benchmark results of the payload of klass, as a dict"""
+    packet = payload(klass)
+    data = packet.pack()
+    # like GaduClient - data from the wire is trusted
+    def unpack():
+        return klass.unpack(data, trusted=True)[0]
+
+    pack_time = best_time(packet.pack, min_time, repeat)
+    unpack_time = best_time(unpack, min_time, repeat)
+    return {
+        'size': len(data),
+        'pack_us': pack_time * 1e6,
+        'unpack_us': unpack_time * 1e6,
+        'pack_mbps': len(data) / pack_time / 2**20,
+        'unpack_mbps': len(data) / unpack_time / 2**20,
+        'retained_gc_objects': retained_gc_objects(unpack),
+        'fields': field_costs(klass, data),
+    }
+
+def measure_session(min_time=0.05, repeat=3, chunk=4096):
+    """Decoding throughput of a GaduSession fed with the payloads of all
+        incoming packet classes in chunks, and the time of a handshake"""
+    stream = ''.join(payload(klass).as_packet() for (klass, id, is_out) \
+        in Resolver.packets() if not is_out)
+    chunks = [stream[i:i + chunk] for i in xrange(0, len(stream), chunk)]
+    def decode():
+        session = GaduSession()
+        for data in chunks:
+            session.feed(data)
+
+    welcome, ok = WelcomePacket(seed=0x1234).as_packet(), LoginOKPacket().as_packet()
+    password = hashlib.new('sha1')
+    password.update('password')
+    def handshake():
+        session = GaduSession()
+        session.feed(welcome)
+        session.send_login(1234, password)
+        session.feed(ok)
+
+    decode_time = best_time(decode, min_time, repeat)
+    return {
+        'size': len(stream),
+        'decode_mbps': len(stream) / decode_time / 2**20,
+        'handshake_us': best_time(handshake, min_time, repeat) * 1e6,
+    }
+
+def run(names=None, min_time=0.05, repeat=3):
+    """Benchmark all registered packet classes (or the ones in names)"""
+    cases = {}
+    for (klass, id, is_out) in Resolver.packets():
+        if names and klass.__name__ not in names:
+            continue
+        cases[klass.__name__] = measure(klass, min_time, repeat)
+    return {'python': sys.version.split()[0], 'cases': cases, \
+        'session': measure_session(min_time, repeat)}
+
+#
+# Baselines
+#
+def save(results, path):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+def load(path):
+    with open(path) as input:
+        return json.load(input)
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """List of (case, metric, baseline value, value) of all metrics
+        that grew by more than threshold (a fraction) over the baseline.
+        Cases and metrics missing in any of the results are skipped."""
+    regressions = []
+    for (name, case) in sorted(results['cases'].iteritems()):
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        for metric in METRICS:
+            if metric not in case or metric not in base:
+                continue
+            if case[metric] > base[metric] * (1 + threshold):
+                regressions.append( (name, metric, base[metric], case[metric]) )
+    return regressions
+
+def report(results, out=sys.stdout, fields=5):
+    for (name, case) in sorted(results['cases'].iteritems()):
+        out.write('%-24s %8d B  pack %10.1f us %8.1f MB/s  unpack %10.1f us %8.1f MB/s  %6d retained gc objects\n' \
+            % (name, case['size'], case['pack_us'], case['pack_mbps'], \
+               case['unpack_us'], case['unpack_mbps'], case['retained_gc_objects']))
+        costly = sorted(case['fields'].iteritems(), key=lambda item: -item[1])
+        for (field, cost) in costly[:fields]:
+            out.write('    %-40s %10.1f us\n' % (field, cost))
+    if 'session' in results:
+        session = results['session']
+        out.write('session: %d B stream decoded at %.1f MB/s, handshake %.1f us\n' \
+            % (session['size'], session['decode_mbps'], session['handshake_us']))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] [PacketClass ...]')
+    parser.add_option('--save', metavar='FILE', help='store the results as a baseline')
+    parser.add_option('--baseline', metavar='FILE', help='compare the results with a baseline')
+    parser.add_option('--threshold', type='float', default=DEFAULT_THRESHOLD, \
+        help='allowed growth over the baseline, as a fraction [%default]')
+    parser.add_option('--min-time', type='float', default=0.05, \
+        help='minimal time of a timed loop, in seconds [%default]')
+    parser.add_option('--repeat', type='int', default=3, help='timed loops per measurement [%default]')
+    options, names = parser.parse_args(argv)
+
+    results = run(names, options.min_time, options.repeat)
+    report(results)
+    if options.save:
+        save(results, options.save)
+
+    if options.baseline:
+        regressions = compare(results, load(options.baseline), options.threshold)
+        for (name, metric, old, new) in regressions:
+            print '%s: %s %.1f -> %.1f' % (name, metric, old, new)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
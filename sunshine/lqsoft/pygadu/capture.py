@@ -0,0 +1,231 @@
+# -*- coding: utf-8
+__doc__ = """Recording the traffic of a GaduClient and replaying it.
+
+A capture file starts with a header (the magic and the start time, as
+seconds since the epoch) followed by records: the direction, microseconds
+since the start and the length of a frame, then its data. Received frames
+are the data as dataReceived() got it, sent ones are whole packets. With
+GaduClient.startCapture(path) every frame costs a struct.pack() and a
+buffered write; captures are off by default.
+
+Replaying feeds the received frames to a GaduClient again - the decoder
+and the handlers - at full speed or at the original timing, and reports
+the decoding and handling time of every packet type:
+
+    python -m sunshine.lqsoft.pygadu.capture [--timing] traffic.ggcap"""
+
+import struct
+import sys
+import time
+from collections import namedtuple
+from timeit import default_timer
+
+from twisted.internet.defer import Deferred, succeed
+
+from sunshine.lqsoft.pygadu.packets import Resolver
+from sunshine.lqsoft.pygadu.framing import HEADER
+from sunshine.lqsoft.pygadu.session import GaduSession
+
+MAGIC = 'GGCAP\x00\x00\x01'
+FILE_HEADER = struct.Struct('<8sd')
+RECORD = struct.Struct('<BQI')
+
+RECEIVED, SENT = 0, 1
+
+# time in seconds since the start of the capture
+Frame = namedtuple('Frame', 'direction time data')
+
+class CaptureWriter(object):
+    """Writes the frames to output, a file opened in binary mode"""
+
+    def __init__(self, output, timer=time.time):
+        self.output = output
+        self.timer = timer
+        self.started = timer()
+        output.write( FILE_HEADER.pack(MAGIC, self.started) )
+
+    def record(self, direction, data):
+        elapsed = int((self.timer() - self.started) * 1e6)
+        self.output.write( RECORD.pack(direction, max(elapsed, 0), len(data)) )
+        self.output.write(data)
+
+    def received(self, data):
+        self.record(RECEIVED, data)
+
+    def sent(self, data):
+        self.record(SENT, data)
+
+    def close(self):
+        self.output.close()
+
+def read_capture(input):
+    """The Frames of a capture file. A record cut short (the capture
+        wasn't closed) ends the capture."""
+    header = input.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[0] != MAGIC:
+        raise ValueError("Not a capture file.")
+
+    while True:
+        record = input.read(RECORD.size)
+        if len(record) < RECORD.size:
+            return
+        direction, elapsed, length = RECORD.unpack(record)
+        data = input.read(length)
+        if len(data) < length:
+            return
+        yield Frame(direction, elapsed / 1e6, data)
+
+def load_capture(path):
+    with open(path, 'rb') as input:
+        return list(read_capture(input))
+
+#
+# Replay
+#
+class PacketStats(object):
+    __slots__ = ('count', 'size', 'decode', 'handle')
+
+    def __init__(self):
+        self.count = self.size = 0
+        self.decode = self.handle = 0.0
+
+class ReplayReport(object):
+    """Statistics of a replay, by packet class name. Decoding is timed
+        with a GaduSession fed one packet at a time, handling - as the
+        time of GaduClient._messageReceived()."""
+
+    def __init__(self):
+        self.packets = {}
+        self.frames = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def stats(self, name):
+        try:
+            return self.packets[name]
+        except KeyError:
+            stats = self.packets[name] = PacketStats()
+            return stats
+
+    def write(self, out=sys.stdout):
+        out.write('%d frames, %d bytes replayed in %.1f ms\n' \
+            % (self.frames, self.bytes, self.elapsed * 1e3))
+        out.write('%-24s %8s %10s %12s %12s\n' % ('packet', 'count', 'bytes', 'decode us', 'handle us'))
+        for (name, stats) in sorted(self.packets.iteritems(), key=lambda item: -item[1].decode):
+            out.write('%-24s %8d %10d %12.2f %12.2f\n' % (name, stats.count, stats.size, \
+                stats.decode * 1e6 / stats.count, stats.handle * 1e6 / max(stats.count, 1)))
+
+def decode_times(frames, report):
+    """Time the decoding of every received packet, by its type - the
+        session is fed one whole packet at a time"""
+    stream = ''.join(frame.data for frame in frames if frame.direction == RECEIVED)
+    session = GaduSession()
+    offset = 0
+    while offset + HEADER.size <= len(stream):
+        msg_type, msg_length = HEADER.unpack_from(stream, offset)
+        end = offset + HEADER.size + msg_length
+        if end > len(stream):
+            break # cut short
+        packet = stream[offset:end]
+        offset = end
+
+        start = default_timer()
+        session.feed(packet)
+        elapsed = default_timer() - start
+        try:
+            name = Resolver.by_IDi(msg_type).__name__
+        except KeyError:
+            name = 'unknown 0x%02x' % msg_type
+        stats = report.stats(name)
+        stats.count += 1
+        stats.size += len(packet)
+        stats.decode += elapsed
+
+def replay(frames, client, timing=False, speed=1.0, clock=None):
+    """Feed the received frames to client (a connected GaduClient). With
+        timing, frames are fed at their original times (sped up speed
+        times) on clock. Returns a Deferred fired with a ReplayReport."""
+    report = ReplayReport()
+    decode_times(frames, report)
+    received = [frame for frame in frames if frame.direction == RECEIVED]
+
+    handle = client._messageReceived
+    def timed(hdr, msg):
+        start = default_timer()
+        handle(hdr, msg)
+        report.stats(type(msg).__name__).handle += default_timer() - start
+    client._messageReceived = timed
+
+    def feed(frame):
+        start = default_timer()
+        client.dataReceived(frame.data)
+        report.elapsed += default_timer() - start
+        report.frames += 1
+        report.bytes += len(frame.data)
+
+    def finish():
+        del client._messageReceived
+        return report
+
+    if not timing:
+        for frame in received:
+            feed(frame)
+        return succeed(finish())
+
+    if clock is None:
+        from twisted.internet import reactor as clock
+    done = Deferred()
+    started = clock.seconds()
+    def next(index):
+        while index < len(received):
+            frame = received[index]
+            delay = started + frame.time / speed - clock.seconds()
+            if delay > 0:
+                clock.callLater(delay, next, index)
+                return
+            feed(frame)
+            index += 1
+        done.callback(finish())
+    next(0)
+    return done
+
+def replay_client(uin=1, clock=None):
+    """A GaduClient to replay captures with, over a fake transport"""
+    from twisted.internet import task
+    from twisted.test.proto_helpers import StringTransport
+    from sunshine.lqsoft.pygadu.twisted_protocol import GaduClient
+    from sunshine.lqsoft.pygadu.models import GaduProfile
+
+    profile = GaduProfile(uin)
+    profile.password = ''
+    profile.status = 0x02
+    client = GaduClient(profile)
+    client.clock = clock or task.Clock()
+    client.transport = StringTransport()
+    client.connectionMade()
+    return client
+
+def main(argv=None):
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] CAPTURE')
+    parser.add_option('--timing', action='store_true', help='replay at the original timing')
+    parser.add_option('--speed', type='float', default=1.0, help='speed up the timing [%default]')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('one capture file expected')
+
+    frames = load_capture(args[0])
+    reports = []
+    if options.timing:
+        from twisted.internet import reactor
+        d = replay(frames, replay_client(clock=reactor), True, options.speed, reactor)
+        d.addBoth(reports.append)
+        d.addBoth(lambda _: reactor.stop())
+        reactor.run()
+    else:
+        replay(frames, replay_client()).addCallback(reports.append)
+    reports[0].write()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
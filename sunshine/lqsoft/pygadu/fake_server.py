@@ -0,0 +1,404 @@
+# -*- coding: utf-8
+__doc__ = """A stand-in Gadu-Gadu server, for tests and load measurements
+without the network.
+
+FakeServerFactory serves the Gadu-Gadu protocol, driven by a Scenario: it
+welcomes the client, checks its login, answers the notify list with floods
+of status notices, streams incoming messages at a given rate and serves
+the contact book. AppMsgResource is the HTTP endpoint clients ask for the
+address of a server. Running the module starts both on localhost, connects
+GaduClients to them and reports the time-to-connected and the throughput:
+
+    python -m sunshine.lqsoft.pygadu.fake_server --clients 10 --contacts 2000 \\
+        --messages 10000 --rate 5000
+
+Sunshine itself uses the endpoint given in the SUNSHINE_APPMSG_URL
+environment variable - and, only then, the server port in its replies."""
+
+import hashlib
+import optparse
+import struct
+import sys
+import zlib
+from timeit import default_timer
+
+from twisted.internet import reactor, task
+from twisted.internet.protocol import Protocol, ServerFactory, ClientFactory
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from sunshine.lqsoft.pygadu.network import *
+from sunshine.lqsoft.pygadu.packets import Resolver
+from sunshine.lqsoft.pygadu.framing import PacketFramer, FramingError
+from sunshine.lqsoft.pygadu.models import GaduProfile
+
+class Scenario(object):
+    """What the server does for every session.
+
+        seed            the seed sent in the welcome
+        password        if given, logins with other passwords fail
+        contacts        size of the contact book served to userlist requests
+        status_chunk    statuses in a single StatusNoticies packet
+        description     description of the contacts' statuses
+        messages        incoming messages sent after the login
+        message_rate    ...per second, None for as fast as possible
+        message_text    plain text of the messages
+        steps           (delay, function) pairs - function(protocol) is
+                        called delay seconds after the login"""
+
+    def __init__(self, seed=0x1234, password=None, contacts=0, status_chunk=400, \
+            description='', messages=0, message_rate=None, message_text='test', steps=()):
+        self.seed = seed
+        self.password = password
+        self.contacts = contacts
+        self.status_chunk = status_chunk
+        self.description = description
+        self.messages = messages
+        self.message_rate = message_rate
+        self.message_text = message_text
+        self.steps = list(steps)
+
+    def contact_book(self, first_uin=1000):
+        """The contact book, as the client gets it - compressed XML"""
+        entries = ['<Contact><Guid>%d</Guid><GGNumber>%d</GGNumber><ShowName>kontakt %d</ShowName>' \
+            '<Groups/></Contact>' % (uin, uin, uin) \
+            for uin in xrange(first_uin, first_uin + self.contacts)]
+        return zlib.compress('<ContactBook><Groups/><Contacts>%s</Contacts></ContactBook>' \
+            % ''.join(entries))
+
+class FakeGaduServer(Protocol):
+    # messages sent in one go, when there is no rate
+    message_batch = 100
+    # seconds between message batches, when there is a rate
+    message_tick = 0.01
+
+    def __init__(self, scenario, stats=None):
+        self.scenario = scenario
+        self.stats = stats if stats is not None else ServerStats()
+        self.uin = None
+        self.clock = reactor
+        self.notices = []
+        self.userlist_version = 0
+        self.__framer = PacketFramer()
+        self.__header = None
+        self.__calls = []
+        self.__message = None
+
+    def connectionMade(self):
+        self.stats.sessions += 1
+        self.send(WelcomePacket(seed=self.scenario.seed))
+
+    def connectionLost(self, reason):
+        for call in self.__calls:
+            if call.active():
+                call.cancel()
+        if self.__message is not None and self.__message.running:
+            self.__message.stop()
+
+    def send(self, packet):
+        self.transport.write(packet.as_packet())
+
+    def dataReceived(self, data):
+        framer = self.__framer
+        framer.feed(data)
+        try:
+            while True:
+                if self.__header is None:
+                    self.__header = framer.header()
+                    if self.__header is None:
+                        break
+                hdr = self.__header
+                if framer.available < hdr.msg_length:
+                    break
+                body = framer.read(hdr.msg_length)
+                self.__header = None
+                self.stats.received += 1
+
+                try:
+                    klass = Resolver.by_IDo(hdr.msg_type)
+                except KeyError:
+                    continue
+                handler = getattr(self, '_handle' + klass.__name__, None)
+                if handler is not None:
+                    handler(klass.unpack(body.tobytes())[0])
+        except FramingError:
+            self.transport.loseConnection()
+
+    # login
+    def _handleLoginPacket(self, msg):
+        if self.scenario.password is not None:
+            expected = hashlib.sha1(self.scenario.password + struct.pack('<i', self.scenario.seed))
+            if msg.login_hash[:20] != expected.digest():
+                self.send(LoginFailedPacket())
+                self.transport.loseConnection()
+                return
+
+        self.uin = msg.uin
+        self.stats.logins += 1
+        self.send(LoginOKPacket())
+        if self.scenario.messages:
+            self.__startMessages()
+        for (delay, step) in self.scenario.steps:
+            self.__calls.append( self.clock.callLater(delay, step, self) )
+
+    def _handlePingPacket(self, msg):
+        self.send(PongPacket())
+
+    # notify list
+    def _handleNoticeFirstPacket(self, msg):
+        self.notices.extend(notice.uin for notice in msg.contacts)
+
+    def _handleNoticeLastPacket(self, msg):
+        self.notices.extend(notice.uin for notice in msg.contacts)
+        self.sendStatuses(self.notices)
+
+    def _handleNoNoticesPacket(self, msg):
+        self.sendStatuses([])
+
+    def _handleAddNoticePacket(self, msg):
+        self.notices.append(msg.contact.uin)
+        self.sendStatuses([msg.contact.uin])
+
+    def _handleRemoveNoticePacket(self, msg):
+        if msg.contact.uin in self.notices:
+            self.notices.remove(msg.contact.uin)
+
+    def sendStatuses(self, uins):
+        """The flood of StatusNoticies, all the uins are available"""
+        description = CStruct_VarString(text=self.scenario.description)
+        size = self.scenario.status_chunk
+        chunks = []
+        for i in xrange(0, len(uins), size):
+            chunks.append( StatusNoticiesPacket(contacts=[StructStatus(uin=uin, status=0x02, \
+                flags=0x00800001, remote_port=8074, image_size=0xff, description=description) \
+                for uin in uins[i:i + size]]).as_packet() )
+        self.stats.statuses += len(uins)
+        self.transport.writeSequence(chunks)
+
+    # messages
+    def _handleMessageOutPacket(self, msg):
+        self.stats.messages_out += 1
+        self.send(MessageAckPacket(msg_status=MessageAckPacket.MSG_STATUS.DELIVERED, \
+            recipient=msg.recipient, seq=msg.seq))
+
+    def _handleRecvMsgAck(self, msg):
+        self.stats.acks += 1
+
+    def message_template(self):
+        """An incoming message, as a bytearray - the seq at offset 12"""
+        text = self.scenario.message_text
+        attrs = StructMsgAttrs()
+        attrs.richtext = StructRichText()
+        content = StructMessage(klass=StructMessage.CLASS.CHAT, \
+            html_message='<span>%s</span>\0' % text, plain_message=text + '\0', attrs=attrs)
+        return bytearray(MessageInPacket(sender=1000, seq=0, time=1249215667, \
+            content=content).as_packet())
+
+    def __startMessages(self):
+        template = self.message_template()
+        rate = self.scenario.message_rate
+        started = self.clock.seconds()
+        state = {'sent': 0}
+
+        def send():
+            total = self.scenario.messages
+            if rate is None:
+                due = min(total, state['sent'] + self.message_batch)
+            else:
+                due = min(total, int((self.clock.seconds() - started) * rate) + 1)
+            chunk = []
+            for seq in xrange(state['sent'], due):
+                struct.pack_into('<I', template, 12, seq)
+                chunk.append(str(template))
+            state['sent'] = due
+            self.stats.messages_in += len(chunk)
+            self.transport.writeSequence(chunk)
+            if due == total:
+                self.__message.stop()
+
+        self.__message = task.LoopingCall(send)
+        self.__message.clock = self.clock
+        self.__message.start(0 if rate is None else self.message_tick)
+
+    # contact book
+    def _handleULRequestPacket(self, msg):
+        if msg.type == ULRequestPacket.TYPE.GET:
+            self.send(ULReplyPacket(type=ULReplyPacket.TYPE.LIST, \
+                version=self.userlist_version, data=self.scenario.contact_book()))
+        else:
+            self.userlist_version = msg.version
+            self.send(ULReplyPacket(type=ULReplyPacket.TYPE.ACK, version=self.userlist_version))
+
+class ServerStats(object):
+    """Counters of all the sessions of a server"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.logins = 0
+        self.received = 0
+        self.statuses = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.acks = 0
+
+class FakeServerFactory(ServerFactory):
+
+    def __init__(self, scenario=None):
+        self.scenario = scenario or Scenario()
+        self.stats = ServerStats()
+
+    def buildProtocol(self, addr):
+        protocol = FakeGaduServer(self.scenario, self.stats)
+        protocol.factory = self
+        return protocol
+
+class AppMsgResource(Resource):
+    """The appmsg endpoint, sending every client to one server"""
+    isLeaf = True
+
+    def __init__(self, host, port):
+        Resource.__init__(self)
+        self.host = host
+        self.port = port
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'text/plain')
+        return '0 0 %s:%d %s\n' % (self.host, self.port, self.host)
+
+def parse_appmsg(reply):
+    """(host, port) of the server in an appmsg reply, None if there's none.
+        Like SunshineConnection, the host is the last field of the reply."""
+    fields = reply.split()
+    if len(fields) < 3 or fields[0] != '0' or fields[-1] == 'notoperating':
+        return None
+    port = fields[2].partition(':')[2]
+    return fields[-1], int(port or 8074)
+
+#
+# Load test
+#
+class LoadProfile(GaduProfile):
+    """A profile recording the times of its session"""
+
+    def __init__(self, uin, password, contacts, messages, done):
+        GaduProfile.__init__(self, uin)
+        self.password = password
+        self.status = 0x02
+        self.expected = (contacts, messages)
+        self.done = done
+        self.started = default_timer()
+        self.logged_in = self.roster = self.finished = None
+        self.statuses = self.messages = 0
+        self.first_message = None
+
+    def onLoginSuccess(self):
+        self.logged_in = default_timer()
+        self.__check()
+
+    def onLoginFailure(self, reason):
+        self.finished = default_timer()
+        self.done(self)
+
+    def onContactStatusChange(self, contact):
+        self.statuses += 1
+        if self.statuses == self.expected[0]:
+            self.roster = default_timer()
+        self.__check()
+
+    def onMessageReceived(self, message):
+        if self.first_message is None:
+            self.first_message = default_timer()
+        self.messages += 1
+        self.__check()
+
+    def __check(self):
+        if self.finished is None and self.logged_in is not None \
+                and self.statuses >= self.expected[0] and self.messages >= self.expected[1]:
+            self.finished = default_timer()
+            self.done(self)
+
+def run(clients=1, scenario=None, first_uin=100000, timeout=60.0):
+    """Connect clients GaduClients to a fake server on localhost, through
+        the fake appmsg endpoint, and wait until all of them logged in and
+        got all the statuses and messages of the scenario. Returns the list
+        of their LoadProfiles."""
+    from twisted.web.client import getPage
+    from sunshine.lqsoft.pygadu.twisted_protocol import GaduClient
+
+    class Contact(object):
+        def __init__(self, uin):
+            self.uin = uin
+
+    scenario = scenario or Scenario()
+    server = reactor.listenTCP(0, FakeServerFactory(scenario), interface='127.0.0.1')
+    appmsg = reactor.listenTCP(0, Site(AppMsgResource('127.0.0.1', server.getHost().port)), \
+        interface='127.0.0.1')
+    url = 'http://127.0.0.1:%d/appsvc/appmsg_ver10.asp' % appmsg.getHost().port
+
+    profiles = []
+    def done(profile):
+        if all(p.finished is not None for p in profiles) and reactor.running:
+            reactor.stop()
+
+    def connect(reply, profile):
+        address = parse_appmsg(reply)
+        if address != ('127.0.0.1', server.getHost().port):
+            raise ValueError("The appmsg endpoint sent the client to %r." % (address,))
+        host, port = address
+        factory = ClientFactory()
+        factory.buildProtocol = lambda addr: GaduClient(profile)
+        reactor.connectTCP(host, port, factory)
+
+    for n in xrange(clients):
+        profile = LoadProfile(first_uin + n, scenario.password or '', scenario.contacts, \
+            scenario.messages, done)
+        for uin in xrange(1000, 1000 + scenario.contacts):
+            profile.addContact(Contact(uin))
+        profiles.append(profile)
+        getPage('%s?fmnumber=%d' % (url, profile.uin)).addCallback(connect, profile)
+
+    reactor.callLater(timeout, reactor.stop)
+    reactor.run()
+    return profiles
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else float('nan')
+
+def report(profiles, out=sys.stdout):
+    def times(name):
+        return [getattr(p, name) - p.started for p in profiles if getattr(p, name) is not None]
+
+    finished = [p for p in profiles if p.finished is not None]
+    out.write('%d of %d clients finished\n' % (len(finished), len(profiles)))
+    for (label, name) in [('time-to-connected', 'logged_in'), ('statuses received', 'roster'), \
+            ('all done', 'finished')]:
+        values = times(name)
+        if values:
+            out.write('%-20s median %8.1f ms  max %8.1f ms\n' \
+                % (label, median(values) * 1e3, max(values) * 1e3))
+
+    messages = sum(p.messages for p in profiles)
+    streaming = [p for p in finished if p.first_message is not None]
+    if streaming:
+        elapsed = max(p.finished for p in streaming) - min(p.first_message for p in streaming)
+        out.write('%d messages received, %.0f messages/s\n' % (messages, messages / max(elapsed, 1e-9)))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--clients', type='int', default=1, help='concurrent clients [%default]')
+    parser.add_option('--contacts', type='int', default=400, help='contacts of every client [%default]')
+    parser.add_option('--messages', type='int', default=1000, help='messages sent to every client [%default]')
+    parser.add_option('--rate', type='float', help='messages per second [as fast as possible]')
+    parser.add_option('--description', default='', help='description of the statuses')
+    parser.add_option('--timeout', type='float', default=60.0, help='seconds [%default]')
+    options, args = parser.parse_args(argv)
+
+    scenario = Scenario(contacts=options.contacts, description=options.description, \
+        messages=options.messages, message_rate=options.rate)
+    profiles = run(options.clients, scenario, timeout=options.timeout)
+    report(profiles)
+    return int(any(p.finished is None or p.logged_in is None for p in profiles))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# -*- coding: utf-8
+__doc__ = """Splitting the data stream from the server into packets"""
+
+import struct
+from collections import namedtuple
+
+from sunshine.lqsoft.pygadu.network_base import PACKET_HEADER_LENGTH
+
+# longer packets mean a broken (or hostile) stream - we would have to
+# buffer all of it before decoding
+MAX_PACKET_LENGTH = 4 * 2**20
+
+HEADER = struct.Struct('<II')
+assert HEADER.size == PACKET_HEADER_LENGTH
+
+class PacketHeader(namedtuple('PacketHeader', 'msg_type msg_length')):
+    """Header of a received packet, see GaduPacketHeader"""
+    __slots__ = ()
+
+    def __str__(self):
+        return '[GGHDR: type=%d, length %d]' % self
+
+class FramingError(Exception):
+    pass
+
+class PacketFramer(object):
+    """Buffer of the received data, read with a cursor.
+
+        Data is appended to a single bytearray, headers are parsed in place
+        and bodies are returned as memoryview slices of it. The consumed data
+        is dropped lazily, when new data is fed - by then, the views returned
+        before must be gone (the bytearray can't be resized while they exist),
+        so copy anything that has to live longer."""
+
+    def __init__(self, max_length=MAX_PACKET_LENGTH):
+        self.max_length = max_length
+        self.__buffer = bytearray()
+        self.__view = None
+        self.__cursor = 0
+
+    @property
+    def available(self):
+        """Number of bytes not read yet"""
+        return len(self.__buffer) - self.__cursor
+
+    def feed(self, data):
+        self.__view = None
+        try:
+            self.__compact()
+            self.__buffer.extend(data)
+        except BufferError:
+            # a view is still alive (in a traceback, most likely) - leave
+            # the old buffer to it
+            self.__buffer = self.__buffer[self.__cursor:]
+            self.__cursor = 0
+            self.__buffer.extend(data)
+
+    def __compact(self):
+        buf, cursor = self.__buffer, self.__cursor
+        if cursor == len(buf):
+            del buf[:]
+            self.__cursor = 0
+        elif cursor >= len(buf) // 2:
+            # moves at most as much data as was consumed since
+            del buf[:cursor]
+            self.__cursor = 0
+
+    def header(self):
+        """Read the header of the next packet, as a PacketHeader. Returns
+            None, if it isn't complete. Raises FramingError for packets
+            longer than max_length."""
+        if self.available < HEADER.size:
+            return None
+        msg_type, msg_length = HEADER.unpack_from(self.__buffer, self.__cursor)
+        if msg_length > self.max_length:
+            raise FramingError("Packet with type %d is %d bytes long, the limit is %d." \
+                % (msg_type, msg_length, self.max_length))
+        self.__cursor += HEADER.size
+        return PacketHeader(msg_type, msg_length)
+
+    def read(self, length):
+        """Read up to length bytes, as a memoryview"""
+        if self.__view is None:
+            self.__view = memoryview(self.__buffer)
+        start = self.__cursor
+        self.__cursor = min(start + length, len(self.__buffer))
+        return self.__view[start:self.__cursor]
@@ -19,6 +19,7 @@ class GaduProfile(object):
         self.handler = None
         self.contactsLoop = None
         self.exportLoop = None
+        self.last_import = None # NoticeUpload of the last contacts import
         
     def __set_password(self, value):
         self.__hashelem = hashlib.new('sha1')
@@ -135,10 +136,9 @@ class GaduProfile(object):
         if not self.connected:
             raise RuntimeError("You need to be connected, to import contact list from the server.")
 
-        def parse_xml(data):
-            print zlib.decompress(data)
-            book = ET.fromstring(zlib.decompress(data))
+        def parse_xml(book):
             self._flushContacts()
+            imported = []
             
             for elem in book.find('Groups').getchildren():
                 self.addGroup( GaduContactGroup.from_xml(elem) )
@@ -155,15 +155,23 @@ class GaduProfile(object):
                     
                 if is_uin_ok == 1:
                     contact = GaduContact.from_xml(elem)
-                    self.addContact( contact )
-                    self.__connection.addNewContact(contact)
+                    if not self.isContactExist(contact.uin):
+                        self.addContact( contact )
+                        imported.append(contact)
                 else:
                     print 'Failed to import contact. Invalid uin: %s.' % check_uin.text
 
+            # one batch of notices, for the contacts the server doesn't know
+            self.__connection.addNewContacts(imported).addCallback(self._contactsImported)
             callback()
 
         self.__connection.sendImportRequest(parse_xml)
 
+    def _contactsImported(self, upload):
+        self.last_import = upload
+        self.handler._log("Imported contacts, sent notices: %s." % upload)
+        return upload
+
     def exportContacts(self, xml):
         if not self.connected:
             raise RuntimeError("You need to be connected, to export contacts.")
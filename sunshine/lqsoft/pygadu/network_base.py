@@ -21,10 +21,29 @@ class GaduPacketHeader(CStruct):
 
 class GaduPacket(CStruct):
     """Wspólna nadklasa dla wszystkich wiadomości w GG"""
+    # no instance __dict__ here, so that compact packets have none at all
+    __slots__ = ()
+
+    # incoming packets of this class are unpacked lazily (see CStruct.unpack_lazy)
+    lazy_decode = False
+    # incoming packets of this class are decoded while they arrive, see
+    # CStruct.decoder() and the GaduClient._stream<ClassName> consumers
+    stream_decode = False
+
     def as_packet(self):
-        data = self.pack()
-        hdr = GaduPacketHeader(msg_type=self.packet_id, msg_length=len(data))
-        return hdr.pack() + data
+        buf = bytearray()
+        self.write_packet(buf)
+        return str(buf)
+
+    def write_packet(self, buf, offset=0):
+        """Pack the packet with its header into the bytearray buf at offset.
+            The body is packed first, the header is patched in front of it.
+            Returns the end of the packet."""
+        body = offset + PACKET_HEADER_LENGTH
+        end = self.pack_into(buf, body)
+        hdr = GaduPacketHeader(msg_type=self.packet_id, msg_length=end - body)
+        hdr.pack_into(buf, offset)
+        return end
 
     def __str__(self):
         return self.__class__.__name__
@@ -7,9 +7,10 @@ __doc__ = """Packet structures for Gadu-Gadu 8.0"""
 # standard library stuff
 import hashlib
 import struct
+from collections import namedtuple
 
 # Cstruct stuff
-from sunshine.lqsoft.cstruct.common import CStruct
+from sunshine.lqsoft.cstruct.common import CStruct, buffer_bytes
 from sunshine.lqsoft.cstruct.fields.numeric import *
 from sunshine.lqsoft.cstruct.fields.text import *
 from sunshine.lqsoft.cstruct.fields.complex import *
@@ -25,6 +26,8 @@ from sunshine.lqsoft.pygadu.network_base import GaduPacket
 # COMMON STRUCTURES
 #
 class StructStatus(CStruct):
+    compact         = True
+
     uin             = IntField(0)
     status          = IntField(1)
     flags           = IntField(2)
@@ -35,17 +38,102 @@ class StructStatus(CStruct):
     reserved02      = IntField(7)
     description     = VarcharField(8)
 
+#
+# Status lists are the biggest packets we get (one entry for every contact
+# on login), so they are decoded by a dedicated scanner into tuples
+# instead of StructStatus instances. Single status updates are decoded into
+# the same tuples, so handlers get one shape of statuses.
+#
+StatusRecord = namedtuple('StatusRecord', 'uin status flags remote_ip remote_port ' \
+    'image_size reserved01 reserved02 description')
+
+# the description of a StatusRecord, has the fields of CStruct_VarString
+StatusDescription = namedtuple('StatusDescription', 'length text')
+
+# fixed fields of StructStatus followed by the length of the description
+STATUS_PREFIX = struct.Struct('<iiiihBbiI')
+
+def scan_statuses(data, offset=0, end=None):
+    """Decode StructStatus entries from offset to end into StatusRecords.
+        Returns the list of records and the end offset."""
+    if end is None:
+        end = len(data)
+    unpack_from, size = STATUS_PREFIX.unpack_from, STATUS_PREFIX.size
+    records = []
+    while offset < end:
+        if offset + size > end:
+            raise struct.error("unpack requires a buffer of %d bytes" % size)
+        values = unpack_from(data, offset)
+        offset += size
+        length = values[-1]
+        text = data[offset:offset + length]
+        if offset + length > end or len(text) != length:
+            raise struct.error("unpack requires a buffer of %d bytes" % length)
+        if text.__class__ is not str:
+            text = buffer_bytes(text)
+        offset += length
+        records.append( StatusRecord(*values[:-1] + (StatusDescription(length, text),)) )
+    return records, offset
+
+def status_record(status):
+    """The StatusRecord of a StructStatus"""
+    description = status.description
+    return StatusRecord(*[getattr(status, name) for name in StatusRecord._fields[:-1]] \
+        + [StatusDescription(description.length, description.text)])
+
+class StatusListField(ArrayField):
+    """StructStatus entries up to the end of the packet, decoded into
+        StatusRecords with scan_statuses(). Records are read-only, they
+        can't be packed."""
+
+    def __init__(self, idx, **kwargs):
+        ArrayField.__init__(self, idx, length=-1, \
+            subfield=StructField(0, struct=StructStatus), **kwargs)
+
+    def _retrieve_value(self, opts):
+        # the reference engine decodes every entry as a StructStatus, so
+        # the differential tests check the scanner against it
+        statuses, offset = ArrayField._retrieve_value(self, opts)
+        return [status_record(status) for status in statuses], offset
+
+    def _gen_retrieve(self, gen):
+        gen.emit('d[%r], offset = %s(data, offset, end)' \
+            % (self.name, gen.bind(scan_statuses, 'scan_statuses')))
+
+class StatusField(StructField):
+    """A StructStatus, decoded into a StatusRecord like the entries of
+        StatusListField. Records are read-only, they can't be packed."""
+
+    def __init__(self, idx, **kwargs):
+        StructField.__init__(self, idx, struct=StructStatus, **kwargs)
+
+    def _retrieve_value(self, opts):
+        status, offset = StructField._retrieve_value(self, opts)
+        return status_record(status), offset
+
+    def _gen_retrieve(self, gen):
+        status = gen.local('status')
+        gen.emit('%s, offset = %s.unpack(data, offset, end, trusted)' \
+            % (status, gen.bind(StructStatus, 'struct')))
+        gen.emit('d[%r] = %s(%s)' % (self.name, gen.bind(status_record, 'status_record'), status))
+
 class StructConference(CStruct):
+    compact         = True
+
     attr_type       = ByteField(0, default=0x01)
     rcp_count       = IntField(1)
     recipients      = ArrayField(2, length='rcp_count', subfield=IntField(0))
 
 class StructRichText(CStruct):
+    compact         = True
+
     attr_type       = ByteField(0, default=0x02)
     length          = UShortField(1)
     format          = StringField(2, length='length', default='\x00\x00\x08\x00\x00\x00')
 
 class StructMsgAttrs(CStruct):
+    compact        = True
+
     conference     = StructField(0, struct=StructConference, prefix__ommit="\x01")
 
     # additional formating for the plain_message version
@@ -60,6 +148,7 @@ class StructMessage(CStruct):
         'CTCP':     0x0010,
         'NOACK':    0x0020,
     })
+    compact             = True
 
     klass               = IntField(0)
     offset_plain        = IntField(1) # tekst
@@ -132,6 +221,9 @@ class LoginOKPacket(GaduPacket): #LoginOk80
 LoginOKPacket = inpacket(0x35)(LoginOKPacket)
 
 class MessageInPacket(GaduPacket): #RecvMsg80
+    lazy_decode         = True
+    compact             = True
+
     sender              = IntField(0)
     seq                 = IntField(1)
     time                = IntField(2)
@@ -173,11 +265,13 @@ class ChangeStatusPacket(GaduPacket): #NewStatus80
 ChangeStatusPacket = outpacket(0x38)(ChangeStatusPacket)
 
 class StatusUpdatePacket(GaduPacket): # Status80
-    contact         = StructField(0, struct=StructStatus)
+    compact         = True
+
+    contact         = StatusField(0)
 StatusUpdatePacket = inpacket(0x36)(StatusUpdatePacket)
 
 class StatusNoticiesPacket(GaduPacket): # NotifyReply80
-    contacts        = ArrayField(0, length=-1, subfield=StructField(0, struct=StructStatus))
+    contacts        = StatusListField(0)
 StatusNoticiesPacket = inpacket(0x37)(StatusNoticiesPacket)
 
 #
@@ -205,6 +299,9 @@ class ULRequestPacket(GaduPacket): # UserListReq100
 ULRequestPacket = outpacket(0x40)(ULRequestPacket)
 
 class ULReplyPacket(GaduPacket): # UserListReply100
+    # the contact list can be big - it is inflated while it arrives
+    stream_decode = True
+
     #TYPE = Enum({
         #'PUT_REPLY':        0x00,
         #'PUT_REPLY_MORE':   0x02,
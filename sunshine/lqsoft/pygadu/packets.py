@@ -2,11 +2,17 @@
 __author__="lreqc"
 __date__ ="$2009-07-14 01:04:28$"
 
+from sunshine.lqsoft.cstruct.common import CompiledRun, buffer_reserve
+from sunshine.lqsoft.cstruct.fields.complex import StructField
+
+import struct
+
 class Resolver(object):
     __by_ID_in = {}
     __by_ID_out = {}
     __by_class = {}
     __by_name = {}
+    __templates = {}
 
     @classmethod
     def packet(cls, id, is_out):
@@ -28,10 +34,22 @@ class Resolver(object):
         
         return decorator
     
+    @classmethod
+    def packets(cls):
+        """List of (class, id, is_out) of the registered packets,
+            incoming ones first, by id"""
+        return [(klass, id, is_out) for (klass, (id, is_out)) \
+            in sorted(cls.__by_class.iteritems(), key=lambda k: (k[1][1],k[1][0]))]
+
+    @classmethod
+    def incoming(cls):
+        """List of (id, class) of the incoming packets, by id"""
+        return sorted(cls.__by_ID_in.iteritems())
+
     @classmethod
     def list_packets(cls):
         print "Listing packets:"
-        for (klass, (id, is_out)) in sorted(cls.__by_class.iteritems(), key=lambda k: (k[1][1],k[1][0])):
+        for (klass, id, is_out) in cls.packets():
             print klass.__name__, hex(id), "(%s)" % (is_out and "OUT" or "IN")
 
     @classmethod
@@ -46,6 +64,83 @@ class Resolver(object):
     def by_IDo(cls, id):
         return cls.__by_ID_out[id]
 
+    @classmethod
+    def template(cls, name):
+        """The (cached) PacketTemplate of the packet class name"""
+        try:
+            return cls.__templates[name]
+        except KeyError:
+            template = cls.__templates[name] = PacketTemplate(cls.by_name(name))
+            return template
+
+
+def template_fields(klass, prefix=''):
+    """List of (name, format, default) of all fields of a fixed-size struct,
+        with names of nested struct fields joined by '__'. None, if the
+        struct has fields of variable size or with constraints."""
+    result = []
+    for item in klass._layout:
+        if isinstance(item, CompiledRun):
+            for field in item.fields:
+                result.append( (prefix + field.name, field.fixed_format(), field.default) )
+        elif isinstance(item, StructField) and not item.constraints and not item.nullable:
+            inner = template_fields(item._struct_klass, prefix + item.name + '__')
+            if inner is None:
+                return None
+            result.extend(inner)
+        else:
+            return None
+    return result
+
+class PacketTemplate(object):
+    """Precompiled wire format (header included) of an outgoing packet class.
+
+        Packets made only of fixed-size fields are packed with one Struct,
+        from keyword values (nested fields as 'contact__uin') and the field
+        defaults. The values are not validated by the fields, struct.error
+        is raised for ones that don't fit. Packets of other classes are
+        built and packed as usual, from the given values."""
+
+    HEADER_FORMAT = '<II'
+
+    def __init__(self, klass):
+        self.klass = klass
+        fields = template_fields(klass)
+        if fields is None:
+            self.struct = None
+            return
+
+        self.fields = [(name, default) for (name, _, default) in fields]
+        self.names = frozenset(name for (name, _) in self.fields)
+        self.struct = struct.Struct(self.HEADER_FORMAT + ''.join(fmt for (_, fmt, _) in fields))
+        self.header = (klass.packet_id, klass.static_size())
+        # the packet with all values default
+        self.default = self.struct.pack(*self.__values({}))
+
+    def __values(self, values):
+        if not self.names.issuperset(values):
+            raise TypeError("Unknown fields for %s: %s" % (self.klass.__name__, \
+                ', '.join(set(values) - self.names)))
+        args = list(self.header)
+        for (name, default) in self.fields:
+            args.append(values.get(name, default))
+        return args
+
+    def pack(self, **values):
+        """The packet with its header, as a string"""
+        if self.struct is None:
+            return self.klass(**values).as_packet()
+        if not values:
+            return self.default
+        return self.struct.pack(*self.__values(values))
+
+    def pack_into(self, buf, offset=0, **values):
+        """Write the packet into the bytearray buf at offset, returns its end"""
+        if self.struct is None:
+            return self.klass(**values).write_packet(buf, offset)
+        buffer_reserve(buf, offset + self.struct.size)
+        self.struct.pack_into(buf, offset, *self.__values(values))
+        return offset + self.struct.size
 
 def inpacket(id):
     return Resolver.packet(id, False)
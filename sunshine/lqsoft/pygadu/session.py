@@ -0,0 +1,288 @@
+# -*- coding: utf-8
+__doc__ = """The Gadu-Gadu protocol, without any I/O.
+
+A GaduSession turns the data received from the server into events
+(feed() returns a list of them) and builds the data of outgoing packets
+(the send_*() methods return strings). Reading from and writing to the
+connection, timers and callbacks are left to the adapters - GaduClient
+for Twisted, GaduAsyncioProtocol for asyncio:
+
+    session = GaduSession()
+    for event in session.feed(data):
+        if isinstance(event, PacketReceived) and session.state == STATE_WELCOME:
+            sock.send( session.send_login(uin, password_hash, status) )"""
+
+import struct
+from collections import namedtuple, Counter
+
+from sunshine.lqsoft.cstruct.common import UnpackException
+from sunshine.lqsoft.pygadu.network import *
+from sunshine.lqsoft.pygadu.packets import Resolver
+from sunshine.lqsoft.pygadu.framing import PacketFramer, FramingError, MAX_PACKET_LENGTH
+
+#
+# Events
+#
+# a whole packet
+PacketReceived = namedtuple('PacketReceived', 'header packet')
+# a piece of the streamed (last) field of a packet - values are the
+# ones of the fields before it
+PacketChunk = namedtuple('PacketChunk', 'header data values')
+# a known packet, that was too short to decode
+PacketSkipped = namedtuple('PacketSkipped', 'header reason')
+# the stream is broken, nothing more is decoded
+ProtocolError = namedtuple('ProtocolError', 'reason')
+
+# what decoding a broken packet raises - lazily decoded packets raise it
+# when their fields are read, so the adapters catch it around handlers
+DECODE_ERRORS = (struct.error, UnpackException)
+
+def skipped(hdr, error):
+    """The PacketSkipped event of a packet, that failed to decode"""
+    return PacketSkipped(hdr, 'Ommiting message with type %d: %s.' % (hdr.msg_type, error))
+
+#
+# States
+#
+STATE_CONNECTING = 'connecting'     # waiting for the welcome
+STATE_WELCOME = 'welcome'           # got the seed, can log in
+STATE_LOGGING_IN = 'logging_in'     # login sent
+STATE_CONNECTED = 'connected'
+STATE_FAILED = 'failed'             # login refused
+STATE_CLOSED = 'closed'             # disconnected or broken
+
+# seconds between pings
+PING_INTERVAL = 180.0
+
+# statuses for send_status(), all of them have a _DESC variant
+STATUSES = ('NOT_AVAILABLE', 'FFC', 'AVAILABLE', 'BUSY', 'DND', 'HIDDEN')
+
+class DecodeRoute(object):
+    """How the packets of one class are decoded"""
+    __slots__ = ('klass', 'size', 'streamed')
+
+    def __init__(self, klass, streamed):
+        self.klass = klass
+        self.size = klass.static_size()
+        self.streamed = streamed
+
+class GaduSession(object):
+
+    def __init__(self, max_length=MAX_PACKET_LENGTH, streamed=()):
+        """streamed are the classes of packets, whose last field is given
+            in PacketChunk events as it arrives, instead of being buffered"""
+        self.state = STATE_CONNECTING
+        self.seed = None
+        self.ping_interval = PING_INTERVAL
+        # number of packets skipped, by their type
+        self.unknown_packets = Counter()
+
+        self.__framer = PacketFramer(max_length)
+        self.__routes = {}
+        for (id, klass) in Resolver.incoming():
+            self.__routes[id] = DecodeRoute(klass, \
+                klass in streamed or klass.__name__ in streamed)
+        self.__header = None
+        self.__decoder = None
+        self.__skip = 0
+        self.__events = None
+        self.__buffer = bytearray()
+
+    #
+    # Receiving
+    #
+    def feed(self, data):
+        """Decode the data received from the server, returns a list of events"""
+        if self.__framer is None:
+            return [] # broken
+        events = self.__events = []
+        try:
+            self.__decode(data)
+        except FramingError, e:
+            # the rest of the stream can't be trusted
+            events.append( ProtocolError(str(e)) )
+            self.state = STATE_CLOSED
+            self.__framer = None
+        finally:
+            self.__events = None
+        return events
+
+    def __decode(self, data):
+        framer = self.__framer
+        framer.feed(data)
+        events = self.__events
+
+        while True:
+            if self.__decoder is not None:
+                # a message decoded as it arrives
+                decoder = self.__decoder
+                try:
+                    decoder.feed( framer.read(decoder.remaining) )
+                except DECODE_ERRORS, e:
+                    # the rest of the message is dropped as it arrives
+                    hdr, self.__header, self.__decoder = self.__header, None, None
+                    self.__skip = decoder.remaining
+                    events.append( skipped(hdr, e) )
+                    continue
+                if not decoder.done:
+                    break
+
+                hdr, self.__header, self.__decoder = self.__header, None, None
+                self.__received(hdr, decoder.result)
+            elif self.__skip:
+                # an unknown message - dropped as it arrives
+                self.__skip -= len(framer.read(self.__skip))
+                if self.__skip:
+                    break
+            elif self.__header is not None:
+                # if we are inside of a message
+                hdr = self.__header
+
+                if framer.available < hdr.msg_length:
+                    # not yet
+                    break
+
+                body = framer.read(hdr.msg_length)
+                self.__header = None
+                route = self.__routes[hdr.msg_type]
+
+                # fixed-size messages are checked before decoding
+                if route.size is not None and hdr.msg_length < route.size:
+                    events.append( PacketSkipped(hdr, \
+                        'Ommiting message with type %d: %d bytes, expected %d.' \
+                        % (hdr.msg_type, hdr.msg_length, route.size)) )
+                else:
+                    try:
+                        packet = self.__unpack(route.klass, body)
+                    except DECODE_ERRORS, e:
+                        events.append( skipped(hdr, e) )
+                    else:
+                        self.__received(hdr, packet)
+            else:
+                # we're waiting for a header
+                hdr = framer.header()
+                if hdr is None:
+                    # no header yet
+                    break
+
+                route = self.__routes.get(hdr.msg_type)
+                if route is None:
+                    self.unknown_packets[hdr.msg_type] += 1
+                    self.__skip = hdr.msg_length
+                    continue
+
+                self.__header = hdr
+                self.__decoder = self.__streamDecoder(hdr, route)
+                # continue normally
+
+    def __unpack(self, klass, body):
+        # data straight from the server - skip validation
+        if klass.lazy_decode:
+            # lazy messages keep their data - the framer reuses its buffer
+            return klass.unpack_lazy(body.tobytes(), trusted=True)
+        return klass.unpack(body, trusted=True)[0]
+
+    def __streamDecoder(self, hdr, route):
+        if not route.klass.stream_decode:
+            return None
+        consumers = {}
+        if route.streamed:
+            last = route.klass._field_order[-1]
+            consumers[last.name] = lambda chunk: self.__events.append( \
+                PacketChunk(hdr, chunk, self.__decoder.values) )
+        return route.klass.decoder(hdr.msg_length, consumers, trusted=True)
+
+    def __received(self, hdr, packet):
+        # the state of the login handshake
+        if isinstance(packet, WelcomePacket):
+            self.seed = packet.seed
+            self.state = STATE_WELCOME
+        elif isinstance(packet, LoginOKPacket):
+            self.state = STATE_CONNECTED
+        elif isinstance(packet, (LoginFailedPacket, Login80FailedPacket)):
+            self.state = STATE_FAILED
+        elif isinstance(packet, DisconnectPacket):
+            self.state = STATE_CLOSED
+        self.__events.append( PacketReceived(hdr, packet) )
+
+    #
+    # Sending
+    #
+    def send_packet(self, packet):
+        """The packet with its transport header, as a string"""
+        # packed into a buffer reused for all outgoing packets
+        buf = self.__buffer
+        del buf[:]
+        packet.write_packet(buf)
+        return str(buf)
+
+    def send_template(self, name, **values):
+        """The packet of class name, packed from a precompiled template"""
+        return Resolver.template(name).pack(**values)
+
+    def send_login(self, uin, hash_elem, status=None):
+        """The login packet. hash_elem is a hashlib object, updated with
+            the password - it is copied and updated with the seed."""
+        if self.state != STATE_WELCOME:
+            raise RuntimeError("Can't log in, when the session is %s." % self.state)
+        hash_elem = hash_elem.copy()
+        hash_elem.update( struct.pack("<i", self.seed) )
+        values = {'uin': uin, 'login_hash': hash_elem.digest()}
+        if status is not None:
+            values['status'] = status
+        self.state = STATE_LOGGING_IN
+        return self.send_packet( LoginPacket(**values) )
+
+    def send_ping(self):
+        return self.send_template('PingPacket')
+
+    def send_msg_ack(self, num):
+        return self.send_template('RecvMsgAck', num=num)
+
+    def send_message(self, rcpt, seq, html_text, plain_message, recipients=None):
+        attrs = StructMsgAttrs()
+        attrs.richtext = StructRichText()
+        if recipients is not None:
+            attrs.conference = StructConference(recipients=map(int, recipients))
+
+        payload = StructMessage(klass=StructMessage.CLASS.CHAT, \
+            html_message=html_text, plain_message=plain_message, \
+            attrs = attrs)
+        return self.send_packet( MessageOutPacket(recipient=rcpt, seq=seq, content=payload) )
+
+    def send_typing_notify(self, uin, type):
+        return self.send_template('TypingNotifyPacket', uin=uin, type=type)
+
+    def send_add_notice(self, uin):
+        return self.send_template('AddNoticePacket', contact__uin=uin)
+
+    def send_remove_notice(self, uin):
+        return self.send_template('RemoveNoticePacket', contact__uin=uin)
+
+    def send_notices(self, uins, last=True):
+        """A NoticeFirst (or the final NoticeLast) packet with the uins,
+            NoNotices if there are none"""
+        if not uins:
+            return self.send_template('NoNoticesPacket')
+        klass = NoticeLastPacket if last else NoticeFirstPacket
+        return self.send_packet( klass(contacts=[StructNotice(uin=uin) for uin in uins]) )
+
+    def send_status(self, status, description=''):
+        """The ChangeStatus packet - status is one of STATUSES, others
+            mean NOT_AVAILABLE"""
+        if status not in STATUSES:
+            status = 'NOT_AVAILABLE'
+        elif description:
+            status += '_DESC'
+        code = getattr(ChangeStatusPacket.STATUS, status)
+        if not description:
+            return self.send_packet( ChangeStatusPacket(status=code, flags=0x00000001) )
+        return self.send_packet( ChangeStatusPacket(status=code, flags=0x00000001, \
+            description_size=len(description), description=description) )
+
+    def send_userlist_get(self):
+        return self.send_packet( ULRequestPacket(type=ULRequestPacket.TYPE.GET, data='') )
+
+    def send_userlist_put(self, version, data):
+        return self.send_packet( ULRequestPacket(type=ULRequestPacket.TYPE.PUT, \
+            version=version, data=data) )
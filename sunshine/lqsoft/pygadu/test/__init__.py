@@ -0,0 +1,27 @@
+import unittest
+
+class Contact(object):
+    def __init__(self, uin):
+        self.uin = uin
+
+def contacts(uins):
+    return [Contact(uin) for uin in uins]
+
+class ClientTestCase(unittest.TestCase):
+    """Tests of a GaduClient over a fake transport, with its time on a
+        task.Clock. Call createClient() in setUp() or in the test."""
+
+    def createClient(self, transport=None, connect=True, uin=1234):
+        from twisted.internet import task
+        from twisted.test.proto_helpers import StringTransport
+        from lqsoft.pygadu.twisted_protocol import GaduClient
+        from lqsoft.pygadu.models import GaduProfile
+
+        self.clock = task.Clock()
+        self.client = GaduClient(GaduProfile(uin))
+        self.client._log = lambda msg: None
+        self.client.clock = self.clock
+        self.client.transport = transport or StringTransport()
+        if connect:
+            self.client.connectionMade()
+        return self.client
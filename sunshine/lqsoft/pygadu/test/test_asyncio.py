@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+class Loop(object):
+    """Just enough of an event loop - call_later() only records the call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def get_debug(self):
+        return False
+
+    def call_soon(self, callback, *args):
+        callback(*args)
+
+    def call_later(self, delay, callback, *args):
+        call = Call(delay, callback, args)
+        self.calls.append(call)
+        return call
+
+    def run_next(self):
+        call = self.calls.pop(0)
+        call.callback(*call.args)
+        return call
+
+class Call(object):
+    def __init__(self, delay, callback, args):
+        self.delay, self.callback, self.args = delay, callback, args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Transport(object):
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+class AsyncioProtocolTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            from lqsoft.pygadu.asyncio_protocol import GaduAsyncioProtocol
+        except ImportError:
+            self.skipTest("neither asyncio nor trollius is available")
+        self.loop = Loop()
+        self.transport = Transport()
+        self.gadu = GaduAsyncioProtocol(1234, 'secret', 0x14, loop=self.loop)
+        self.gadu.connection_made(self.transport)
+
+    def sent(self):
+        return [struct.unpack_from('<I', data)[0] for data in self.transport.written]
+
+    def login(self):
+        from lqsoft.pygadu.network import WelcomePacket, LoginOKPacket
+        self.gadu.data_received(WelcomePacket(seed=7).as_packet())
+        self.gadu.data_received(LoginOKPacket().as_packet())
+
+    def testHandshake(self):
+        import hashlib
+        from lqsoft.pygadu.network import WelcomePacket, LoginPacket
+        self.gadu.data_received(WelcomePacket(seed=7).as_packet())
+        login = LoginPacket.unpack(self.transport.written[0][8:])[0]
+        self.assertEqual((login.uin, login.status), (1234, 0x14))
+        self.assertEqual(login.login_hash[:20], hashlib.sha1('secret' + struct.pack('<i', 7)).digest())
+        self.assertFalse(self.gadu.logged_in.done())
+
+        self.login()
+        self.assertTrue(self.gadu.logged_in.result() is self.gadu)
+
+    def testLoginFailed(self):
+        from lqsoft.pygadu.network import WelcomePacket, LoginFailedPacket
+        self.gadu.data_received(WelcomePacket(seed=7).as_packet() + LoginFailedPacket().as_packet())
+        self.assertRaises(RuntimeError, self.gadu.logged_in.result)
+        self.assertEqual(self.loop.calls, [])
+
+    def testPing(self):
+        from lqsoft.pygadu.network import LoginPacket, PingPacket
+        self.login()
+        call = self.loop.calls[0]
+        self.assertEqual(call.delay, self.gadu.session.ping_interval)
+        self.loop.run_next()
+        self.assertEqual(self.sent(), [LoginPacket.packet_id, PingPacket.packet_id])
+        # the next one is scheduled
+        self.assertEqual(len(self.loop.calls), 1)
+
+        self.gadu.connection_lost(None)
+        self.assertTrue(self.loop.calls[0].cancelled)
+
+    def testProtocolError(self):
+        self.gadu.data_received(struct.pack('<II', 0x01, 2**30))
+        self.assertTrue(self.transport.closed)
+        self.assertFalse(self.gadu.logged_in.done())
+
+    def testHandlers(self):
+        from lqsoft.pygadu.network import MessageAckPacket
+        received = []
+        self.gadu.handleMessageAckPacket = received.append
+        self.gadu.data_received(MessageAckPacket(seq=3).as_packet())
+        self.assertEqual([msg.seq for msg in received], [3])
+
+if __name__ == '__main__':
+    unittest.main()
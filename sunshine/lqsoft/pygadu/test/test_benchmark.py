@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+
+class BenchmarkTest(unittest.TestCase):
+
+    def testPayloads(self):
+        from lqsoft.pygadu import benchmark
+
+        for (klass, id, is_out) in benchmark.Resolver.packets():
+            data = benchmark.payload(klass).pack()
+            packet, offset = klass.unpack(data)
+            self.assertEqual(offset, len(data))
+            # incoming status lists decode to records, not structs
+            if is_out:
+                self.assertEqual(packet.pack(), data)
+
+    def testCompare(self):
+        from lqsoft.pygadu import benchmark
+
+        baseline = {'cases': {'A': {'pack_us': 10.0, 'unpack_us': 10.0, 'retained_gc_objects': 4}}}
+        results = {'cases': {'A': {'pack_us': 10.5, 'unpack_us': 12.0, 'retained_gc_objects': 4}, \
+            'B': {'pack_us': 1.0, 'unpack_us': 1.0, 'retained_gc_objects': 1}}}
+        self.assertEqual(benchmark.compare(results, baseline, 0.1), [('A', 'unpack_us', 10.0, 12.0)])
+        self.assertEqual(benchmark.compare(results, baseline, 0.25), [])
+        # baselines of older versions, without some metrics
+        del baseline['cases']['A']['retained_gc_objects']
+        self.assertEqual(benchmark.compare(results, baseline, 0.25), [])
+
+if __name__ == '__main__':
+    unittest.main()
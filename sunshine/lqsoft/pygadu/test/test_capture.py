@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+class CaptureTest(unittest.TestCase):
+
+    def capture(self, frames):
+        from StringIO import StringIO
+        from lqsoft.pygadu.capture import CaptureWriter
+        times = iter([100.0] + [100.0 + t for (t, _, _) in frames])
+        output = StringIO()
+        output.close = lambda: None
+        writer = CaptureWriter(output, lambda: next(times))
+        for (_, direction, data) in frames:
+            writer.record(direction, data)
+        return output.getvalue()
+
+    def traffic(self):
+        from lqsoft.pygadu.capture import RECEIVED, SENT
+        from lqsoft.pygadu.fake_server import FakeGaduServer, Scenario
+        from lqsoft.pygadu.network import WelcomePacket, LoginOKPacket
+        message = str(FakeGaduServer(Scenario()).message_template())
+        stream = WelcomePacket(seed=7).as_packet() + LoginOKPacket().as_packet() + message * 3
+        # split in the middle of packets, as TCP would
+        return [(0.5, RECEIVED, stream[:10]), (0.75, RECEIVED, stream[10:12]), \
+            (0.75, SENT, 'login'), (1.0, RECEIVED, stream[12:40]), (2.5, RECEIVED, stream[40:])]
+
+    def testRoundTrip(self):
+        from StringIO import StringIO
+        from lqsoft.pygadu.capture import read_capture, Frame
+        data = self.capture(self.traffic())
+        frames = list(read_capture(StringIO(data)))
+        self.assertEqual(frames, [Frame(d, t, chunk) for (t, d, chunk) in self.traffic()])
+        # a record cut short ends the capture
+        self.assertEqual(list(read_capture(StringIO(data[:-1]))), frames[:-1])
+        self.assertRaises(ValueError, list, read_capture(StringIO('GGCAP')))
+
+    def testReplay(self):
+        from StringIO import StringIO
+        from lqsoft.pygadu.capture import read_capture, replay, replay_client
+        frames = list(read_capture(StringIO(self.capture(self.traffic()))))
+        client = replay_client()
+        reports = []
+        replay(frames, client).addCallback(reports.append)
+        report = reports[0]
+        self.assertEqual((report.frames, report.bytes), (4, sum(len(f.data) for f in frames) - 5))
+        self.assertEqual(report.packets['MessageInPacket'].count, 3)
+        self.assertTrue(report.packets['MessageInPacket'].handle > 0)
+        self.assertEqual(report.packets['WelcomePacket'].count, 1)
+        client.flushPackets()
+        # RecvMsgAck headers
+        self.assertEqual(client.transport.value().count(struct.pack('<II', 0x46, 4)), 3)
+
+    def testTiming(self):
+        from StringIO import StringIO
+        from twisted.internet import task
+        from lqsoft.pygadu.capture import read_capture, replay, replay_client
+        frames = list(read_capture(StringIO(self.capture(self.traffic()))))
+        clock = task.Clock()
+        reports = []
+        replay(frames, replay_client(), True, 2.0, clock).addCallback(reports.append)
+        clock.advance(0.25)
+        self.assertEqual(reports, [])
+        clock.advance(1.0)
+        self.assertEqual(reports[0].frames, 4)
+
+    def testStartCapture(self):
+        import os, tempfile
+        from twisted.internet import task
+        from lqsoft.pygadu.capture import load_capture, replay_client, RECEIVED, SENT
+        from lqsoft.pygadu.network import WelcomePacket
+        clock = task.Clock()
+        client = replay_client(clock=clock)
+        path = tempfile.mktemp()
+        try:
+            client.startCapture(path)
+            clock.advance(1.5)
+            client.dataReceived(WelcomePacket(seed=7).as_packet())
+            client.connectionLost(None)
+            self.assertEqual(client.capture, None)
+            frames = load_capture(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual([(f.direction, f.time) for f in frames], [(RECEIVED, 1.5), (SENT, 1.5)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.pygadu.test import ClientTestCase
+
+class DispatchTest(ClientTestCase):
+
+    def setUp(self):
+        self.createClient()
+
+    def testUnknownPackets(self):
+        from lqsoft.pygadu.network import MessageAckPacket
+
+        received = []
+        self.client.subscribe('MessageAckPacket', received.append)
+        ack = MessageAckPacket(msg_status=2, recipient=3, seq=4).as_packet()
+        self.client.dataReceived(struct.pack('<II', 0x7777, 6) + 'abc')
+        self.client.dataReceived('def' + ack)
+
+        self.assertEqual(self.client.unknown_packets, {0x7777: 1})
+        self.assertEqual([msg.seq for msg in received], [4])
+
+    def testSubscribe(self):
+        from lqsoft.pygadu.network import MessageAckPacket
+
+        events = []
+        subscriber = lambda msg: events.append(('subscriber', msg.seq))
+        self.client.subscribe(MessageAckPacket, subscriber)
+        self.client._route(MessageAckPacket).handler = lambda msg: events.append(('handler', msg.seq))
+
+        self.client.dataReceived(MessageAckPacket(seq=1).as_packet())
+        self.client.unsubscribe(MessageAckPacket, subscriber)
+        self.client.dataReceived(MessageAckPacket(seq=2).as_packet())
+        self.assertEqual(events, [('subscriber', 1), ('handler', 1), ('handler', 2)])
+
+    def testDropsConnection(self):
+        self.client.dataReceived(struct.pack('<II', 0x01, self.client.max_packet_length + 1))
+        self.assertTrue(self.client.transport.disconnecting)
+
+    def testBrokenLazyPacket(self):
+        from lqsoft.pygadu.fake_server import FakeGaduServer, Scenario
+        logged, contents = [], []
+        self.client._log = logged.append
+        self.client.subscribe('MessageInPacket', lambda msg: contents.append(msg.content))
+
+        message = str(FakeGaduServer(Scenario()).message_template())
+        # content cut short - only the lazily decoded field is broken
+        body = message[8:22]
+        self.client.dataReceived(struct.pack('<II', 0x2e, len(body)) + body)
+        self.client.dataReceived(message)
+
+        self.assertEqual(len(contents), 1)
+        self.assertEqual([msg for msg in logged if msg.startswith('Ommiting')], \
+            ['Ommiting message with type 46: unpack_from requires a buffer of at least 12 bytes.'])
+        self.assertFalse(self.client.transport.disconnecting)
+
+class ImportRequestTest(ClientTestCase):
+
+    def setUp(self):
+        self.createClient()
+        self.failures = []
+        self.client._log_failure = self.failures.append
+        self.books = []
+
+    def reply(self, data):
+        from lqsoft.pygadu.network import ULReplyPacket
+        packet = ULReplyPacket(type=0x00, version=5, data=data).as_packet()
+        # in pieces, so the list is streamed
+        for i in xrange(0, len(packet), 7):
+            self.client.dataReceived(packet[i:i + 7])
+
+    def testImport(self):
+        import zlib
+        self.client.sendImportRequest(self.books.append)
+        self.reply(zlib.compress('<ContactBook><Contacts/></ContactBook>'))
+        self.assertEqual([book.tag for book in self.books], ['ContactBook'])
+        self.assertEqual(self.client.clistversion, 5)
+
+    def testBrokenList(self):
+        import zlib
+        import xml.etree.ElementTree as ET
+        for (data, error) in [('not zlib data at all', zlib.error), \
+                (zlib.compress('<ContactBook><Contacts>'), ET.ParseError)]:
+            self.client.sendImportRequest(self.books.append)
+            self.reply(data)
+            self.assertEqual(self.books, [])
+            self.assertTrue(self.failures.pop().check(error))
+            self.assertFalse(self.client.transport.disconnecting)
+
+        # the next request isn't blocked
+        self.client.sendImportRequest(self.books.append)
+        self.reply(zlib.compress('<ContactBook/>'))
+        self.assertEqual(len(self.books), 1)
+
+    def testShortReply(self):
+        import zlib
+        from lqsoft.pygadu.network import MessageAckPacket
+        acks = []
+        self.client.subscribe(MessageAckPacket, acks.append)
+        self.client.sendImportRequest(self.books.append)
+        self.client.dataReceived(struct.pack('<II', 0x41, 2) + 'ab')
+        self.assertEqual(self.books, [])
+        self.assertTrue(self.failures.pop().check(ValueError))
+
+        # the connection goes on
+        self.client.dataReceived(MessageAckPacket(seq=1).as_packet())
+        self.assertEqual([msg.seq for msg in acks], [1])
+        self.client.sendImportRequest(self.books.append)
+        self.reply(zlib.compress('<ContactBook/>'))
+        self.assertEqual(len(self.books), 1)
+
+    def testUnexpectedReply(self):
+        import zlib
+        self.reply(zlib.compress('<ContactBook/>'))
+        self.assertEqual((self.books, self.failures), ([], []))
+
+if __name__ == '__main__':
+    unittest.main()
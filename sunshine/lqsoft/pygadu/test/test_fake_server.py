@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+
+from lqsoft.pygadu.test import contacts as make_contacts
+
+class FakeServerTest(unittest.TestCase):
+
+    def connect(self, scenario, password='secret', contacts=0, messages=0):
+        from twisted.internet import task
+        from twisted.test import iosim
+        from lqsoft.pygadu.twisted_protocol import GaduClient
+        from lqsoft.pygadu.fake_server import FakeGaduServer, LoadProfile
+
+        clock = self.clock = task.Clock()
+        finished = self.finished = []
+        self.profile = LoadProfile(100, password, contacts, messages, finished.append)
+        for contact in make_contacts(xrange(1000, 1000 + contacts)):
+            self.profile.addContact(contact)
+
+        def server():
+            self.server = FakeGaduServer(scenario)
+            self.server.clock = clock
+            return self.server
+
+        def client():
+            self.client = GaduClient(self.profile)
+            self.client._log = lambda msg: None
+            self.client.clock = clock
+            self.client.cooperator = task.Cooperator(scheduler=lambda call: clock.callLater(0, call))
+            return self.client
+
+        _, _, self.pump = iosim.connectedServerAndClient(server, client)
+
+    def run_for(self, ticks=20):
+        for _ in xrange(ticks):
+            self.clock.advance(0)
+            self.pump.flush()
+
+    def tearDown(self):
+        if getattr(self, 'pump', None) is not None:
+            self.client.transport.loseConnection()
+            self.server.transport.loseConnection()
+            self.pump.flush()
+
+    def testSession(self):
+        from lqsoft.pygadu.fake_server import Scenario
+        self.connect(Scenario(password='secret', messages=250), contacts=450, messages=250)
+        self.run_for()
+        self.assertEqual(len(self.finished), 1)
+        self.assertEqual((self.profile.statuses, self.profile.messages), (450, 250))
+        self.assertEqual(self.server.notices, range(1000, 1450))
+        self.assertEqual(self.server.stats.acks, 250)
+
+    def testWrongPassword(self):
+        from lqsoft.pygadu.fake_server import Scenario
+        self.connect(Scenario(password='secret'), password='wrong')
+        self.client.loginSuccess.addErrback(lambda failure: None)
+        self.run_for()
+        self.assertEqual(self.profile.logged_in, None)
+        self.assertEqual(self.server.stats.logins, 0)
+
+    def testSteps(self):
+        from lqsoft.pygadu.fake_server import Scenario
+        from lqsoft.pygadu.network import XmlEventPacket
+        events = []
+        self.connect(Scenario(contacts=3, steps=[(5.0, lambda server: server.send( \
+            XmlEventPacket(data='<event/>')))]))
+        self.profile.onXmlEvent = events.append
+        self.run_for()
+        self.assertEqual(events, [])
+        self.clock.advance(5.0)
+        self.run_for()
+        self.assertEqual([event.data for event in events], ['<event/>'])
+
+        books = []
+        self.client.sendImportRequest(books.append)
+        self.run_for()
+        self.assertEqual([c.find('GGNumber').text for c in books[0].find('Contacts')], \
+            ['1000', '1001', '1002'])
+
+    def testAppMsg(self):
+        from twisted.web.test.requesthelper import DummyRequest
+        from lqsoft.pygadu.fake_server import AppMsgResource, parse_appmsg
+        reply = AppMsgResource('127.0.0.1', 18074).render_GET(DummyRequest(['']))
+        self.assertEqual(parse_appmsg(reply), ('127.0.0.1', 18074))
+        self.assertEqual(parse_appmsg('0 0 1.2.3.4:8074 notoperating'), None)
+
+class LoadProfileTest(unittest.TestCase):
+
+    def testStatusesBeforeMessages(self):
+        from lqsoft.pygadu.fake_server import LoadProfile
+        finished = []
+        profile = LoadProfile(100, 'secret', 2, 3, finished.append)
+        profile.onLoginSuccess()
+        for _ in xrange(3):
+            profile.onContactStatusChange(None)
+        # more statuses than expected, but no messages yet
+        self.assertEqual((finished, profile.finished), ([], None))
+        for _ in xrange(3):
+            profile.onMessageReceived(None)
+        self.assertEqual(finished, [profile])
+        self.assertNotEqual(profile.finished, None)
+
+if __name__ == '__main__':
+    unittest.main()
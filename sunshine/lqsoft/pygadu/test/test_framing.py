@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+class FramerTest(unittest.TestCase):
+
+    def setUp(self):
+        from lqsoft.pygadu.framing import PacketFramer, FramingError
+        self.framer = PacketFramer(max_length=64)
+        self.FramingError = FramingError
+
+    def testPieces(self):
+        stream = struct.pack('<II', 5, 3) + 'abc' + struct.pack('<II', 6, 0) + struct.pack('<II', 7, 1) + 'x'
+        packets = []
+        for char in stream:
+            self.framer.feed(char)
+            hdr = self.framer.header()
+            if hdr is not None:
+                packets.append( [hdr, ''] )
+            if packets and len(packets[-1][1]) < packets[-1][0].msg_length:
+                packets[-1][1] += self.framer.read(packets[-1][0].msg_length - len(packets[-1][1])).tobytes()
+        self.assertEqual([(hdr.msg_type, hdr.msg_length, body) for (hdr, body) in packets], \
+            [(5, 3, 'abc'), (6, 0, ''), (7, 1, 'x')])
+        self.assertEqual(self.framer.available, 0)
+
+    def testMaxLength(self):
+        self.framer.feed(struct.pack('<II', 5, 65))
+        self.assertRaises(self.FramingError, self.framer.header)
+        self.assertEqual(self.framer.available, 8)
+
+    def testViewAlive(self):
+        self.framer.feed('abcdef')
+        view = self.framer.read(4)
+        self.framer.feed('gh')
+        self.assertEqual(view.tobytes(), 'abcd')
+        self.assertEqual(self.framer.read(4).tobytes(), 'efgh')
+
+if __name__ == '__main__':
+    unittest.main()
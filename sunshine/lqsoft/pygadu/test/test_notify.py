@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.pygadu.test import ClientTestCase, contacts
+
+class NotifyListTest(ClientTestCase):
+
+    def setUp(self):
+        from twisted.internet import task
+
+        self.createClient(connect=False)
+        self.ticks = task.Clock()
+        # one chunk per tick()
+        self.client.cooperator = task.Cooperator( \
+            terminationPredicateFactory=lambda: lambda: True, \
+            scheduler=lambda call: self.ticks.callLater(1, call))
+        self.client.notice_chunk_size = 3
+        self.client.connectionMade()
+
+    def tick(self, count=1):
+        for _ in xrange(count):
+            self.ticks.advance(1)
+            self.clock.advance(0)
+
+    def contacts(self, count):
+        return contacts(xrange(1, count + 1))
+
+    def sent(self):
+        from lqsoft.pygadu.network import NoticeFirstPacket, NoticeLastPacket
+        data, packets = self.client.transport.value(), []
+        while data:
+            msg_type, length = struct.unpack_from('<II', data)
+            klass = {NoticeFirstPacket.packet_id: NoticeFirstPacket, \
+                NoticeLastPacket.packet_id: NoticeLastPacket}.get(msg_type)
+            body, data = data[8:8 + length], data[8 + length:]
+            uins = klass and [n.uin for n in klass.unpack(body)[0].contacts]
+            packets.append( (msg_type, uins) )
+        return packets
+
+    def testChunks(self):
+        from lqsoft.pygadu.network import NoticeFirstPacket, NoticeLastPacket
+        done = []
+        self.client.sendNotifyList(self.contacts(7)).addCallback(done.append)
+        self.assertEqual(self.sent(), [])
+        self.tick()
+        # the first chunk is written, while the second one is packed
+        self.assertEqual(self.sent(), [(NoticeFirstPacket.packet_id, [1, 2, 3])])
+        self.tick(4)
+        self.assertEqual(self.sent(), [(NoticeFirstPacket.packet_id, [1, 2, 3]), \
+            (NoticeFirstPacket.packet_id, [4, 5, 6]), (NoticeLastPacket.packet_id, [7])])
+        self.assertEqual(len(done), 1)
+
+    def testExactChunks(self):
+        from lqsoft.pygadu.network import NoticeFirstPacket, NoticeLastPacket
+        self.client.sendNotifyList(self.contacts(3))
+        self.tick(3)
+        self.assertEqual(self.sent(), [(NoticeLastPacket.packet_id, [1, 2, 3])])
+
+    def testNoContacts(self):
+        from lqsoft.pygadu.network import NoNoticesPacket
+        self.client.sendNotifyList([])
+        self.tick(3)
+        self.assertEqual(self.sent(), [(NoNoticesPacket.packet_id, None)])
+
+    def testPausedTransport(self):
+        from twisted.test.proto_helpers import StringTransport
+        self.client.send_chunk_size = 0
+        self.client.transport = StringTransport()
+        self.client.connectionMade()
+        self.client.transport.producer.pauseProducing()
+        self.client.sendNotifyList(self.contacts(30))
+        self.tick(5)
+        # waits for the first chunk to be written
+        self.assertEqual(self.client.sendQueueDepth()['bulk'], 1)
+        self.client.transport.producer.resumeProducing()
+        self.tick(20)
+        self.assertEqual([uin for (_, uins) in self.sent() for uin in uins], range(1, 31))
+
+    def testConnectionLost(self):
+        self.client.sendNotifyList(self.contacts(30))
+        self.tick()
+        self.client.connectionLost(None)
+        self.tick(20)
+        self.assertEqual(len(self.sent()), 1)
+
+    def testDiff(self):
+        from lqsoft.pygadu.network import NoticeFirstPacket, NoticeLastPacket
+        self.client.sendNotifyList(self.contacts(4))
+        self.tick(3)
+        self.assertEqual(self.client.notified_uins, set([1, 2, 3, 4]))
+
+        uploads = []
+        contacts = self.contacts(9)
+        self.client.addNewContacts(contacts + contacts[-1:]).addCallback(uploads.append)
+        self.tick(3)
+        self.assertEqual(self.sent()[2:], [(NoticeFirstPacket.packet_id, [5, 6, 7]), \
+            (NoticeLastPacket.packet_id, [8, 9])])
+
+        upload = uploads[0]
+        self.assertEqual((upload.requested, upload.contacts, upload.packets), (10, 5, 2))
+        self.assertEqual(upload.saved_packets, 8)
+        self.assertEqual(upload.saved_bytes, 10 * 13 - (8 + 3 * 5) - (8 + 2 * 5))
+
+    def testNothingNew(self):
+        self.client.notified_uins.update([1, 2])
+        uploads = []
+        self.client.addNewContacts(self.contacts(2)).addCallback(uploads.append)
+        self.tick(2)
+        self.assertEqual(self.sent(), [])
+        self.assertEqual((uploads[0].packets, uploads[0].saved_packets), (0, 2))
+
+    def testImportContacts(self):
+        import xml.etree.ElementTree as ET
+        from lqsoft.pygadu.network import NoticeLastPacket
+        profile = self.client.user_profile
+        profile._loginSuccess(self.client)
+        self.client.notified_uins.add(1)
+        self.client.sendImportRequest = lambda callback: callback(ET.fromstring( \
+            '<ContactBook><Groups/><Contacts>%s</Contacts></ContactBook>' % ''.join( \
+            '<Contact><Guid>%d</Guid><GGNumber>%d</GGNumber><ShowName>%d</ShowName></Contact>' \
+            % (uin, uin, uin) for uin in [1, 2, 2, 3])))
+
+        imported, logged = [], []
+        self.client._log = logged.append
+        profile.importContacts(lambda: imported.append(True))
+        self.tick(2)
+        self.assertEqual(self.sent(), [(NoticeLastPacket.packet_id, [2, 3])])
+        self.assertEqual(imported, [True])
+        self.assertEqual((profile.last_import.requested, profile.last_import.saved_packets), (3, 2))
+        self.assertTrue("Imported contacts, sent notices: %s." % profile.last_import in logged)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+from lqsoft.cstruct.fields.text import CStruct_VarString
+
+class PacketTemplateTest(unittest.TestCase):
+
+    def setUp(self):
+        # registers the packet classes
+        import lqsoft.pygadu.network
+        from lqsoft.pygadu.packets import Resolver
+        self.Resolver = Resolver
+
+    def assertSameAsPacket(self, name, **values):
+        klass = self.Resolver.by_name(name)
+        data = self.Resolver.template(name).pack(**values)
+        self.assertEqual(data, klass(**values).as_packet())
+        return data
+
+    def testFixedPackets(self):
+        from lqsoft.pygadu.network import StructNotice
+
+        self.assertSameAsPacket('PingPacket')
+        self.assertSameAsPacket('NoNoticesPacket')
+        self.assertSameAsPacket('RecvMsgAck', num=42)
+        self.assertSameAsPacket('TypingNotifyPacket', uin=1234, type=3)
+
+        data = self.Resolver.template('AddNoticePacket').pack(contact__uin=5)
+        klass = self.Resolver.by_name('AddNoticePacket')
+        self.assertEqual(data, klass(contact=StructNotice(uin=5)).as_packet())
+
+    def testFallback(self):
+        template = self.Resolver.template('MessageOutPacket')
+        self.assertEqual(template.struct, None)
+        from lqsoft.pygadu.network import StructMessage, StructMsgAttrs
+
+        content = StructMessage(html_message='<b>x</b>\0', plain_message='x\0', \
+            attrs=StructMsgAttrs())
+        self.assertSameAsPacket('MessageOutPacket', recipient=7, content=content)
+
+    def testUnknownField(self):
+        template = self.Resolver.template('RecvMsgAck')
+        self.assertRaises(TypeError, template.pack, number=1)
+
+    def testPackInto(self):
+        buf = bytearray('xx')
+        end = self.Resolver.template('RecvMsgAck').pack_into(buf, 2, num=1)
+        self.assertEqual(end, len(buf))
+        self.assertEqual(str(buf[2:]), self.Resolver.template('RecvMsgAck').pack(num=1))
+
+class StatusScannerTest(unittest.TestCase):
+
+    def setUp(self):
+        from lqsoft.pygadu.network import StructStatus, StatusNoticiesPacket
+
+        self.statuses = [StructStatus(uin=1, status=2, flags=3, remote_ip=4, remote_port=5, \
+                image_size=6, reserved01=-7, reserved02=8, description=CStruct_VarString(text='away')),
+            StructStatus(uin=9)]
+        self.data = ''.join(s.pack() for s in self.statuses)
+        self.StructStatus = StructStatus
+        self.StatusNoticiesPacket = StatusNoticiesPacket
+
+    def testSameAsStruct(self):
+        names = [field.name for field in self.StructStatus._field_order]
+        for unpack in (self.StatusNoticiesPacket.unpack, self.StatusNoticiesPacket.unpack_reference):
+            packet, offset = unpack(memoryview(self.data), trusted=True)
+            self.assertEqual(offset, len(self.data))
+            self.assertEqual(len(packet.contacts), 2)
+            for (record, status) in zip(packet.contacts, self.statuses):
+                for name in names[:-1]:
+                    self.assertEqual(getattr(record, name), getattr(status, name))
+                self.assertEqual(record.description.text, status.description.text)
+                self.assert_(isinstance(record.description.text, str))
+
+    def testTruncated(self):
+        for unpack in (self.StatusNoticiesPacket.unpack, self.StatusNoticiesPacket.unpack_reference):
+            self.assertRaises(struct.error, unpack, self.data[:-3])
+            self.assertRaises(struct.error, unpack, self.data[:30])
+
+    def testStatusUpdate(self):
+        from lqsoft.pygadu.network import StatusUpdatePacket, StatusRecord
+        data = self.statuses[0].pack()
+        for unpack in (StatusUpdatePacket.unpack, StatusUpdatePacket.unpack_reference):
+            packet = unpack(data, trusted=True)[0]
+            # the same records as in status lists
+            self.assertEqual(type(packet.contact), StatusRecord)
+            self.assertEqual(packet.contact, self.StatusNoticiesPacket.unpack(data)[0].contacts[0])
+
+    def testDifferential(self):
+        from lqsoft.cstruct import differential
+        from lqsoft.pygadu import network_v8
+        # a broken scanner - reserved01 is signed
+        prefix = network_v8.STATUS_PREFIX
+        network_v8.STATUS_PREFIX = struct.Struct('<iiiihBBiI')
+        try:
+            divergences, _ = differential.run([self.StatusNoticiesPacket], rounds=20)[self.StatusNoticiesPacket]
+        finally:
+            network_v8.STATUS_PREFIX = prefix
+        self.assertTrue(divergences)
+        self.assertEqual(set(d.what for d in divergences), set(['unpack']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+
+from twisted.test.proto_helpers import StringTransport
+
+from lqsoft.pygadu.test import ClientTestCase
+
+class Transport(StringTransport):
+    # keeps every write separately
+    def __init__(self):
+        StringTransport.__init__(self)
+        self.writes = []
+
+    def writeSequence(self, data):
+        self.writes.append(''.join(data))
+
+class SendSchedulerTest(ClientTestCase):
+
+    def setUp(self):
+        from lqsoft.pygadu.packets import Resolver
+
+        self.createClient(Transport(), connect=False)
+        self.notice = Resolver.template('AddNoticePacket').pack(contact__uin=5)
+        self.typing = Resolver.template('TypingNotifyPacket').pack(uin=5, type=1)
+        self.ack = Resolver.template('RecvMsgAck').pack(num=1)
+
+    def addContact(self):
+        from lqsoft.pygadu.twisted_protocol import PRIORITY_BULK
+        self.client._sendTemplate('AddNoticePacket', PRIORITY_BULK, contact__uin=5)
+
+    def testOncePerTick(self):
+        self.client.connectionMade()
+        self.assertTrue(self.client.transport.streaming)
+        for _ in xrange(3):
+            self.addContact()
+        self.assertEqual(self.client.transport.writes, [])
+        self.assertEqual(self.client.sendQueueDepth(), \
+            {'control': 0, 'interactive': 0, 'bulk': 3})
+        self.clock.advance(0)
+        self.assertEqual(self.client.transport.writes, [self.notice * 3])
+        self.clock.advance(0)
+        self.assertEqual(len(self.client.transport.writes), 1)
+
+    def testPriorities(self):
+        self.client.connectionMade()
+        self.addContact()
+        self.client.sendTypingNotify(5, 1)
+        self.client.sendMsgAck(1)
+        # control packets go out right away, ahead of the queued ones
+        self.assertEqual(self.client.transport.writes, [self.ack + self.typing + self.notice])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testBackpressure(self):
+        self.client.connectionMade()
+        producer = self.client.transport.producer
+        producer.pauseProducing()
+        self.addContact()
+        self.client.sendTypingNotify(5, 1)
+        self.client.sendMsgAck(1)
+        self.clock.advance(0)
+        self.assertEqual(self.client.transport.writes, [])
+        self.assertEqual(self.client.sendQueueDepth(), \
+            {'control': 1, 'interactive': 1, 'bulk': 1})
+        producer.resumeProducing()
+        self.assertEqual(self.client.transport.writes, [self.ack + self.typing + self.notice])
+        self.assertEqual(self.client.sendQueueDepth(), \
+            {'control': 0, 'interactive': 0, 'bulk': 0})
+
+    def testChunkSize(self):
+        self.client.send_chunk_size = 2 * len(self.notice)
+        self.client.connectionMade()
+        for _ in xrange(3):
+            self.addContact()
+        self.assertEqual(self.client.transport.writes, [self.notice * 2])
+        self.client.sendTypingNotify(5, 1)
+        self.clock.advance(0)
+        # whole packets only - these two don't fit in one chunk
+        self.assertEqual(self.client.transport.writes, \
+            [self.notice * 2, self.typing, self.notice])
+
+    def testConnectionLost(self):
+        self.client.connectionMade()
+        self.addContact()
+        self.client.connectionLost(None)
+        self.assertEqual(self.client.sendQueueDepth()['bulk'], 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+if __name__ == '__main__':
+    unittest.main()
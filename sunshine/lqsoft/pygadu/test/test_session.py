@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+
+import unittest
+import struct
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        from lqsoft.pygadu.session import GaduSession
+        self.session = GaduSession(streamed=['ULReplyPacket'])
+
+    def testHandshake(self):
+        import hashlib
+        from lqsoft.pygadu import session
+        from lqsoft.pygadu.network import WelcomePacket, LoginPacket, LoginOKPacket
+
+        self.assertRaises(RuntimeError, self.session.send_login, 1234, hashlib.new('sha1'))
+        events = self.session.feed(WelcomePacket(seed=7).as_packet())
+        self.assertEqual([type(e.packet) for e in events], [WelcomePacket])
+        self.assertEqual((self.session.state, self.session.seed), (session.STATE_WELCOME, 7))
+
+        password = hashlib.new('sha1')
+        password.update('secret')
+        data = self.session.send_login(1234, password, 0x14)
+        login = LoginPacket.unpack(data[8:])[0]
+        self.assertEqual((login.uin, login.status), (1234, 0x14))
+        self.assertEqual(login.login_hash[:20], hashlib.sha1('secret' + struct.pack('<i', 7)).digest())
+        self.assertEqual(self.session.state, session.STATE_LOGGING_IN)
+
+        self.session.feed(LoginOKPacket().as_packet())
+        self.assertEqual(self.session.state, session.STATE_CONNECTED)
+
+    def testStreamedChunks(self):
+        from lqsoft.pygadu.session import PacketChunk, PacketReceived
+        from lqsoft.pygadu.network import ULReplyPacket
+        data = ULReplyPacket(type=0, version=3, data='x' * 100).as_packet()
+        events = []
+        for i in xrange(0, len(data), 30):
+            events.extend(self.session.feed(data[i:i + 30]))
+        chunks = [e for e in events if isinstance(e, PacketChunk)]
+        self.assertEqual(''.join(e.data for e in chunks), 'x' * 100)
+        self.assertEqual(chunks[0].values['type'], 0)
+        self.assertTrue(isinstance(events[-1], PacketReceived))
+        self.assertEqual(events[-1].packet.version, 3)
+
+    def testProtocolError(self):
+        from lqsoft.pygadu.session import ProtocolError, STATE_CLOSED
+        from lqsoft.pygadu.network import WelcomePacket
+        events = self.session.feed(struct.pack('<II', 0x01, 2**30))
+        self.assertTrue(isinstance(events[0], ProtocolError))
+        self.assertEqual(self.session.state, STATE_CLOSED)
+        self.assertEqual(self.session.feed(WelcomePacket(seed=7).as_packet()), [])
+
+    def testBrokenPacket(self):
+        from lqsoft.pygadu.session import PacketSkipped, PacketReceived
+        from lqsoft.pygadu.network import StatusNoticiesPacket, StructStatus, WelcomePacket
+        data = StatusNoticiesPacket(contacts=[StructStatus(uin=1)]).as_packet()
+        # the length of the record is right, the one of the description isn't
+        body = data[8:-4] + struct.pack('<I', 5)
+        events = self.session.feed(struct.pack('<II', 0x37, len(body)) + body \
+            + WelcomePacket(seed=7).as_packet())
+        self.assertEqual([type(e) for e in events], [PacketSkipped, PacketReceived])
+        self.assertEqual(events[1].packet.seed, 7)
+
+    def testBrokenStreamedPacket(self):
+        from lqsoft.pygadu.session import PacketSkipped, PacketReceived
+        from lqsoft.pygadu.network import WelcomePacket
+        # a reply too short for its own header fields
+        events = self.session.feed(struct.pack('<II', 0x41, 2) + 'ab')
+        self.assertEqual([type(e) for e in events], [PacketSkipped])
+        events = self.session.feed(WelcomePacket(seed=7).as_packet())
+        self.assertEqual([type(e) for e in events], [PacketReceived])
+        self.assertEqual(events[0].packet.seed, 7)
+
+    def testSendStatus(self):
+        from lqsoft.pygadu.network import ChangeStatusPacket
+        STATUS = ChangeStatusPacket.STATUS
+        for (name, desc, code) in [('BUSY', '', STATUS.BUSY), ('BUSY', 'zaraz', STATUS.BUSY_DESC), \
+                ('BLOCKED', 'x', STATUS.NOT_AVAILABLE)]:
+            packet = ChangeStatusPacket.unpack(self.session.send_status(name, desc)[8:])[0]
+            self.assertEqual((packet.status, packet.description), (code, desc))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,17 +2,188 @@
 __author__="lreqc"
 __date__ ="$2009-07-14 05:51:00$"
 
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, succeed
 from twisted.internet.protocol import Protocol
-from twisted.internet import task
+from twisted.internet import reactor, task
+from twisted.internet.interfaces import IPushProducer
 import twisted.python.log as tlog
+from zope.interface import implements
 
 from sunshine.lqsoft.pygadu.network import *
 from sunshine.lqsoft.pygadu.packets import Resolver
-
-import struct, time
+from sunshine.lqsoft.pygadu.framing import MAX_PACKET_LENGTH
+from sunshine.lqsoft.pygadu.capture import CaptureWriter
+from sunshine.lqsoft.pygadu.session import GaduSession, PacketReceived, PacketChunk, \
+    PacketSkipped, ProtocolError, DECODE_ERRORS, skipped
+
+import itertools, logging, time, zlib
+import xml.etree.ElementTree as ET
+from collections import deque
+
+# priorities of outgoing packets, the first ones are sent first
+PRIORITY_CONTROL, PRIORITY_INTERACTIVE, PRIORITY_BULK = range(3)
+PRIORITY_NAMES = ('control', 'interactive', 'bulk')
+
+class SendScheduler(object):
+    """Queues of outgoing packets, one for every priority. Queued packets
+        are written once per reactor iteration, higher priorities first,
+        at most chunk_size bytes with a single writeSequence() call.
+
+        The scheduler is a push producer of the transport: while the
+        transport buffer is full, packets wait in their queues, so control
+        packets still get ahead of the bulk ones that are waiting."""
+    implements(IPushProducer)
+
+    def __init__(self, clock, chunk_size=64 * 1024):
+        self.clock = clock
+        self.chunk_size = chunk_size
+        self.transport = None
+        self.paused = False
+        self.__queues = [deque() for _ in PRIORITY_NAMES]
+        self.__sizes = [0 for _ in PRIORITY_NAMES]
+        self.__flush_call = None
+        self.__drain_waiters = []
+
+    def attach(self, transport):
+        self.transport = transport
+        self.paused = False
+        transport.registerProducer(self, True)
+
+    def detach(self):
+        """Drop all the queued packets"""
+        self.__cancel()
+        self.transport = None
+        for queue in self.__queues:
+            queue.clear()
+        self.__sizes = [0 for _ in PRIORITY_NAMES]
+        self.__drain_waiters = []
+
+    def depth(self, priority):
+        """Number of queued packets of the priority"""
+        return len(self.__queues[priority])
+
+    def queued_bytes(self, priority=None):
+        """Size of the packets queued with the priority, or all of them"""
+        if priority is None:
+            return sum(self.__sizes)
+        return self.__sizes[priority]
+
+    def drained(self, priority):
+        """Deferred fired when there are no queued packets of the priority"""
+        if not self.__queues[priority]:
+            return succeed(None)
+        d = Deferred()
+        self.__drain_waiters.append( (priority, d) )
+        return d
+
+    def send(self, data, priority):
+        """Queue the packed packet data. Control packets are written
+            right away, unless the transport is paused."""
+        self.__queues[priority].append(data)
+        self.__sizes[priority] += len(data)
+        if priority == PRIORITY_CONTROL or self.queued_bytes() >= self.chunk_size:
+            self.flush()
+        elif self.__flush_call is None:
+            self.__flush_call = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        """Write the queued packets, until the transport pauses us"""
+        self.__cancel()
+        while not self.paused and self.transport is not None:
+            chunk = self.__take(self.chunk_size)
+            if not chunk:
+                break
+            self.transport.writeSequence(chunk)
+
+        if self.__drain_waiters:
+            waiters, self.__drain_waiters = self.__drain_waiters, []
+            for (priority, d) in waiters:
+                if self.__queues[priority]:
+                    self.__drain_waiters.append( (priority, d) )
+                else:
+                    d.callback(None)
+
+    def __take(self, limit):
+        # whole packets only, at least one
+        chunk, size = [], 0
+        for (priority, queue) in enumerate(self.__queues):
+            while queue and (not chunk or size + len(queue[0]) <= limit):
+                data = queue.popleft()
+                self.__sizes[priority] -= len(data)
+                chunk.append(data)
+                size += len(data)
+            if queue:
+                break
+        return chunk
+
+    def __cancel(self):
+        if self.__flush_call is not None and self.__flush_call.active():
+            self.__flush_call.cancel()
+        self.__flush_call = None
+
+    # IPushProducer
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+
+    def stopProducing(self):
+        self.detach()
+
+class NoticeUpload(object):
+    """Counters of a batched notice upload. The savings are counted against
+        sending an AddNotice packet for every requested contact."""
+
+    def __init__(self, requested=0):
+        self.requested = requested
+        self.contacts = 0
+        self.packets = 0
+        self.bytes = 0
+
+    def add(self, contacts, size):
+        self.contacts += contacts
+        self.packets += 1
+        self.bytes += size
+
+    @property
+    def saved_packets(self):
+        return self.requested - self.packets
+
+    @property
+    def saved_bytes(self):
+        return self.requested * len(Resolver.template('AddNoticePacket').default) - self.bytes
+
+    def __str__(self):
+        text = "%d contacts in %d packets (%d bytes)" % (self.contacts, self.packets, self.bytes)
+        if self.requested:
+            text += ", of %d requested - saved %d packets (%d bytes)" \
+                % (self.requested, self.saved_packets, self.saved_bytes)
+        return text
+
+class PacketRoute(object):
+    """Where the received packets of one class go"""
+    __slots__ = ('klass', 'handler', 'stream', 'subscribers')
+
+    def __init__(self, klass, handler, stream):
+        self.klass = klass
+        self.handler = handler
+        # consumer of the streamed field, called with (chunk, values)
+        self.stream = stream
+        self.subscribers = []
 
 class GaduClient(Protocol):
+    # longest packet accepted from the server, the connection is dropped
+    # when a header announces a longer one
+    max_packet_length = MAX_PACKET_LENGTH
+    # outgoing packets are collected and written once per reactor
+    # iteration, or as soon as there is this many bytes of them
+    send_chunk_size = 64 * 1024
+    # contacts in a single NoticeFirst/NoticeLast packet
+    notice_chunk_size = 400
+    # a CaptureWriter recording the traffic, see startCapture()
+    capture = None
     
     def __init__(self, profile):
         self.user_profile = profile # the user connected to this client
@@ -28,15 +199,28 @@ class GaduClient(Protocol):
         self.loginSuccess.addErrback(self._onLoginFailed)
 
         self.importrq_cb = None
+        # the list streamed now was dropped - its reply is expected
+        self.import_dropped = False
         self.firstPing = True
         self.__pingThread = None
 
         self.msg_id = 0
         self.clistversion = 0
+        self.session = None
+        self.clock = reactor
+        self.cooperator = task
+        self.__routes = self._routes()
+        self.__noticeTasks = set()
 
     def connectionMade(self):
-        self.__buffer = ''        
-        self.__chdr = None
+        self.__scheduler = SendScheduler(self.clock, self.send_chunk_size)
+        self.__scheduler.attach(self.transport)
+        self.session = GaduSession(self.max_packet_length, streamed=[route.klass \
+            for route in self.__routes.itervalues() if route.stream is not None])
+        # number of packets skipped, by their type
+        self.unknown_packets = self.session.unknown_packets
+        # contacts the server sends notifications about
+        self.notified_uins = set()
         # Nie trzeba tu nic robic, bo to server pierwszy wysyła nam wiadomość
 
     def connectionLost(self, reason):
@@ -44,67 +228,111 @@ class GaduClient(Protocol):
             self.__pingThread.stop()
             self.__pingThread = None
 
-        Protocol.connectionLost(self, reason)
-
-    def __pop_data(self, n):
-        data, self.__buffer = self.__buffer[:n], self.__buffer[n:]
-        return data
+        for upload in list(self.__noticeTasks):
+            upload.stop()
+        self.__scheduler.detach()
+        self.stopCapture()
 
-    def dataReceived(self, data):
-        self.__buffer += data
+        Protocol.connectionLost(self, reason)
 
-        while True:
-            if self.__chdr is not None:
-                # if we are inside of a message
-                hdr = self.__chdr
+    def startCapture(self, path):
+        """Record the received data and the sent packets to a capture
+            file at path, until stopCapture() or the connection is lost"""
+        self.stopCapture()
+        self.capture = CaptureWriter(open(path, 'wb'), self.clock.seconds)
 
-                if len(self.__buffer) < hdr.msg_length:
-                    # not yet
-                    break
+    def stopCapture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
 
+    def dataReceived(self, data):
+        if self.capture is not None:
+            self.capture.received(data)
+        for event in self.session.feed(data):
+            if isinstance(event, PacketReceived):
                 try:
-                    msg_class = Resolver.by_IDi(hdr.msg_type)
-                except KeyError, e:
-                    self.__pop_data(hdr.msg_length)
-                    self._log('Ommiting message with type %d.' % hdr.msg_type)
-                else:
-                    msg, _ = msg_class.unpack( self.__pop_data(hdr.msg_length) )
-                    self._messageReceived(hdr, msg)
-                finally:
-                    self.__chdr = None                  
-            else:
-                # we're waiting for a header
-                if len(self.__buffer) < PACKET_HEADER_LENGTH:
-                    # no header yet
-                    break
-
-                self.__chdr, _ = GaduPacketHeader.unpack(\
-                    self.__pop_data(PACKET_HEADER_LENGTH))
-                # continue normally
-
-        # end of data loop
-    
-    def _sendPacket(self, msg):
-        # wrap the packet with a transport header
-        self.transport.write( msg.as_packet() )
+                    self._messageReceived(event.header, event.packet)
+                except DECODE_ERRORS, e:
+                    if not event.packet.lazy_decode:
+                        raise
+                    # a lazy packet, broken in a field the handlers read
+                    self._log(skipped(event.header, e).reason)
+            elif isinstance(event, PacketChunk):
+                self.__routes[event.header.msg_type].stream(event.data, event.values)
+            elif isinstance(event, PacketSkipped):
+                self._log(event.reason)
+                if event.header.msg_type == ULReplyPacket.packet_id:
+                    # no more of this reply is coming
+                    self.import_dropped = False
+                    if self.importrq_cb:
+                        self._importFailed(ValueError(event.reason))
+            elif isinstance(event, ProtocolError):
+                self._log(event.reason)
+                self.transport.loseConnection()
+
+    def _sendPacket(self, msg, priority=PRIORITY_INTERACTIVE):
+        return self._sendData(self.session.send_packet(msg), priority)
+
+    def _sendTemplate(self, name, priority=PRIORITY_INTERACTIVE, **values):
+        # small control packets - packed from a precompiled template
+        return self._sendData(self.session.send_template(name, **values), priority)
+
+    def _sendData(self, data, priority=PRIORITY_INTERACTIVE):
+        """Queue the packed packets, returns their size"""
+        if self.capture is not None:
+            self.capture.sent(data)
+        self.__scheduler.send(data, priority)
+        return len(data)
+
+    def flushPackets(self):
+        """Write the queued packets now, if the transport takes them"""
+        self.__scheduler.flush()
+
+    def sendQueueDepth(self):
+        """Number of queued outgoing packets, by priority name"""
+        return dict( (name, self.__scheduler.depth(priority)) \
+            for (priority, name) in enumerate(PRIORITY_NAMES) )
+
+    def _routes(self):
+        """The dispatch table - a PacketRoute for every incoming packet id"""
+        routes = {}
+        for (id, klass) in Resolver.incoming():
+            name = klass.__name__
+            stream = None
+            if klass.stream_decode:
+                stream = getattr(self, '_stream' + name, None)
+            routes[id] = PacketRoute(klass, getattr(self, '_handle' + name, self._log), stream)
+        return routes
+
+    def _route(self, packet):
+        if isinstance(packet, basestring):
+            packet = Resolver.by_name(packet)
+        return self.__routes[packet.packet_id]
+
+    def subscribe(self, packet, callback):
+        """Call callback(msg) with every received packet of the class (or
+            class name) packet, before it is handled"""
+        self._route(packet).subscribers.append(callback)
+
+    def unsubscribe(self, packet, callback):
+        self._route(packet).subscribers.remove(callback)
 
     def _messageReceived(self, hdr, msg):
-        """Called when a full GG message has been received"""        
-        self._log("Calling action: " + msg.__class__.__name__)
-        getattr(self, '_handle' + msg.__class__.__name__, self._log)(msg)
+        """Called when a full GG message has been received"""
+        route = self.__routes[hdr.msg_type]
+        for callback in route.subscribers:
+            callback(msg)
+        route.handler(msg)
 
     # handlers
     def _handleWelcomePacket(self, msg):
         self._log("Welcome seed is: " + str(msg.seed))
-        self.__seed = msg.seed
-        self.doLogin.callback(self.__seed)
+        self.doLogin.callback(msg.seed)
         
     def _doLogin(self, result, *args, **kwargs):
         self._log("Sending creditials to the server.")
-        login_klass = Resolver.by_name('LoginPacket')
-        result[1].update( struct.pack("<i", self.__seed) )
-        login = login_klass(uin=result[0], login_hash=result[1].digest(), status=result[2])
-        self._sendPacket(login)
+        self._sendData(self.session.send_login(*result), PRIORITY_CONTROL)
         return True
 
     def _onLoginFailed(self, failure, *args, **kwargs):
@@ -121,7 +349,8 @@ class GaduClient(Protocol):
     def _handleLoginOKPacket(self, msg):
         print 'Login almost done - send the notify list.'
         self.__pingThread = task.LoopingCall(self.sendPing)
-        self.__pingThread.start(180.0)
+        self.__pingThread.clock = self.clock
+        self.__pingThread.start(self.session.ping_interval)
         self.loginSuccess.callback(self)
 
     def _handleLoginFailedPacket(self, msg):
@@ -165,174 +394,174 @@ class GaduClient(Protocol):
         #self.loseConnection()
 
     def _sendAllContacts(self, result, *args, **kwargs):
-        contacts = list( self.user_profile.contacts )
-
-        if len(contacts) == 0:
-            self._sendPacket( Resolver.by_name('NoNoticesPacket')() )
-            return self
+        # the roster may change while it's uploaded - new contacts get
+        # their own AddNotice then
+        self.sendNotifyList(list(self.user_profile.contacts))
+        return self
 
-        nl_class = Resolver.by_name('NoticeLastPacket')
-        nf_class = Resolver.by_name('NoticeFirstPacket')
+    def sendNotifyList(self, contacts):
+        """Upload the notify list - NoticeFirst packets with notice_chunk_size
+            contacts each and the final NoticeLast, or NoNotices if there
+            are no contacts. Chunks are packed by a cooperative task, while
+            the previous ones are written, so long lists don't block the
+            reactor. Returns a Deferred fired with a NoticeUpload, when all
+            chunks are queued."""
+        return self._uploadNotices(contacts, NoticeUpload(), True)
+
+    def addNewContacts(self, contacts):
+        """Like addNewContact() for all of the contacts, but only the ones
+            the server doesn't know are sent, batched like the notify list.
+            Returns a Deferred fired with a NoticeUpload."""
+        upload = NoticeUpload(requested=len(contacts))
+        new, uins = [], set(self.notified_uins)
+        for contact in contacts:
+            if contact.uin not in uins:
+                uins.add(contact.uin)
+                new.append(contact)
+        return self._uploadNotices(new, upload, False)
+
+    def _uploadNotices(self, contacts, upload, initial):
+        cooperative = self.cooperator.cooperate(self._noticeChunks(iter(contacts), upload, initial))
+        self.__noticeTasks.add(cooperative)
+
+        def finished(result):
+            self.__noticeTasks.discard(cooperative)
+            return result
+
+        d = cooperative.whenDone()
+        d.addBoth(finished)
+        d.addCallback(lambda _: upload)
+        d.addCallback(self._noticesSent)
+        d.addErrback(lambda failure: failure.trap(task.TaskStopped))
+        d.addErrback(self._log_failure)
+        return d
+
+    def _noticeChunks(self, contacts, upload, initial):
+        size = self.notice_chunk_size
+
+        def take():
+            return [contact.uin for contact in itertools.islice(contacts, size)]
+
+        def send(uins, last):
+            upload.add(len(uins), self._sendData(self.session.send_notices(uins, last), PRIORITY_BULK))
+            self.notified_uins.update(uins)
+
+        chunk = take()
+        if not chunk:
+            if initial:
+                upload.add(0, self._sendData(self.session.send_notices(chunk), PRIORITY_BULK))
+            return
 
-        while len(contacts) > 400:
-            batch, contacts = constacts[:400], contacts[400:]
-            self._sendPacket( nf_class(contacts= \
-                [StructNotice(uin=uin) for (uin, _) in batch]) )
+        while True:
+            following = take()
+            if not following:
+                break
+            send(chunk, False)
+            chunk = following
+            # don't pile the list up, while the transport is paused
+            scheduler = self.__scheduler
+            if scheduler.queued_bytes(PRIORITY_BULK) >= scheduler.chunk_size:
+                yield scheduler.drained(PRIORITY_BULK)
+            else:
+                yield None
+        send(chunk, True)
 
-#        self._sendPacket( nl_class(contacts= \
-#                [StructNotice(uin=uin) for (uin, _) in contacts]) )
-        self._sendPacket( nl_class(contacts= \
-                [StructNotice(uin=contacts[i].uin) for i in range(len(contacts))]) )
-        self._log("Sent all contacts.")
-        return self
+    def _noticesSent(self, upload):
+        self._log("Sent notices: %s." % upload)
+        return upload
 
     def exportContactsList(self, xml):
-        klass = Resolver.by_name('ULRequestPacket')
-        #i = 0
-        
-        #while len(xml) != 0:
-        #    i = i +1
-        #    batch, xml = xml[:2048], xml[2048:]
-        #    if(i == 1):
-        #        type = ULRequestPacket.TYPE.PUT
-        #    else:
-        #        type = ULRequestPacket.TYPE.PUT_MORE
-        #    self._sendPacket(klass(type = type, data = batch))
-        
         self.clistversion = self.clistversion+1
         
-        self._sendPacket(klass(type = ULRequestPacket.TYPE.PUT, version = self.clistversion, data = xml))
+        self._sendData(self.session.send_userlist_put(self.clistversion, xml), PRIORITY_BULK)
         self._log("All contacts exported.")
 
     def sendPing(self):
         print '[PING]'
         if self.firstPing != True:
-            self._sendPacket( Resolver.by_name('PingPacket')() )
+            self._sendData(self.session.send_ping(), PRIORITY_CONTROL)
         self.firstPing = False
 
     def sendMsgAck(self, num):
-        klass = Resolver.by_name('RecvMsgAck')
-        ack = klass(num=num)
-        self._sendPacket(ack)
+        self._sendData(self.session.send_msg_ack(num), PRIORITY_CONTROL)
 
     def sendHTMLMessage(self, rcpt, html_text, plain_message):
-        klass = Resolver.by_name('MessageOutPacket')
-
-        attrs = StructMsgAttrs()
-        attrs.richtext = StructRichText()
-
-        payload = StructMessage(klass=StructMessage.CLASS.CHAT, \
-            html_message=html_text, plain_message=plain_message, \
-            attrs = attrs)
-
-        self._sendPacket( klass( recipient=rcpt, seq=int(time.time()), content=payload) )
+        self._sendData(self.session.send_message(rcpt, int(time.time()), html_text, plain_message))
 
     def sendTypingNotify(self, uin, type):
-        klass = Resolver.by_name('TypingNotifyPacket')
-        self._sendPacket(klass(uin=uin, type=type))
+        self._sendData(self.session.send_typing_notify(uin, type))
 
     def sendConfMessage(self, rcpt, html_text, plain_message, contacts):
-        klass = Resolver.by_name('MessageOutPacket')
-
-        attrs = StructMsgAttrs()
-        attrs.richtext = StructRichText()
-
-        #contacts_len = len(contacts)
-        contacts = map(int, contacts)
-        konference = StructConference(recipients=contacts)
-
-        attrs.conference = konference
-
-        payload = StructMessage(klass=StructMessage.CLASS.CHAT, \
-            html_message=html_text, plain_message=plain_message, \
-            attrs = attrs)
-
-        self._sendPacket( klass( recipient=rcpt, seq=int(time.time()), content=payload) )
+        self._sendData(self.session.send_message(rcpt, int(time.time()), \
+            html_text, plain_message, contacts))
 
     def sendImportRequest(self, callback):
+        """Ask for the contact list stored on the server. callback is called
+            with the contact book as an ElementTree Element - the compressed
+            list is inflated and parsed while it arrives. A broken list is
+            logged instead and callback isn't called."""
         if self.importrq_cb is not None:
             raise RuntimeError("There can be only one import request pending.")
 
         self.importrq_cb = Deferred()
         self.importrq_cb.addCallbacks(lambda result, *args, **kwargs: callback(result), self._log_failure)
         self.importrq_cb.addErrback(self._log_failure)
-        self.import_buf = ''
-        
-        klass = Resolver.by_name('ULRequestPacket')
-        self._sendPacket( klass(type=klass.TYPE.GET, data='') )
+        # the compressed list is parsed while it arrives
+        self.import_inflater = zlib.decompressobj()
+        self.import_parser = ET.XMLParser()
+        self._sendData(self.session.send_userlist_get(), PRIORITY_BULK)
 
     def addNewContact(self, contact):
-        add_class = Resolver.by_name('AddNoticePacket')
-
-        self._sendPacket( add_class(contact= \
-                StructNotice(uin=contact.uin)) )
+        self._sendData(self.session.send_add_notice(contact.uin), PRIORITY_BULK)
+        self.notified_uins.add(contact.uin)
         self._log("New contact %s added." % contact.uin)
         return self
     
     def delContact(self, contact):
-        add_class = Resolver.by_name('RemoveNoticePacket')
-
-        self._sendPacket( add_class(contact= \
-                StructNotice(uin=contact.uin)) )
+        self._sendData(self.session.send_remove_notice(contact.uin), PRIORITY_BULK)
+        self.notified_uins.discard(contact.uin)
         self._log("Contact %s removed." % contact.uin)
         return self
 
     def changeStatus(self, status, desc=''):
-        change_status_class = Resolver.by_name('ChangeStatusPacket')
-
-        if status == 'NOT_AVAILABLE':
-            if desc == '' or desc == None:
-                gg_status = change_status_class.STATUS.NOT_AVAILABLE
-            else:
-                gg_status = change_status_class.STATUS.NOT_AVAILABLE_DESC
-        elif status == 'FFC':
-            if desc == '' or desc == None:
-                gg_status = change_status_class.STATUS.FFC
-            else:
-                gg_status = change_status_class.STATUS.FFC_DESC
-        elif status == 'AVAILABLE':
-            if desc == '' or desc == None:
-                gg_status = change_status_class.STATUS.AVAILABLE
-            else:
-                gg_status = change_status_class.STATUS.AVAILABLE_DESC
-        elif status == 'BUSY':
-            if desc == '' or desc == None:
-                gg_status = change_status_class.STATUS.BUSY
-            else:
-                gg_status = change_status_class.STATUS.BUSY_DESC
-        elif status == 'DND':
-            if desc == '' or desc == None:
-                gg_status = change_status_class.STATUS.DND
-            else:
-                gg_status = change_status_class.STATUS.DND_DESC
-        elif status == 'HIDDEN':
-            if desc == '' or desc == None:
-                gg_status = change_status_class.STATUS.HIDDEN
-            else:
-                gg_status = change_status_class.STATUS.HIDDEN_DESC
-        else:
-            gg_status = change_status_class.STATUS.NOT_AVAILABLE
-
-        if desc == '' or desc == None:
-            self._sendPacket( change_status_class(status=gg_status, flags=0x00000001) )
-        else:
-            desc_len = len(desc)
-            self._sendPacket( change_status_class(status=gg_status, flags=0x00000001, description_size=desc_len, description=desc) )
+        self._sendData(self.session.send_status(status, desc or ''))
         self._log("Status changed")
         return True
 
+    def _streamULReplyPacket(self, chunk, values):
+        if values['type'] == 0x00 and self.importrq_cb:
+            try:
+                self.import_parser.feed( self.import_inflater.decompress(chunk) )
+            except (zlib.error, ET.ParseError):
+                self.import_dropped = True
+                self._importFailed()
+
+    def _importFailed(self, error=None):
+        # without the error, called in an except clause - errback()
+        # takes the exception
+        cb = self.importrq_cb
+        self.importrq_cb = self.import_inflater = self.import_parser = None
+        cb.errback(error)
+
     def _handleULReplyPacket(self, msg):
         if msg.type == 0x00:
             if not self.importrq_cb:
-                self._warn("Unexpected UL_GET reply")
+                if not self.import_dropped:
+                    self._warn("Unexpected UL_GET reply")
+                self.import_dropped = False
                 return
 
-            self.import_buf = msg.data
+            self.clistversion = msg.version
+            try:
+                self.import_parser.feed( self.import_inflater.flush() )
+                book = self.import_parser.close()
+            except (zlib.error, ET.ParseError):
+                self._importFailed()
+                return
 
             cb = self.importrq_cb
-            self.importrq_cb = None
-            self.clistversion = msg.version
-            cb.callback(self.import_buf)
+            self.importrq_cb = self.import_inflater = self.import_parser = None
+            cb.callback(book)
         elif msg.type == 0x10:
             self.clistversion = msg.version
         elif msg.type == 0x12:
@@ -345,7 +574,7 @@ class GaduClient(Protocol):
     #
 
     def _warn(self, obj):
-        tlog.warning( str(obj) )
+        tlog.msg( str(obj), logLevel=logging.WARNING )
 
     def _log(self, obj):
         tlog.msg( str(obj) )